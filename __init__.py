@@ -26,12 +26,15 @@
 # NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import json
 import os
+import shutil
 
-from random import randint
-from threading import Event
-from time import sleep
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor, wait
+from random import randint, uniform
+from threading import Event, Lock, Thread, Timer
+from time import sleep, time
+from typing import Callable, Dict, List, Optional, Tuple
 from neon_utils.validator_utils import numeric_confirmation_validator
 from ovos_bus_client.message import dig_for_message, Message
 from ovos_utils import classproperty
@@ -43,6 +46,23 @@ from neon_utils.user_utils import get_user_prefs
 from ovos_workshop.decorators import intent_handler
 from ovos_workshop.intents import IntentBuilder
 
+from .bus_utils import LatencyTracker, hedged_request, sequential_request, \
+    timed_request
+from .image_cache import ImageCache, get_image_validator
+from .os_media import BlockMap, MediaWriteError, download_image, \
+    download_segmented, fetch_block_map, fetch_digest, get_block_map_names, \
+    get_compression_suffix, set_background_priority, stream_image_to_device, \
+    strip_compression, verify_device, write_image_to_device
+from .peer_cache import PeerCache, find_peers
+from .update_checks import CheckCache, OSUpdateCheck, RolloutGate, \
+    SingleFlight, get_squashfs_url
+from .update_journal import UpdateJournal
+from .update_mirror import DEFAULT_UPSTREAMS, MirrorSelector, UpdateMirror, \
+    get_mirror_url
+from .update_schedule import ACTIVITY_EVENTS, CheckScheduler, IdleScheduler, \
+    get_device_id
+from .update_state import UpdateState, UpdateStateMachine
+
 
 class UpdateSkill(NeonSkill):
     def __init__(self, **kwargs):
@@ -50,11 +70,41 @@ class UpdateSkill(NeonSkill):
         self._current_ver = None
         self.latest_ver = None
         self._update_filename = "update_signal"
+        self._update_journal = UpdateJournal(
+            os.path.join(self.file_system.path, "update_journal.jsonl"))
+        self._update_txn: Optional[str] = None
+        self._prestage = dict()
+        self._prestage_lock = Lock()
+        self._idle_scheduler = IdleScheduler()
+        self._check_scheduler = CheckScheduler(get_device_id(), 0)
+        self._rollout_gate = RolloutGate(get_device_id())
+        self._check_timer: Optional[Timer] = None
+        self._metadata_filename = "update_metadata.json"
+        self._metadata_lock = Lock()
         self._os_updates_supported = None
         self._default_prerelease = None
-        self._updating = False
+        self._update_state = UpdateStateMachine()
+        self._check_results = dict()
+        self._last_update_result = None
+        self._update_worker: Optional[Thread] = None
         self._download_completed = Event()
+        self._download_activity = Event()
+        self._download_progress = dict()
+        self._media_image_file: Optional[str] = None
+        self._media_bmap: Optional[BlockMap] = None
+        self._media_progress_time = 0
+        self._image_cache = ImageCache(
+            os.path.join(self.file_system.path, "images"), 0)
+        self._peer_cache: Optional[PeerCache] = None
+        self._update_mirror: Optional[UpdateMirror] = None
+        self._mirror_selector = MirrorSelector()
         self._download_check_interval = 300
+        self._download_heartbeat_timeout = 15
+        self._os_check_timeout = 10
+        self._check_cache = CheckCache(ttl=0)
+        self._check_flights = SingleFlight()
+        self._endpoint_stats = LatencyTracker(
+            os.path.join(self.file_system.path, "latency.json"))
         self.add_event('mycroft.ready', self._on_ready)
         self.add_event("update.gui.continue_installation",
                        self.continue_os_installation)
@@ -62,6 +112,9 @@ class UpdateSkill(NeonSkill):
                        self.finish_os_installation)
         self.add_event("update.gui.install_update",
                        self.handle_update_device)
+        self.add_event("neon.update.get_state", self.handle_get_state)
+        for msg_type in ACTIVITY_EVENTS:
+            self.add_event(msg_type, self._idle_scheduler.on_activity)
 
     @classproperty
     def runtime_requirements(self):
@@ -79,18 +132,16 @@ class UpdateSkill(NeonSkill):
     def current_ver(self) -> str:
         if not self._current_ver:
             message = (dig_for_message() or Message(""))
+            requests = [message.forward("neon.core_updater.get_version")]
             if self.os_updates_supported:
-                resp = self.bus.wait_for_response(message.forward(
-                    "neon.device_updater.get_build_info"), timeout=15)
-                if resp:
-                    self._current_ver = resp.data.get("build_version") or \
-                        resp.data.get("core", {}).get("version")
-                    LOG.info(f"Got build version: {self._current_ver}")
-                    return self._current_ver
-            resp = self.bus.wait_for_response(message.forward(
-                "neon.core_updater.get_version"), timeout=15)
+                requests.insert(0, message.forward(
+                    "neon.device_updater.get_build_info"))
+            resp = self._request_version_info(
+                requests, lambda m: bool(self._parse_installed_version(m)))
             if resp:
-                self._current_ver = resp.data.get("version")
+                self._current_ver = self._parse_installed_version(resp)
+                LOG.info(f"Got installed version: {self._current_ver} "
+                         f"({resp.msg_type})")
         if not self._current_ver:
             LOG.error("Installed core version unknown!")
         return self._current_ver
@@ -99,6 +150,30 @@ class UpdateSkill(NeonSkill):
     def current_ver(self, val: str):
         self._current_ver = val
 
+    @staticmethod
+    def _parse_installed_version(response: Message) -> Optional[str]:
+        """
+        Get the installed version from a `neon.device_updater.get_build_info`
+        or `neon.core_updater.get_version` response.
+        """
+        return response.data.get("build_version") or \
+            response.data.get("core", {}).get("version") or \
+            response.data.get("version")
+
+    @property
+    def _updating(self) -> bool:
+        """
+        Returns True if an update check or update is in progress.
+        """
+        return self._update_state.busy
+
+    @_updating.setter
+    def _updating(self, val: bool):
+        if not val:
+            self._update_state.reset(UpdateState.IDLE)
+        elif not self._update_state.busy:
+            self._update_state.reset(UpdateState.CONFIRMED)
+
     @property
     def default_prerelease(self) -> bool:
         """
@@ -194,13 +269,83 @@ class UpdateSkill(NeonSkill):
         """
         self.settings['include_prerelease'] = value
         self.settings.store()
+        self._check_cache.invalidate()
+
+    @property
+    def update_track(self) -> str:
+        """
+        Returns the OS update track to check (`dev` or `master`)
+        """
+        return "dev" if self.include_prerelease else "master"
+
+    @property
+    def check_cache_ttl(self) -> float:
+        """
+        Returns the number of seconds update check results are reused for.
+        """
+        return float(self.settings.get("update_check_ttl", 900))
+
+    @property
+    def check_interval(self) -> float:
+        """
+        Returns the number of seconds between periodic update checks, or 0 to
+        only check on startup.
+        """
+        return float(self.settings.get("update_check_interval", 0))
 
     @property
     def image_url(self) -> Optional[str]:
         """
-        Return a configured URL to download a clean OS image from.
+        Return a configured URL to download a clean OS image from, on the
+        `update_mirror_url` mirror if one is configured.
+        """
+        return get_mirror_url(self.settings.get("image_url"),
+                              self.update_mirror_url, self.mirror_upstreams)
+
+    @property
+    def image_mirrors(self) -> List[str]:
+        """
+        Returns URLs of the same image as `image_url` to download from if
+        they are faster or if `image_url` is unavailable.
+        """
+        return [get_mirror_url(url, self.update_mirror_url,
+                               self.mirror_upstreams)
+                for url in self.settings.get("image_mirrors") or []]
+
+    @property
+    def update_sources(self) -> List[str]:
+        """
+        Returns the URLs of update sources, of which at least one must be
+        available to start a core update.
+        """
+        sources = list(self.settings.get("update_sources") or
+                       ["https://github.com"])
+        if self.update_mirror_url:
+            sources.insert(0, self.update_mirror_url)
+        return sources
+
+    @property
+    def update_mirror(self) -> bool:
+        """
+        Returns True if this device should serve a local mirror of update
+        artifacts for other devices.
+        """
+        return bool(self.settings.get("update_mirror", False))
+
+    @property
+    def update_mirror_url(self) -> Optional[str]:
+        """
+        Returns the base URL of a local update mirror to use, if configured.
+        """
+        return self.settings.get("update_mirror_url") or None
+
+    @property
+    def mirror_upstreams(self) -> Dict[str, str]:
+        """
+        Returns a dict of mirror path names to the upstream base URLs they
+        mirror.
         """
-        return self.settings.get("image_url")
+        return self.settings.get("mirror_upstreams") or DEFAULT_UPSTREAMS
 
     @property
     def image_drive(self) -> str:
@@ -210,26 +355,333 @@ class UpdateSkill(NeonSkill):
         """
         return self.settings.get("image_drive") or "/dev/sdb"
 
+    @property
+    def stream_image_write(self) -> bool:
+        """
+        Returns True if new boot media should be written while the OS image
+        downloads instead of after the download completes.
+        """
+        return bool(self.settings.get("stream_image_write", False))
+
+    @property
+    def sparse_image_write(self) -> bool:
+        """
+        Returns True if new boot media should be written by this skill using a
+        block map, so that only blocks containing data are written.
+        """
+        return bool(self.settings.get("sparse_image_write", False))
+
+    @property
+    def verify_image_download(self) -> bool:
+        """
+        Returns True if this skill should download OS images itself so that
+        they can be verified as they are received.
+        """
+        return bool(self.settings.get("verify_image_download", False))
+
+    @property
+    def verify_image_write(self) -> bool:
+        """
+        Returns True if new boot media should be read back and compared with
+        the downloaded image before reporting that installation is complete.
+        """
+        return bool(self.settings.get("verify_image_write", False))
+
+    @property
+    def image_cache_size(self) -> int:
+        """
+        Returns the maximum number of bytes of downloaded OS images to keep
+        for reuse, from the `image_cache_mb` setting. 0 disables caching.
+        """
+        return int(float(self.settings.get("image_cache_mb", 0)) * 1024 * 1024)
+
+    @property
+    def download_connections(self) -> int:
+        """
+        Returns the number of concurrent range requests to download OS images
+        with. More than 1 enables resumable segmented downloads.
+        """
+        return int(self.settings.get("download_connections", 1))
+
+    @property
+    def background_priority(self) -> bool:
+        """
+        Returns True if downloads, writes, and verification run by this skill
+        should use reduced CPU and I/O priority.
+        """
+        return bool(self.settings.get("background_priority", False))
+
+    @property
+    def max_download_rate(self) -> Optional[float]:
+        """
+        Returns the maximum bytes/s for downloads run by this skill, from the
+        `max_download_rate_mb` setting, or None for no limit.
+        """
+        rate = float(self.settings.get("max_download_rate_mb", 0))
+        return rate * 1024 * 1024 if rate > 0 else None
+
+    @property
+    def prestage_rate(self) -> float:
+        """
+        Returns the maximum bytes/s for background squashfs pre-stage
+        downloads, from the `prestage_rate_mb` setting (default 2), and no
+        more than `max_download_rate`.
+        """
+        rate = float(self.settings.get("prestage_rate_mb", 2)) * 1024 * 1024
+        if rate <= 0:
+            rate = 2 * 1024 * 1024
+        return min(rate, self.max_download_rate or rate)
+
+    @property
+    def peer_cache(self) -> bool:
+        """
+        Returns True if OS images should be fetched from and shared with other
+        devices on the local network.
+        """
+        return bool(self.settings.get("peer_cache", False))
+
+    @property
+    def peer_cache_size(self) -> int:
+        """
+        Returns the maximum number of bytes of downloaded payloads to keep for
+        other devices, from the `peer_cache_mb` setting.
+        """
+        return int(float(self.settings.get("peer_cache_mb", 4096)) *
+                   1024 * 1024)
+
+    @property
+    def peer_addresses(self) -> List[Tuple[str, int]]:
+        """
+        Returns the (host, port) addresses to query for peers with a payload,
+        from the `peer_addresses` setting. Defaults to a broadcast on the
+        `peer_discovery_port`.
+        """
+        default_port = int(self.settings.get("peer_discovery_port", 31850))
+        addresses = list()
+        for address in self.settings.get("peer_addresses") or \
+                [f"255.255.255.255:{default_port}"]:
+            host, _, port = address.partition(':')
+            addresses.append((host, int(port or default_port)))
+        return addresses
+
+    @property
+    def _download_images(self) -> bool:
+        """
+        Returns True if OS images should be downloaded by this skill instead of
+        by the device updater plugin.
+        """
+        return self.verify_image_download or bool(self.image_cache_size) or \
+            self.download_connections > 1 or self.peer_cache
+
+    @property
+    def prestage_updates(self) -> bool:
+        """
+        Returns True if squashfs updates should be downloaded in the background
+        as soon as they are found, before the user confirms the update.
+        """
+        return bool(self.settings.get("prestage_updates", False))
+
+    @property
+    def squashfs_download_dir(self) -> str:
+        """
+        Returns the directory the device updater plugin saves squashfs
+        downloads to, where confirmed pre-staged updates are moved.
+        """
+        return self.settings.get("squashfs_download_dir") or "/opt/neon"
+
+    @property
+    def idle_updates(self) -> bool:
+        """
+        Returns True if background update checks and pre-staging should wait
+        for the device to be idle.
+        """
+        return bool(self.settings.get("idle_updates", False))
+
+    @property
+    def idle_seconds(self) -> float:
+        """
+        Returns the number of seconds without voice interaction before the
+        device is considered idle.
+        """
+        return float(self.settings.get("idle_seconds", 120))
+
+    @property
+    def quiet_hours(self) -> Optional[Tuple[int, int]]:
+        """
+        Returns the (start, end) local hours that background update work is
+        limited to, if configured.
+        """
+        hours = self.settings.get("quiet_hours")
+        return (int(hours[0]), int(hours[1])) if hours else None
+
+    @property
+    def hedge_requests(self) -> bool:
+        """
+        Returns True if device and core updater version requests should be
+        sent concurrently instead of falling back after a timeout.
+        """
+        return bool(self.settings.get("hedge_requests", False))
+
+    @property
+    def hedge_grace(self) -> float:
+        """
+        Returns the number of seconds to wait for a higher priority response
+        after a valid hedged response is received.
+        """
+        return float(self.settings.get("hedge_grace", 0.5))
+
+    @property
+    def adaptive_timeouts(self) -> bool:
+        """
+        Returns True if request timeouts should be derived from observed
+        updater response latency.
+        """
+        return bool(self.settings.get("adaptive_timeouts", True))
+
+    @property
+    def endpoint_stats(self) -> dict:
+        """
+        Returns response latency statistics for each updater request type.
+        """
+        return self._endpoint_stats.get()
+
+    @property
+    def background_startup(self) -> bool:
+        """
+        Returns True if startup update checks should run in a background
+        thread instead of the `mycroft.ready` handler.
+        """
+        return bool(self.settings.get("background_startup", False))
+
+    @property
+    def startup_delay(self) -> float:
+        """
+        Returns the maximum number of seconds to randomly delay background
+        startup checks by.
+        """
+        return float(self.settings.get("startup_delay", 30))
+
     def _on_ready(self, message):
-        meta = None
-        if self.check_squashfs:
-            meta = self._check_squashfs_update(message)
-        if isinstance(meta, dict) and self.notify_updates:
-            version = meta.get("build_version") or \
-                      meta.get("core", {}).get("version", "")
-            text = self.dialog_renderer.render("notify_os_update_available",
-                                               {"version": version})
-            LOG.info(f"OS Update Available: {meta['build_version']}")
-            callback_data = {**message.data, **{"notification": text}}
-            self.gui.show_notification(text,
-                                       action="update.gui.install_update",
-                                       callback_data=callback_data)
-        elif self.check_python:
-            LOG.debug("Checking latest core version")
-            self._check_latest_release(message)
+        if self.background_startup:
+            delay = uniform(0, self.startup_delay)
+            LOG.info(f"Running startup checks in {delay}s")
+            Thread(target=self._handle_startup, args=(message, delay),
+                   daemon=True).start()
+        else:
+            self._handle_startup(message)
+
+    def _handle_startup(self, message, delay: float = 0):
+        """
+        Check for available updates and report the status of any update that
+        was applied before this startup.
+        @param message: `mycroft.ready` Message
+        @param delay: seconds to wait before checking
+        """
+        if delay:
+            sleep(delay)
+        saved = self._load_update_metadata()
+        if saved:
+            for component, data in saved["checks"].items():
+                self._record_check_result(saved["track"], component, data,
+                                          saved["checked"])
+            # Serve the last known result now and revalidate in the background
+            LOG.info(f"Using update metadata checked at {saved['checked']}")
+            text = self._render_update_notification(saved["checks"])
+            if text and self.notify_updates:
+                self._show_update_notification(message, text)
+            if self.check_interval and \
+                    time() - saved["checked"] < self.check_interval:
+                LOG.info("Saved update metadata is current, waiting for "
+                         "the next periodic check")
+            else:
+                Thread(target=self._refresh_update_metadata,
+                       args=(message, text), daemon=True).start()
+        else:
+            if self.background_startup:
+                self._wait_for_idle("startup update check")
+            self._check_startup_updates(message)
+
+        self._report_update_status()
+        # Don't block the `mycroft.ready` handler waiting for a response
+        Thread(target=self._offer_interrupted_updates, args=(message,),
+               daemon=True).start()
+        self._start_periodic_checks()
+        if self.peer_cache:
+            self._get_peer_cache()
+        if self.update_mirror:
+            self._start_update_mirror()
+
+    def _start_periodic_checks(self):
+        """
+        Schedule the first periodic update check if `update_check_interval` is
+        set. The first check is at a random point in the first interval so
+        that devices started at the same time do not check together.
+        """
+        if not self.check_interval:
+            return
+        self._check_scheduler.interval = self.check_interval
+        self._schedule_periodic_check(self._check_scheduler.first_delay())
 
+    def _schedule_periodic_check(self, delay: float):
+        """
+        Schedule the next periodic update check, replacing any scheduled check.
+        @param delay: seconds to wait before checking
+        """
+        if self._check_timer:
+            self._check_timer.cancel()
+        LOG.info(f"Next update check in {delay}s")
+        self._check_timer = Timer(delay, self._run_periodic_check)
+        self._check_timer.daemon = True
+        self._check_timer.start()
+
+    def _run_periodic_check(self):
+        """
+        Check for updates, notifying only if the result has changed, and
+        schedule the next check. Failed checks are retried with backoff.
+        """
+        self._check_scheduler.interval = self.check_interval
+        if not self._check_scheduler.interval:
+            LOG.info("Periodic update checks disabled")
+            return
+        start = time()
+        if self._update_state.busy:
+            LOG.debug("Skipping periodic check during an update")
+            success = True
+        else:
+            saved = self._load_update_metadata()
+            text = self._render_update_notification(saved["checks"]) \
+                if saved else None
+            # Periodic checks must reach the updaters to be counted
+            self._check_cache.invalidate(track=self.update_track)
+            self._refresh_update_metadata(
+                Message("neon.update.periodic_check"), text)
+            success = not (self.check_squashfs or self.check_python) or \
+                any(result["checked"] >= start
+                    for results in self._check_results.values()
+                    for result in results.values())
+        if not success:
+            LOG.warning(f"Periodic update check failed "
+                        f"({self._check_scheduler.failures + 1} in a row)")
+        self._schedule_periodic_check(
+            self._check_scheduler.next_delay(success))
+
+    def shutdown(self):
+        if self._check_timer:
+            self._check_timer.cancel()
+        if self._peer_cache:
+            self._peer_cache.stop()
+        if self._update_mirror:
+            self._update_mirror.stop()
+        NeonSkill.shutdown(self)
+
+    def _report_update_status(self):
+        """
+        Speak the result of an update that was applied before this startup.
+        """
         update_stat = self._check_update_status()
         LOG.debug(f"Update status is {update_stat}")
+        if update_stat is not None:
+            self._set_update_result(update_stat)
         if not update_stat:
             # No update was attempted
             return
@@ -247,43 +699,282 @@ class UpdateSkill(NeonSkill):
             self.speak_dialog("notify_update_failure",
                               {"version": speak_version})
 
+    def _check_startup_updates(self, message, notify: bool = True):
+        """
+        Check for available updates on startup.
+        @param message: Message associated with the check
+        @param notify: if True, show a notification for an available update
+        """
+        meta = None
+        if self.check_squashfs:
+            meta = self._check_squashfs_update(message)
+        if isinstance(meta, dict) and self.notify_updates:
+            version = meta.get("build_version") or \
+                      meta.get("core", {}).get("version", "")
+            LOG.info(f"OS Update Available: {version}")
+            if notify and self._in_rollout("squashfs", version,
+                                           meta.get("rollout")):
+                text = self.dialog_renderer.render(
+                    "notify_os_update_available", {"version": version})
+                self._show_update_notification(message, text)
+        elif self.check_python:
+            LOG.debug("Checking latest core version")
+            self._check_latest_release(
+                message if notify else message.forward("neon.update.refresh"))
+
+    def _refresh_update_metadata(self, message, known_text: Optional[str]):
+        """
+        Re-check for updates after notifying from saved metadata. A new
+        notification is shown only if the result has changed.
+        @param message: Message associated with the check
+        @param known_text: notification text shown from saved metadata
+        """
+        self._wait_for_idle("update metadata refresh")
+        self._check_startup_updates(message, notify=False)
+        saved = self._load_update_metadata()
+        text = self._render_update_notification(saved["checks"]) \
+            if saved else None
+        if text == known_text:
+            LOG.debug("Saved update metadata is current")
+            return
+        LOG.info(f"Update metadata changed: {text}")
+        if known_text:
+            self._dismiss_notification(message.forward(
+                message.msg_type, {"notification": known_text}))
+        if text and self.notify_updates:
+            self._show_update_notification(message, text)
+
+    def _render_update_notification(self, checks: dict) -> Optional[str]:
+        """
+        Render notification text for an update described by check responses.
+        @param checks: dict of component to check response data
+        @return: notification text if an update is available, else None
+        """
+        squashfs = checks.get("squashfs") or dict()
+        if self.check_squashfs and squashfs.get("update_available"):
+            meta = squashfs.get("update_metadata") or dict()
+            version = meta.get("build_version") or \
+                meta.get("core", {}).get("version", "")
+            if self._in_rollout("squashfs", version, meta.get("rollout")):
+                return self.dialog_renderer.render(
+                    "notify_os_update_available", {"version": version})
+        core = checks.get("core") or dict()
+        latest = core.get("latest_version") or core.get("new_version")
+        if self.check_python and latest and \
+                latest != core.get("installed_version") and \
+                self._in_rollout("core", latest, core.get("rollout")):
+            return self.dialog_renderer.render("notify_update_available",
+                                               {"version": latest})
+        return None
+
+    def _in_rollout(self, component: str, version: Optional[str],
+                    rollout) -> bool:
+        """
+        Check if this device is included in the staged rollout of an update.
+        This only limits automatic notifications and pre-staging; a user may
+        always request an available update.
+        @param component: component being updated (`core` or `squashfs`)
+        @param version: version being rolled out
+        @param rollout: `rollout` spec from the update metadata
+        @return: True if this device should act on the update now
+        """
+        if rollout is None:
+            return True
+        eligible = self._rollout_gate.is_eligible(component, str(version),
+                                                  rollout)
+        LOG.debug(f"Rollout of {component} {version} ({rollout}): "
+                  f"eligible={eligible}")
+        return eligible
+
+    def _show_update_notification(self, message, text: str):
+        """
+        Show a notification the user can interact with to start an update.
+        @param message: Message associated with the update check
+        @param text: notification text to display
+        """
+        callback_data = {**message.data, **{"notification": text}}
+        self.gui.show_notification(text, action="update.gui.install_update",
+                                   callback_data=callback_data)
+
+    def _load_update_metadata(self) -> Optional[dict]:
+        """
+        Load update check responses saved for the current update track.
+        @return: dict with `track`, `checked` time, and per-component `checks`
+        """
+        if not self.file_system.exists(self._metadata_filename):
+            return None
+        try:
+            with self.file_system.open(self._metadata_filename, 'r') as f:
+                saved = json.load(f)
+        except Exception as e:
+            LOG.error(f"Failed to load saved update metadata: {e}")
+            return None
+        if saved.get("track") != self.update_track or not saved.get("checks"):
+            return None
+        return saved
+
+    def _save_update_metadata(self, component: str, data: dict):
+        """
+        Save an update check response to be used after the next restart.
+        @param component: component that was checked
+        @param data: check response data
+        """
+        with self._metadata_lock:
+            saved = self._load_update_metadata() or \
+                {"track": self.update_track, "checks": dict()}
+            saved["checked"] = time()
+            saved["checks"][component] = data
+            try:
+                with self.file_system.open(self._metadata_filename, 'w+') as f:
+                    json.dump(saved, f)
+            except Exception as e:
+                LOG.error(f"Failed to save update metadata: {e}")
+
+    def _clear_update_metadata(self):
+        """
+        Remove saved update metadata after an update has been applied.
+        """
+        if self.file_system.exists(self._metadata_filename):
+            os.remove(os.path.join(self.file_system.path,
+                                   self._metadata_filename))
+
     def _check_latest_release(self, message):
         """
         Handles checking for a new release version
         :param message: message object associated with loaded emit
         """
-        response = None
-        if self.os_updates_supported:
-            response = self.bus.wait_for_response(message.forward(
-                "neon.device_updater.check_update",
-                {'include_prerelease': self.include_prerelease}), timeout=15)
-        response = response or self.bus.wait_for_response(
-            message.forward("neon.core_updater.check_update",
-                            {'include_prerelease': self.include_prerelease}),
-            timeout=15)
-        if response:
-            LOG.debug(f"Got response: {response.data}")
-            self.current_ver = response.data.get("installed_version")
-            self.latest_ver = response.data.get("latest_version") or \
-                response.data.get("new_version")
+        def _request_latest_release() -> Optional[dict]:
+            data = {'include_prerelease': self.include_prerelease}
+            requests = [message.forward("neon.core_updater.check_update",
+                                        data)]
+            if self.os_updates_supported:
+                requests.insert(0, message.forward(
+                    "neon.device_updater.check_update", data))
+            response = self._request_version_info(
+                requests, lambda m: bool(m.data.get("latest_version") or
+                                         m.data.get("new_version")))
+            return response.data if response else None
+
+        data = self._cached_check("core", _request_latest_release)
+        if data:
+            LOG.debug(f"Got response: {data}")
+            self.current_ver = data.get("installed_version")
+            self.latest_ver = data.get("latest_version") or \
+                data.get("new_version")
             if not self.latest_ver:
                 LOG.error(f"Expected string version and got none in response: "
-                          f"{response.data}")
+                          f"{data}")
             elif self.latest_ver != self.current_ver and \
                     self.notify_updates and \
-                    message.msg_type in ("mycroft.ready", "neon.update.check"):
+                    message.msg_type in ("mycroft.ready",
+                                         "neon.update.check") and \
+                    self._in_rollout("core", self.latest_ver,
+                                     data.get("rollout")):
                 text = self.dialog_renderer.render(
                     "notify_update_available",
                     {"version": self.latest_ver})
                 LOG.info("Update Available")
-                callback_data = {**message.data, **{"notification": text}}
-                self.gui.show_notification(text,
-                                           action="update.gui.install_update",
-                                           callback_data=callback_data)
+                self._show_update_notification(message, text)
 
         else:
             LOG.error("No response from updater plugin")
 
+    def _get_timeout(self, msg_type: str, default: float,
+                     long_running: bool = False) -> float:
+        """
+        Get a timeout for a request, based on observed p99 response latency
+        plus `timeout_margin` and limited to `timeout_floor` and
+        `timeout_ceiling` if adaptive timeouts are enabled.
+        @param msg_type: request message type
+        @param default: timeout to use without enough observed latency
+        @param long_running: if True, the request performs work that may take
+            much longer than previously observed, so the timeout may be
+            extended but is never less than `default`
+        @return: seconds to wait for a response
+        """
+        if not self.adaptive_timeouts:
+            return default
+        timeout = self._endpoint_stats.get_timeout(
+            msg_type, default,
+            floor=float(self.settings.get("timeout_floor", 2)),
+            ceiling=float(self.settings.get("timeout_ceiling", 120)),
+            margin=float(self.settings.get("timeout_margin", 2)))
+        return max(timeout, default) if long_running else timeout
+
+    def _request_version_info(self, requests: list,
+                              validator: Callable[[Message], bool]) -> \
+            Optional[Message]:
+        """
+        Request version information from updater plugins.
+        @param requests: request Messages in priority order
+        @param validator: returns True if a response is valid
+        @return: highest priority valid response, else any response received
+        """
+        timeouts = [self._get_timeout(request.msg_type, 15)
+                    for request in requests]
+        if self.hedge_requests and len(requests) > 1:
+            resp = hedged_request(self.bus, requests, max(timeouts), validator,
+                                  self.hedge_grace, self._endpoint_stats)
+        else:
+            resp = sequential_request(self.bus, requests, timeouts, validator,
+                                      self._endpoint_stats)
+        LOG.debug(f"Updater endpoint stats: {self.endpoint_stats}")
+        return resp
+
+    def _record_check_result(self, track: str, component: str, data: dict,
+                             checked: Optional[float] = None):
+        """
+        Keep a summary of the latest check response for reporting state.
+        @param track: update track the check was made for
+        @param component: component that was checked
+        @param data: check response data
+        @param checked: time of the check (default now)
+        """
+        if component == "core":
+            latest = data.get("latest_version") or data.get("new_version")
+            available = bool(latest) and \
+                latest != data.get("installed_version")
+        else:
+            meta = data.get("update_metadata") or dict()
+            latest = meta.get("build_version") or \
+                meta.get("core", {}).get("version")
+            available = bool(data.get("update_available"))
+        self._check_results.setdefault(track, dict())[component] = {
+            "checked": checked or time(), "update_available": available,
+            "latest_version": latest}
+
+    def _cached_check(self, component: str,
+                      request: Callable[[], Optional[dict]]) -> Optional[dict]:
+        """
+        Get an update check response for the current track, reusing a cached
+        response if one is still valid or waiting for an equivalent check that
+        is already in progress.
+        @param component: component being checked (core, initramfs, squashfs)
+        @param request: method to request response data if not cached
+        @return: response data, or None if the request was not answered
+        """
+        self._check_cache.ttl = self.check_cache_ttl
+        track = self.update_track
+        data = self._check_cache.get(track, component)
+        if data is not None:
+            LOG.debug(f"Using cached {component} check for {track}: "
+                      f"{self._check_cache.stats}")
+            return data
+
+        def _request():
+            resp_data = request()
+            if resp_data is not None:
+                self._record_check_result(track, component, resp_data)
+                self._check_cache.put(track, component, resp_data)
+                if component in ("core", "squashfs"):
+                    self._save_update_metadata(component, resp_data)
+            return resp_data
+
+        # Concurrent checks for the same track and component share a request
+        data = self._check_flights.do((track, component), _request)
+        LOG.debug(f"{component} check flights: {self._check_flights.stats}")
+        return data
+
     def pronounce_version(self, version: str):
         """
         Format a version spec into a speakable string
@@ -304,32 +995,42 @@ class UpdateSkill(NeonSkill):
     @intent_handler("update_device.intent")
     def handle_update_device(self, message):
         """
-        Handle a user request to check for updates.
+        Handle a user request to check for updates. Once an OS update is
+        confirmed, it continues in a worker thread and this handler returns.
         :param message: message object associated with request
         """
-        if self._updating:
+        if not self._update_state.start_check():
             LOG.warning("Requested update while already in-progress")
             self.speak_dialog("update_in_progress")
             return
+        try:
+            self._check_and_confirm_update(message)
+        finally:
+            self._update_state.transition(UpdateState.IDLE,
+                                          (UpdateState.CHECKING,))
+
+    def _check_and_confirm_update(self, message):
+        """
+        Check for updates and ask the user to confirm any available update.
+        :param message: message object associated with request
+        """
         # Explicitly enabled for initramfs checks that involve file downloads
         if get_user_prefs(message)['response_mode'].get('hesitation'):
             self.speak_dialog("check_updates")
-        initramfs_available = False
-        squashfs_available = False
         new_core_ver = None
         new_os_ver = None
+        os_check = self._check_os_updates(message)
+        initramfs_available = os_check.initramfs_available
+        squashfs_available = os_check.squashfs_available
         if self.check_initramfs:
-            initramfs_available = self._check_initramfs_update(message)
             LOG.info(f"initramfs_available={initramfs_available}")
         if self.check_squashfs:
-            meta = self._check_squashfs_update(message)
-            if isinstance(meta, dict):
+            if squashfs_available:
+                meta = os_check.squashfs_meta
                 # Core version since it matches old behavior and is more variable
                 new_core_ver = meta.get("core", {}).get("version", "")
                 new_os_ver = meta.get(
                     'build_version') or meta.get("image", {}).get("version", "")
-                squashfs_available = True
-
             LOG.info(f"squashfs_available={squashfs_available}")
 
         if initramfs_available or squashfs_available:
@@ -350,81 +1051,18 @@ class UpdateSkill(NeonSkill):
             else:
                 resp = self.ask_yesno("update_system")
             if resp == "yes":
-                self._updating = True
+                self._update_state.transition(UpdateState.CONFIRMED)
                 self.speak_dialog("starting_update", wait=True)
                 self.gui.show_controlled_notification(
                     self.resources.render_dialog("notify_downloading_update"))
-                track = "dev" if self.include_prerelease else "master"
-                if initramfs_available:
-                    LOG.info("Updating initramfs")
-                    # Force update since we already checked for updates
-                    resp = self.bus.wait_for_response(
-                        message.forward("neon.update_initramfs",
-                                        {"force_update": True,
-                                         "track": track}), timeout=60)
-                    if not resp:
-                        LOG.error(f"initramfs update timeout")
-                        self.speak_dialog("error_updating_os",
-                                          {"help": self.resources.render_dialog(
-                                              "help_support")})
-                        self.gui.remove_controlled_notification()
-                        self._updating = False
-                        return
-
-                    if resp.data.get("updated"):
-                        LOG.info("initramfs updated")
-                        self.speak_dialog("update_initramfs_success")
-                    elif resp.data.get("error"):
-                        LOG.warning(f"Error response: {resp.data}")
-                        self.speak_dialog("error_updating_os",
-                                          {"help": self.resources.render_dialog(
-                                              "help_support")})
-                        self.gui.remove_controlled_notification()
-                        self._updating = False
-                        return
-                    else:
-                        LOG.warning(f"Expected initramfs update: {resp.data}")
-
-                    if squashfs_available:
-                        self.speak_dialog("update_continuing")
-                    else:
-                        self._updating = False
-                        self.speak_dialog("up_to_date",
-                                          {"version": self.pronounce_version(
-                                              self.current_ver)})
-
-                if squashfs_available:
-                    self._download_completed.clear()
-                    LOG.info("Updating squashfs")
-                    self.add_event("neon.update_squashfs.response",
-                                   self._handle_download_completed, once=True)
-                    self.bus.emit(message.forward("neon.update_squashfs",
-                                                  {"track": track}))
-                    while not self._download_completed.wait(
-                            self._download_check_interval):
-                        download_state_resp = (
-                            self.bus.wait_for_response(message.forward(
-                                "neon.device_updater.get_download_status")))
-                        if download_state_resp and \
-                                download_state_resp.data.get("downloading"):
-                            LOG.debug("Still downloading")
-                        elif download_state_resp and not \
-                                download_state_resp.data.get("downloading"):
-                            LOG.info(f"No active download")
-                            sleep(1)  # pad to ensure completed event is handled
-                            if not self._download_completed.is_set():
-                                LOG.error(f"Download completion not handled!")
-                                self._handle_download_failure()
-                                return
-                        elif not download_state_resp:
-                            # This could also be an older version of the plugin
-                            LOG.error(f"No response from updater plugin")
-                            self._handle_download_failure()
-                            return
-                else:
-                    self.gui.remove_controlled_notification()
+                self._update_txn = None
+                self._update_worker = Thread(
+                    target=self._run_os_update, daemon=True,
+                    args=(message, initramfs_available, squashfs_available))
+                self._update_worker.start()
             else:
                 # User declined update
+                self._discard_prestaged_update()
                 self.speak_dialog("not_updating")
         elif self.check_python:
             # OS Updates not supported
@@ -435,6 +1073,366 @@ class UpdateSkill(NeonSkill):
                               {"version": self.pronounce_version(
                                   self.current_ver)})
 
+    def _run_os_update(self, message, initramfs_available: bool,
+                       squashfs_available: bool):
+        """
+        Apply a confirmed OS update. This runs in the update worker thread so
+        the intent handler is not blocked for the duration of the update.
+        :param message: message object associated with request
+        :param initramfs_available: True if an initramfs update is available
+        :param squashfs_available: True if a squashfs update is available
+        """
+        with self._idle_scheduler.work():
+            try:
+                self._apply_os_update(message, initramfs_available,
+                                      squashfs_available)
+            except Exception as e:
+                LOG.exception(f"OS update failed: {e}")
+                self.speak_dialog("error_updating_os",
+                                  {"help": self.resources.render_dialog(
+                                      "help_support")})
+                self.gui.remove_controlled_notification()
+                # Not busy anymore, so another update may be started
+                self._update_state.reset(UpdateState.FAILED)
+                self._set_update_result(False, str(e))
+                if self._update_txn:
+                    self._update_journal.finish(self._update_txn, "failed",
+                                                error=str(e))
+                    self._update_txn = None
+
+    def _apply_os_update(self, message, initramfs_available: bool,
+                         squashfs_available: bool):
+        """
+        Update initramfs and/or squashfs, waiting for a squashfs download to
+        complete.
+        :param message: message object associated with request
+        :param initramfs_available: True if an initramfs update is available
+        :param squashfs_available: True if a squashfs update is available
+        """
+        track = self.update_track
+        if initramfs_available:
+            self._update_state.transition(UpdateState.INITRAMFS)
+            LOG.info("Updating initramfs")
+            # Force update since we already checked for updates
+            resp = timed_request(
+                self.bus, message.forward("neon.update_initramfs",
+                                          {"force_update": True,
+                                           "track": track}),
+                self._get_timeout("neon.update_initramfs", 60,
+                                  long_running=True),
+                self._endpoint_stats)
+            if not resp:
+                LOG.error(f"initramfs update timeout")
+                self.speak_dialog("error_updating_os",
+                                  {"help": self.resources.render_dialog(
+                                      "help_support")})
+                self.gui.remove_controlled_notification()
+                self._update_state.transition(UpdateState.FAILED)
+                self._set_update_result(False, "initramfs_timeout")
+                return
+
+            if resp.data.get("updated"):
+                LOG.info("initramfs updated")
+                self._check_cache.invalidate(component="initramfs")
+                self.speak_dialog("update_initramfs_success")
+            elif resp.data.get("error"):
+                LOG.warning(f"Error response: {resp.data}")
+                self.speak_dialog("error_updating_os",
+                                  {"help": self.resources.render_dialog(
+                                      "help_support")})
+                self.gui.remove_controlled_notification()
+                self._update_state.transition(UpdateState.FAILED)
+                self._set_update_result(False, str(resp.data.get("error")))
+                return
+            else:
+                LOG.warning(f"Expected initramfs update: {resp.data}")
+
+            if squashfs_available:
+                self.speak_dialog("update_continuing")
+            else:
+                self._update_state.transition(UpdateState.IDLE)
+                self.speak_dialog("up_to_date",
+                                  {"version": self.pronounce_version(
+                                      self.current_ver)})
+
+        if squashfs_available:
+            self._update_state.transition(UpdateState.SQUASHFS_DOWNLOADING)
+            self._download_completed.clear()
+            self._download_progress = dict()
+            data = {"track": track}
+            prestaged = self._adopt_prestaged_update(track)
+            if prestaged:
+                LOG.info(f"Using pre-staged squashfs {prestaged['version']}")
+                data["update_metadata"] = prestaged["meta"]
+                self._update_journal.record(self._update_txn, "downloading")
+            elif self._update_txn:
+                self._update_journal.record(self._update_txn, "downloading",
+                                            resumed=True)
+            else:
+                self._update_txn = self._update_journal.begin(
+                    "squashfs", "downloading", track=track)
+            LOG.info("Updating squashfs")
+            self.add_event("neon.update_squashfs.response",
+                           self._handle_download_completed, once=True)
+            self.add_event("neon.update_squashfs.progress",
+                           self._handle_download_progress)
+            self.bus.emit(message.forward("neon.update_squashfs", data))
+            self._monitor_squashfs_download(message)
+        else:
+            self.gui.remove_controlled_notification()
+            self._update_state.transition(UpdateState.IDLE,
+                                          (UpdateState.CONFIRMED,))
+
+    def _prestage_squashfs_update(self, message, meta: dict):
+        """
+        Download an available squashfs update in the background so it is ready
+        if the user confirms it. The file is held by this skill and only handed
+        to the device updater plugin when an update is confirmed. A download
+        that is already complete or in progress for the same update is not
+        repeated.
+        @param message: Message associated with the update check
+        @param meta: metadata of the available update
+        """
+        self._wait_for_idle("squashfs pre-stage")
+        track = self.update_track
+        version = meta.get("build_version")
+        url = get_mirror_url(get_squashfs_url(meta), self.update_mirror_url,
+                             self.mirror_upstreams)
+        if not version or not url:
+            LOG.debug(f"Can't pre-stage squashfs without a URL: {meta}")
+            return
+        with self._prestage_lock:
+            if self._update_state.state not in (UpdateState.IDLE,
+                                                UpdateState.CHECKING,
+                                                UpdateState.FAILED):
+                LOG.debug("Not pre-staging during an update")
+                return
+            if self._prestage and \
+                    (self._prestage["track"], self._prestage["version"]) == \
+                    (track, version):
+                return
+            LOG.info(f"Pre-staging squashfs update {version} ({track})")
+            if self._prestage:
+                self._discard_prestage(self._prestage)
+            prestage_dir = os.path.join(self.file_system.path, "prestage")
+            os.makedirs(prestage_dir, exist_ok=True)
+            prestage = {
+                "track": track, "version": version, "meta": meta,
+                "file": os.path.join(prestage_dir, f"{version}.squashfs"),
+                "done": Event(), "staged": False, "cancelled": False}
+            prestage["txn"] = self._update_journal.begin(
+                "squashfs", "prestaging", track=track, version=version,
+                file=prestage["file"])
+            self._prestage = prestage
+            self._idle_scheduler.start_work()
+        # Pre-staging is never urgent, so it always runs at low priority
+        set_background_priority()
+        part_file = f"{prestage['file']}.part"
+        try:
+            # With idle_updates, the download pauses during user interaction
+            can_run = self._idle_scheduler.can_run if self.idle_updates \
+                else None
+            download_image(url, part_file, decompress=False,
+                           max_rate=self.prestage_rate, can_run=can_run)
+            os.replace(part_file, prestage["file"])
+            error = None
+        except Exception as e:
+            LOG.warning(f"squashfs pre-stage failed: {e}")
+            error = str(e)
+        finally:
+            self._idle_scheduler.end_work()
+        with self._prestage_lock:
+            if prestage["cancelled"] or error:
+                self._remove_prestage_file(prestage)
+                self._update_journal.finish(
+                    prestage["txn"], "cancelled" if prestage["cancelled"]
+                    else "failed", error=error)
+                if self._prestage is prestage:
+                    self._prestage = dict()
+            else:
+                LOG.info(f"squashfs pre-staged: {prestage['file']}")
+                prestage["staged"] = True
+                self._update_journal.record(prestage["txn"], "staged")
+            prestage["done"].set()
+
+    @staticmethod
+    def _remove_prestage_file(prestage: dict):
+        """
+        Remove the downloaded or partial file of a pre-staged update.
+        @param prestage: pre-stage state
+        """
+        for path in (prestage["file"], f"{prestage['file']}.part"):
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def _discard_prestage(self, prestage: dict):
+        """
+        Discard a pre-staged update. A download in progress is removed when it
+        finishes. Must be called with `_prestage_lock` held.
+        @param prestage: pre-stage state
+        """
+        LOG.info(f"Discarding pre-staged update {prestage['version']}")
+        prestage["cancelled"] = True
+        if prestage["done"].is_set() and prestage["staged"]:
+            self._remove_prestage_file(prestage)
+            self._update_journal.finish(prestage["txn"], "cancelled")
+        if self._prestage is prestage:
+            self._prestage = dict()
+
+    def _discard_prestaged_update(self):
+        """
+        Discard any pre-staged update, i.e. after the user declines it.
+        """
+        with self._prestage_lock:
+            if self._prestage:
+                self._discard_prestage(self._prestage)
+
+    def _adopt_prestaged_update(self, track: str) -> Optional[dict]:
+        """
+        Take over a pre-staged squashfs download as the confirmed update,
+        waiting for it to finish if it is still downloading. The file is moved
+        to `squashfs_download_dir`, where the device updater plugin uses it
+        instead of downloading the update again.
+        @param track: update track that was confirmed
+        @return: pre-stage state if a pre-staged file for `track` was handed
+            to the plugin, else None. A pre-staged download for another track
+            is discarded.
+        """
+        with self._prestage_lock:
+            prestage = self._prestage
+            if not prestage:
+                return None
+            if prestage["track"] != track:
+                self._discard_prestage(prestage)
+                return None
+            self._prestage = dict()
+        if not prestage["done"].is_set():
+            LOG.info("Waiting for pre-staged squashfs download")
+            prestage["done"].wait()
+        if not prestage["staged"]:
+            return None
+        try:
+            os.makedirs(self.squashfs_download_dir, exist_ok=True)
+            shutil.move(prestage["file"], os.path.join(
+                self.squashfs_download_dir, prestage["version"]))
+        except OSError as e:
+            LOG.error(f"Failed to hand over pre-staged squashfs: {e}")
+            self._remove_prestage_file(prestage)
+            self._update_journal.finish(prestage["txn"], "failed",
+                                        error=str(e))
+            return None
+        self._update_txn = prestage["txn"]
+        return prestage
+
+    def _wait_for_idle(self, name: str):
+        """
+        If `idle_updates` is enabled, wait until the device is idle and within
+        any configured quiet hours before starting background update work.
+        @param name: description of the work to log
+        """
+        if not self.idle_updates:
+            return
+        self._idle_scheduler.idle_seconds = self.idle_seconds
+        self._idle_scheduler.quiet_hours = self.quiet_hours
+        if not self._idle_scheduler.can_run():
+            LOG.info(f"Waiting for device to be idle before {name}")
+            self._idle_scheduler.wait()
+            LOG.info(f"Device idle, starting {name}")
+
+    def _set_update_result(self, success: bool, error: Optional[str] = None):
+        """
+        Record the result of the latest update attempt for reporting state.
+        @param success: True if the update succeeded
+        @param error: optional description of a failure
+        """
+        self._last_update_result = {"success": success, "error": error,
+                                    "time": time()}
+
+    def handle_get_state(self, message):
+        """
+        Respond with the current update state from memory. This never sends
+        requests to updater plugins.
+        @param message: `neon.update.get_state` Message
+        """
+        checked = [result["checked"] for results in
+                   self._check_results.values() for result in results.values()]
+        self.bus.emit(message.response({
+            "installed_version": self._current_ver,
+            "update_track": self.update_track,
+            "tracks": {track: dict(results) for track, results
+                       in self._check_results.items()},
+            "last_check": max(checked) if checked else None,
+            "state": self._update_state.state.value,
+            "updating": self._updating,
+            "download_progress": self._download_progress,
+            "response_latency": self._idle_scheduler.latency_stats,
+            "mirror": self._update_mirror.stats if self._update_mirror
+            else None,
+            "sources": self._mirror_selector.stats,
+            "last_result": self._last_update_result}))
+
+    def _monitor_squashfs_download(self, message):
+        """
+        Wait for a squashfs download to complete. Plugins that emit
+        `neon.update_squashfs.progress` are expected to do so at least every
+        `_download_heartbeat_timeout` seconds and are only queried for status
+        if a heartbeat is missed; other plugins are queried every
+        `_download_check_interval` seconds.
+        @param message: Message associated with the update request
+        """
+        while not self._download_completed.is_set():
+            self._download_activity.clear()
+            interval = self._download_heartbeat_timeout if \
+                self._download_progress else self._download_check_interval
+            if self._download_completed.is_set() or \
+                    self._download_activity.wait(interval):
+                continue
+            download_state_resp = timed_request(
+                self.bus, message.forward(
+                    "neon.device_updater.get_download_status"),
+                self._get_timeout(
+                    "neon.device_updater.get_download_status", 3),
+                self._endpoint_stats)
+            if download_state_resp and \
+                    download_state_resp.data.get("downloading"):
+                LOG.debug("Still downloading")
+            elif download_state_resp and not \
+                    download_state_resp.data.get("downloading"):
+                LOG.info(f"No active download")
+                sleep(1)  # pad to ensure completed event is handled
+                if not self._download_completed.is_set():
+                    LOG.error(f"Download completion not handled!")
+                    self._handle_download_failure()
+                    return
+            elif not download_state_resp:
+                # This could also be an older version of the plugin
+                LOG.error(f"No response from updater plugin")
+                self._handle_download_failure()
+                return
+
+    def _handle_download_progress(self, message):
+        """
+        Handle a squashfs download progress event.
+        @param message: `neon.update_squashfs.progress` Message with optional
+            `progress` (percent), `bytes`, `total_bytes`, `rate` (bytes/s), and
+            `error` data
+        """
+        if self._download_completed.is_set():
+            return
+        self._download_progress = {**message.data, "time": time()}
+        if message.data.get("error"):
+            LOG.error(f"squashfs download failed: {message.data['error']}")
+            self._handle_download_failure()
+        else:
+            LOG.debug(f"squashfs download progress: {message.data}")
+            if self._update_txn:
+                self._update_journal.progress(
+                    self._update_txn, "downloading",
+                    bytes_done=message.data.get("bytes"),
+                    total_bytes=message.data.get("total_bytes"),
+                    file=message.data.get("file"))
+        self._download_activity.set()
+
     def _handle_download_failure(self):
         """
         Handle update download failure. Speak error and clean up.
@@ -444,8 +1442,15 @@ class UpdateSkill(NeonSkill):
                               "help_online")})
         self.gui.remove_controlled_notification()
         self.remove_event("neon.update_squashfs.response")
+        self.remove_event("neon.update_squashfs.progress")
         self._download_completed.set()
-        self._updating = False
+        self._download_activity.set()
+        self._update_state.transition(UpdateState.FAILED)
+        self._set_update_result(False, "download_failed")
+        if self._update_txn:
+            self._update_journal.finish(self._update_txn, "failed",
+                                        error="download_failed")
+            self._update_txn = None
 
     def _handle_download_completed(self, message):
         """
@@ -454,10 +1459,16 @@ class UpdateSkill(NeonSkill):
         @param message: `neon.update_squashfs.response` Message
         """
         self._download_completed.set()
+        self._download_activity.set()
+        self.remove_event("neon.update_squashfs.progress")
         self.gui.remove_controlled_notification()
-        self._write_update_signal("squashfs")
         if message.data.get("new_version"):
             LOG.info("squashfs updated")
+            self._write_update_signal("squashfs")
+            self._check_cache.invalidate()
+            self._clear_update_metadata()
+            self._update_state.transition(UpdateState.REBOOT_PENDING)
+            self._set_update_result(True)
             self.speak_dialog("update_restarting", wait=True)
             self.bus.emit(message.forward("system.reboot"))
         else:
@@ -465,50 +1476,126 @@ class UpdateSkill(NeonSkill):
             LOG.error(f"squashfs update failed: {error}")
             self.speak_dialog("error_updating_os", {"help": ""})
             self.gui.remove_controlled_notification()
-            self._updating = False
+            self._update_state.transition(UpdateState.FAILED)
+            self._set_update_result(False, str(error))
+            if self._update_txn:
+                self._update_journal.finish(self._update_txn, "failed",
+                                            error=str(error))
+                self._update_txn = None
+
+    def _check_os_updates(self, message) -> OSUpdateCheck:
+        """
+        Check for initramfs and squashfs updates concurrently. Enabled checks
+        are sent at the same time and share a single response deadline.
+        @param message: Message associated with the request
+        @return: OSUpdateCheck with the combined check results
+        """
+        checks = dict()
+        timeouts = list()
+        if self.check_initramfs:
+            checks["initramfs"] = self._check_initramfs_update
+            timeouts.append(self._get_timeout("neon.check_update_initramfs",
+                                              self._os_check_timeout))
+        if self.check_squashfs:
+            checks["squashfs"] = self._check_squashfs_update
+            timeouts.append(self._get_timeout("neon.check_update_squashfs",
+                                              self._os_check_timeout))
+        result = OSUpdateCheck()
+        if not checks:
+            return result
+        timeout = max(timeouts)
+        start_time = time()
+        executor = ThreadPoolExecutor(max_workers=len(checks))
+        # Let each request outlive the shared deadline slightly so a missing
+        # reply is reported as a timeout rather than as no update available
+        futures = {executor.submit(check, message, timeout + 1):
+                   name for name, check in checks.items()}
+        executor.shutdown(wait=False)
+        done, _ = wait(futures, timeout=timeout)
+        for future, name in futures.items():
+            if future not in done:
+                LOG.warning(f"{name} update check timed out")
+                result.timed_out.append(name)
+            elif future.exception():
+                LOG.error(f"{name} update check failed: {future.exception()}")
+            elif name == "initramfs":
+                result.initramfs_available = future.result()
+            elif name == "squashfs":
+                result.squashfs_meta = future.result()
+        result.elapsed = time() - start_time
+        LOG.debug(f"OS update checks completed in {result.elapsed}s")
+        return result
 
-    def _check_initramfs_update(self, message) -> bool:
+    def _check_initramfs_update(self, message,
+                                timeout: Optional[float] = None) -> bool:
         """
         Check for an updated initramfs image
+        @param message: Message associated with the request
+        @param timeout: seconds to wait for a response
+        @return: True if an initramfs update is available
         """
-        resp = self.bus.wait_for_response(message.forward(
-            "neon.check_update_initramfs",
-            {"track": "dev" if self.include_prerelease else "master"}),
-            timeout=10)
-        if resp and resp.data.get("update_available"):
-            LOG.info(f"Initramfs update available: {resp.data}")
+        timeout = timeout or self._get_timeout("neon.check_update_initramfs",
+                                               10)
+        data = self._cached_check("initramfs", lambda: self._request_data(
+            message.forward("neon.check_update_initramfs",
+                            {"track": self.update_track}), timeout))
+        if data and data.get("update_available"):
+            LOG.info(f"Initramfs update available: {data}")
             return True
         LOG.debug("No initramfs update")
         return False
 
-    def _check_squashfs_update(self, message) -> Optional[dict]:
+    def _check_squashfs_update(self, message,
+                               timeout: Optional[float] = None) -> \
+            Optional[dict]:
         """
         Check for an updated squashfs image
+        @param message: Message associated with the request
+        @param timeout: seconds to wait for a response
         @return: Dict metadata for new update if available, else None
         """
-        resp = self.bus.wait_for_response(message.forward(
-            "neon.check_update_squashfs",
-            {"track": "dev" if self.include_prerelease else "master"}),
-            timeout=10)
-        if resp and resp.data.get("update_available"):
-            LOG.info(f"Squashfs update available ({resp.data.get('track')})")
-            meta = resp.data.get('update_metadata', dict())
+        timeout = timeout or self._get_timeout("neon.check_update_squashfs",
+                                               10)
+        data = self._cached_check("squashfs", lambda: self._request_data(
+            message.forward("neon.check_update_squashfs",
+                            {"track": self.update_track}), timeout))
+        if data and data.get("update_available"):
+            LOG.info(f"Squashfs update available ({data.get('track')})")
+            meta = data.get('update_metadata', dict())
+            version = meta.get("build_version") or \
+                meta.get("core", {}).get("version", "")
+            if self.prestage_updates and self._in_rollout(
+                    "squashfs", version, meta.get("rollout")):
+                Thread(target=self._prestage_squashfs_update,
+                       args=(message, meta), daemon=True).start()
             return meta
-        elif resp:
-            LOG.debug(f"No Squashfs update (track={resp.data.get('track')}")
+        elif data:
+            LOG.debug(f"No Squashfs update (track={data.get('track')}")
         return None
 
+    def _request_data(self, message: Message,
+                      timeout: float) -> Optional[dict]:
+        """
+        Emit a request and wait for its response.
+        @param message: request Message to emit
+        @param timeout: seconds to wait for a response
+        @return: response data, or None if no response was received
+        """
+        resp = timed_request(self.bus, message, timeout, self._endpoint_stats)
+        return resp.data if resp else None
+
     def _check_package_update(self, message):
         self._check_latest_release(message)
         if not all((self.current_ver, self.latest_ver)):
             self.speak_dialog("check_error")
             return
 
-        # TODO: Support alternate update sources?
-        if not is_connected_http("https://github.com"):
-            LOG.warning(f"GitHub not available. Skipping update")
+        sources = self._rank_sources(self.update_sources)
+        if not sources:
+            LOG.warning("No update source available. Skipping update")
             self.speak_dialog("error_offline")
             return
+        LOG.info(f"Using update source: {sources[0]}")
 
         if self.current_ver == self.latest_ver:
             self.speak_dialog(
@@ -525,6 +1612,8 @@ class UpdateSkill(NeonSkill):
             if message.data.get('notification'):
                 self._dismiss_notification(message)
             self._write_update_signal(self.latest_ver)
+            self._check_cache.invalidate(component="core")
+            self._clear_update_metadata()
             self.speak_dialog("starting_update", wait=True)
             self.bus.emit(message.forward("neon.core_updater.start_update",
                                           {"version": self.latest_ver}))
@@ -533,12 +1622,17 @@ class UpdateSkill(NeonSkill):
 
     def _write_update_signal(self, new_ver: str):
         """
-        Write a file with the version being updated to that can be checked upon
-        next boot
-        :param new_ver: New core version being updated to
+        Record in the update journal that an update is being applied, so it
+        can be checked upon next boot
+        :param new_ver: New core version being updated to, or `squashfs`
         """
-        with self.file_system.open(self._update_filename, 'w+') as f:
-            f.write(new_ver)
+        if new_ver == "squashfs":
+            txn = self._update_txn or \
+                self._update_journal.begin("squashfs", "downloading")
+            self._update_journal.record(txn, "applying")
+            self._update_txn = None
+        else:
+            self._update_journal.begin("core", "applying", version=new_ver)
 
     def _check_update_status(self) -> Optional[bool]:
         """
@@ -548,14 +1642,33 @@ class UpdateSkill(NeonSkill):
             True if an update was successful
             False if an update failed
         """
+        status = None
         update_filepath = os.path.join(self.file_system.path,
                                        self._update_filename)
-        if not os.path.exists(update_filepath):
-            return None
-        with open(update_filepath, 'r') as f:
-            expected_ver = f.read()
-        os.remove(update_filepath)
-        LOG.info(f"Removed update signal at {update_filepath}")
+        if os.path.exists(update_filepath):
+            # Signal written by an older version of this skill
+            with open(update_filepath, 'r') as f:
+                expected_ver = f.read()
+            os.remove(update_filepath)
+            LOG.info(f"Removed update signal at {update_filepath}")
+            status = self._check_applied_update(expected_ver)
+        for txn, state in self._update_journal.get_pending().items():
+            if state["phase"] != "applying":
+                continue
+            status = self._check_applied_update(
+                state.get("version") or state["component"])
+            self._update_journal.finish(
+                txn, "complete" if status else "failed",
+                installed_version=self.current_ver)
+        self._update_journal.compact()
+        return status
+
+    def _check_applied_update(self, expected_ver: str) -> bool:
+        """
+        Check if an applied update was successful.
+        :param expected_ver: expected core version, or `squashfs`
+        :returns: True if the expected version is installed
+        """
         if expected_ver == "squashfs":
             LOG.info("Updated squashFS")
             return True
@@ -565,6 +1678,67 @@ class UpdateSkill(NeonSkill):
             return False
         return True
 
+    def _offer_interrupted_updates(self, message):
+        """
+        Offer to resume OS image downloads and restart squashfs updates that
+        were interrupted by a restart. The device updater plugin does not
+        resume partial squashfs downloads, so those are started again. Only
+        the most recent interrupted download of each component is offered.
+        :param message: Message associated with startup
+        """
+        interrupted = dict()
+        for txn, state in self._update_journal.get_pending().items():
+            if state["phase"] in ("prestaging", "staged"):
+                # Pre-staging starts again when the update is found
+                self._update_journal.finish(txn, "cancelled")
+                if state.get("file"):
+                    self._remove_prestage_file(state)
+            if state["phase"] != "downloading":
+                continue
+            if state["component"] in interrupted:
+                self._update_journal.finish(
+                    interrupted[state["component"]][0], "cancelled")
+            interrupted[state["component"]] = (txn, state)
+        for component, (txn, state) in interrupted.items():
+            LOG.info(f"Found interrupted {component} download: {state}")
+            if component == "squashfs":
+                resp = self.ask_yesno("ask_restart_update")
+            elif component == "os_image":
+                resp = self.ask_yesno("ask_resume_download")
+            else:
+                resp = None
+            if resp != "yes":
+                self._update_journal.finish(txn, "cancelled")
+                for path in (state.get("part_file"),
+                             f"{state.get('part_file')}.json"):
+                    if state.get("part_file") and os.path.isfile(path):
+                        os.remove(path)
+            elif component == "squashfs":
+                self._restart_squashfs_update(message, txn)
+            else:
+                self.gui.show_controlled_notification(
+                    self.resources.render_dialog("notify_downloading_os"))
+                Thread(target=self._download_os_image, args=(message, txn),
+                       daemon=True).start()
+
+    def _restart_squashfs_update(self, message, txn: str):
+        """
+        Restart an interrupted squashfs update in the update worker thread.
+        :param message: Message associated with startup
+        :param txn: update journal transaction of the interrupted update
+        """
+        if not self._update_state.start_check():
+            LOG.warning("Not resuming update while another is in-progress")
+            return
+        self._update_state.transition(UpdateState.CONFIRMED)
+        self._update_txn = txn
+        self.speak_dialog("starting_update", wait=True)
+        self.gui.show_controlled_notification(
+            self.resources.render_dialog("notify_downloading_update"))
+        self._update_worker = Thread(target=self._run_os_update, daemon=True,
+                                     args=(message, False, True))
+        self._update_worker.start()
+
     @intent_handler("core_version.intent")
     def handle_core_version(self, message):
         """
@@ -599,7 +1773,22 @@ class UpdateSkill(NeonSkill):
         :param message: message object associated with request
         """
         resp = self.ask_yesno("ask_download_image")
-        if resp == "yes":
+        cached_image = self._get_cached_image() if resp == "yes" else None
+        if cached_image:
+            LOG.info(f"Using cached image: {cached_image}")
+            self.continue_os_installation(message.forward(
+                "neon.download_os_image.complete",
+                {"success": True, "image_file": cached_image}))
+        elif resp == "yes" and self.stream_image_write:
+            self._stream_os_media(message)
+        elif resp == "yes" and self._download_images:
+            self.speak_dialog("downloading_image")
+            self.speak_dialog("drive_instructions")
+            self.gui.show_controlled_notification(
+                self.resources.render_dialog("notify_downloading_os"))
+            Thread(target=self._download_os_image, args=(message,),
+                   daemon=True).start()
+        elif resp == "yes":
             self.add_event("neon.download_os_image.complete",
                            self.on_download_complete, once=True)
             self.speak_dialog("downloading_image")
@@ -646,6 +1835,55 @@ class UpdateSkill(NeonSkill):
             self.speak_dialog("confirm_no_change_update_track",
                               {"track": update_track})
 
+    def _stream_os_media(self, message):
+        """
+        Confirm the target drive, then download the OS image and write it to
+        the drive at the same time.
+        :param message: message object associated with request
+        """
+        self.speak_dialog("drive_instructions", wait=True)
+        confirm_number = randint(100, 999)
+        validator = numeric_confirmation_validator(str(confirm_number))
+        resp = self.get_response('ask_overwrite_drive',
+                                 {'confirm': str(confirm_number)},
+                                 validator)
+        if not resp:
+            self.speak_dialog("not_updating")
+            return
+        self.speak_dialog("starting_installation")
+        self.gui.show_controlled_notification(
+            self.resources.render_dialog("notify_writing_image"))
+        # There is no downloaded image to verify the written drive against
+        self._media_image_file = None
+        Thread(target=self._write_os_media, args=(message,),
+               daemon=True).start()
+
+    def _write_os_media(self, message):
+        """
+        Stream the configured OS image to `image_drive` and report the result
+        as an image write completion.
+        :param message: message object associated with request
+        """
+        self._set_work_priority()
+        data = {"device": self.image_drive}
+        try:
+            bmap = fetch_block_map(self.image_url) if \
+                self.image_url and self.sparse_image_write else None
+            sources = self._get_image_sources()
+            data.update(stream_image_to_device(
+                sources[0], self.image_drive, bmap=bmap,
+                sha256=self._get_image_digest(),
+                max_rate=self.max_download_rate, mirrors=sources[1:]))
+            data["success"] = True
+        except MediaWriteError as e:
+            LOG.error(f"Failed to write image to {self.image_drive}: {e}")
+            data.update({"success": False, "error": e.error})
+        except Exception as e:
+            LOG.exception(f"Failed to write image to {self.image_drive}: {e}")
+            data.update({"success": False, "error": "error_unknown"})
+        self.on_write_complete(message.forward(
+            "neon.install_os_image.complete", data))
+
     def on_download_complete(self, message):
         """
         After `handle_create_os_media`, this method will be called with the OS
@@ -654,6 +1892,9 @@ class UpdateSkill(NeonSkill):
         :param message: message object associated with download completion
         """
         self.gui.remove_controlled_notification()
+        if message.data.get("sha256"):
+            LOG.info(f"Downloaded image sha256={message.data['sha256']} "
+                     f"verified={message.data.get('verified')}")
         if message.data.get("success"):
             LOG.info(f"Showing Download Complete Notification")
             text = self.resources.render_dialog("notify_download_complete")
@@ -676,7 +1917,8 @@ class UpdateSkill(NeonSkill):
         prompt confirmation to clear data
         :param message: message object associated with notification interaction
         """
-        self._dismiss_notification(message)
+        if message.data.get("notification"):
+            self._dismiss_notification(message)
         image_file = message.data.get("image_file")
         # TODO: Prompt user to select which device?
         confirm_number = randint(100, 999)
@@ -685,7 +1927,15 @@ class UpdateSkill(NeonSkill):
         resp = self.get_response('ask_overwrite_drive',
                                  {'confirm': str(confirm_number)},
                                  validator)
-        if resp:
+        self._media_image_file = image_file
+        self._media_bmap = None
+        if resp and self.sparse_image_write:
+            self.speak_dialog("starting_installation")
+            self.gui.show_controlled_notification(
+                self.resources.render_dialog("notify_writing_image"))
+            Thread(target=self._write_os_image_file,
+                   args=(message, image_file), daemon=True).start()
+        elif resp:
             self.speak_dialog("starting_installation")
             self.add_event("neon.install_os_image.complete",
                            self.on_write_complete, once=True)
@@ -699,14 +1949,345 @@ class UpdateSkill(NeonSkill):
         else:
             self.speak_dialog("not_updating")
 
+    def _get_image_digest(self) -> Optional[str]:
+        """
+        Get the expected SHA-256 digest of `image_url` from the `image_sha256`
+        setting, else from a digest published alongside the image.
+        """
+        if not self.image_url:
+            return None
+        return self.settings.get("image_sha256") or \
+            fetch_digest(self.image_url)
+
+    def _get_cached_image(self) -> Optional[str]:
+        """
+        Get a cached copy of `image_url` if it is still current.
+        @return: path to the cached image, else None
+        """
+        if not self.image_cache_size or not self.image_url:
+            return None
+        self._image_cache.max_bytes = self.image_cache_size
+        validator = get_image_validator(self.image_url,
+                                        sha256=self._get_image_digest())
+        image_file = self._image_cache.get(self.image_url, validator)
+        LOG.debug(f"Image cache stats: {self._image_cache.stats}")
+        return image_file
+
+    def _download_os_image(self, message, txn: Optional[str] = None):
+        """
+        Download `image_url`, verifying it as it is received, and report the
+        result as a download completion. If enabled, the image is cached.
+        Segmented downloads are recorded in the update journal so they can be
+        resumed after a restart. If `peer_cache` is enabled and the image
+        digest is known, the download is shared with other devices.
+        :param message: message object associated with request
+        :param txn: update journal transaction of a download being resumed
+        """
+        self._set_work_priority()
+        url = self.image_url or ""
+        image_file = os.path.join(
+            self.file_system.path,
+            os.path.basename(strip_compression(url)) or "os_image.img")
+        data = {"image_file": image_file}
+        digest = self._get_image_digest()
+        # Get the validator before downloading in case the image changes
+        validator = get_image_validator(url, sha256=digest) if \
+            url and self.image_cache_size else None
+        bmap = fetch_block_map(url) if url and self.sparse_image_write \
+            else None
+        if txn:
+            self._update_journal.record(txn, "downloading", resumed=True)
+        elif self.download_connections > 1:
+            txn = self._update_journal.begin(
+                "os_image", "downloading", url=url, image_file=image_file,
+                part_file=f"{image_file}.part")
+
+        def _complete():
+            if txn:
+                self._update_journal.finish(
+                    txn, "complete" if data["success"] else "failed",
+                    error=data.get("error"))
+            self.on_download_complete(message.forward(
+                "neon.download_os_image.complete", data))
+
+        if self.peer_cache and digest:
+            try:
+                payload, source = self._get_peer_payload(url, digest)
+                # Decompress and verify the shared payload locally
+                data.update(download_image(f"file://{payload}", image_file,
+                                           sha256=digest))
+                data["source"] = source
+                if validator:
+                    self._image_cache.max_bytes = self.image_cache_size
+                    data["image_file"] = self._image_cache.put(
+                        url, validator, image_file, data["sha256"])
+                self._save_block_map(bmap, data["image_file"])
+                data["success"] = True
+            except MediaWriteError as e:
+                LOG.error(f"Failed to download {url}: {e}")
+                data.update({"success": False, "error": e.error})
+            except Exception as e:
+                # Sharing is optional; download directly instead
+                LOG.exception(f"Failed to get {url} from peers: {e}")
+                data.clear()
+                data["image_file"] = image_file
+            if "success" in data:
+                _complete()
+                return
+
+        def _on_progress(progress: dict):
+            self._show_download_progress(progress)
+            self._update_journal.progress(
+                txn, "downloading", bytes_done=progress["bytes_done"],
+                total_bytes=progress["total_bytes"])
+
+        sources = self._get_image_sources()
+        try:
+            if self.download_connections > 1:
+                data.update(download_segmented(
+                    sources[0], image_file, self.download_connections,
+                    sha256=digest, on_progress=_on_progress,
+                    max_rate=self.max_download_rate, mirrors=sources[1:]))
+            else:
+                if os.path.isfile(f"{image_file}.part"):
+                    # A segmented download can't be resumed by one connection
+                    os.remove(f"{image_file}.part")
+                data.update(download_image(
+                    sources[0], image_file, sha256=digest,
+                    max_rate=self.max_download_rate, mirrors=sources[1:]))
+            if validator:
+                self._image_cache.max_bytes = self.image_cache_size
+                data["image_file"] = self._image_cache.put(
+                    url, validator, image_file, data["sha256"])
+            self._save_block_map(bmap, data["image_file"])
+            data["success"] = True
+        except MediaWriteError as e:
+            LOG.error(f"Failed to download {url}: {e}")
+            data.update({"success": False, "error": e.error})
+        except Exception as e:
+            LOG.exception(f"Failed to download {url}: {e}")
+            data.update({"success": False, "error": "error_unknown"})
+        _complete()
+
+    @staticmethod
+    def _save_block_map(bmap: Optional[BlockMap], image_file: str):
+        """
+        Save the block map published with a downloaded image next to it, so
+        it is used when the image is written. Downloaded images have no holes,
+        so without it every block of the image would be written.
+        @param bmap: published BlockMap of the image, if any
+        @param image_file: path to the downloaded image
+        """
+        bmap_file = f"{image_file}.bmap"
+        if bmap:
+            with open(bmap_file, 'w') as f:
+                f.write(bmap.to_xml())
+        elif os.path.isfile(bmap_file):
+            # Don't use a map saved with a previous download of this path
+            os.remove(bmap_file)
+
+    def _start_update_mirror(self):
+        """
+        Start serving a local mirror of update artifacts on `mirror_port`.
+        """
+        if self._update_mirror:
+            return
+        mirror = UpdateMirror(
+            os.path.join(self.file_system.path, "mirror"),
+            self.mirror_upstreams,
+            max_age=float(self.settings.get("mirror_max_age", 300)),
+            max_bytes=int(float(self.settings.get("mirror_cache_mb", 0)) *
+                          1024 * 1024))
+        try:
+            mirror.start(int(self.settings.get("mirror_port", 31852)))
+            self._update_mirror = mirror
+        except OSError as e:
+            LOG.error(f"Failed to start update mirror: {e}")
+
+    def _rank_sources(self, urls: List[str]) -> List[str]:
+        """
+        Get the available sources in `urls`, fastest first. Rankings are
+        cached for `source_rank_ttl` seconds.
+        @param urls: equivalent URLs to rank
+        @return: URLs that are available, in order of preference
+        """
+        if len(urls) == 1:
+            return urls if is_connected_http(urls[0]) else []
+        self._mirror_selector.ttl = \
+            float(self.settings.get("source_rank_ttl", 3600))
+        return self._mirror_selector.rank(urls)
+
+    def _get_image_sources(self) -> List[str]:
+        """
+        Get `image_url` and `image_mirrors`, fastest first. If none respond,
+        all are returned in configured order to be tried anyway.
+        """
+        urls = [url for url in [self.image_url] + self.image_mirrors if url]
+        if len(urls) < 2:
+            return urls or [self.image_url]
+        ranked = self._rank_sources(urls)
+        return ranked + [url for url in urls if url not in ranked]
+
+    def _get_peer_cache(self) -> PeerCache:
+        """
+        Get the cache of payloads shared with other devices, starting it if
+        it is not already running.
+        """
+        if not self._peer_cache:
+            self._peer_cache = PeerCache(
+                os.path.join(self.file_system.path, "peer_cache"),
+                self.peer_cache_size,
+                int(self.settings.get("peer_port", 31851)),
+                int(self.settings.get("peer_discovery_port", 31850)))
+            try:
+                self._peer_cache.start()
+            except OSError as e:
+                LOG.error(f"Failed to start sharing update payloads: {e}")
+        self._peer_cache.max_bytes = self.peer_cache_size
+        return self._peer_cache
+
+    def _get_peer_payload(self, url: str, digest: str) -> Tuple[str, str]:
+        """
+        Get the original (compressed) download of `url` from the local peer
+        cache, else from a device on the local network, else from `url`. Each
+        download is verified against `digest` before it is used or shared.
+        @param url: URL of the OS image
+        @param digest: expected SHA-256 digest of the download
+        @return: path to the payload and the URL it was downloaded from
+        @raises MediaWriteError: if the payload could not be downloaded
+        """
+        cache = self._get_peer_cache()
+        payload = cache.get(digest)
+        if payload:
+            LOG.info(f"Using shared payload: {payload}")
+            return payload, payload
+        suffix = get_compression_suffix(url)
+        part_file = os.path.join(cache.path, f"{digest}{suffix}.part")
+        sources = find_peers(digest, self.peer_addresses) + \
+            self._get_image_sources()
+        for source in sources:
+            try:
+                download_image(source, part_file, sha256=digest,
+                               max_rate=self.max_download_rate,
+                               decompress=False)
+            except MediaWriteError as e:
+                LOG.warning(f"Failed to download from {source}: {e}")
+                continue
+            LOG.info(f"Downloaded shared payload from {source}")
+            return cache.put(part_file, digest, suffix), source
+        raise MediaWriteError("error_download",
+                              f"No source available for {url}")
+
+    def _set_work_priority(self):
+        """
+        If `background_priority` is enabled, lower the priority of the calling
+        worker thread so heavy work does not slow down voice interaction.
+        """
+        if self.background_priority:
+            set_background_priority()
+
+    def _show_download_progress(self, progress: dict):
+        """
+        Update the OS image download notification with progress and aggregate
+        throughput, at most every 5 seconds.
+        @param progress: dict with `bytes_done`, `total_bytes`, and `rate`
+        """
+        if time() - self._media_progress_time < 5:
+            return
+        self._media_progress_time = time()
+        percent = round(100 * progress["bytes_done"] / progress["total_bytes"])
+        rate = round(progress["rate"] / 1024 / 1024, 1)
+        LOG.debug(f"OS image download progress: {percent}% ({rate} MiB/s)")
+        self.gui.show_controlled_notification(self.resources.render_dialog(
+            "notify_downloading_os_progress",
+            {"percent": percent, "rate": rate}))
+
+    def _write_os_image_file(self, message, image_file: str):
+        """
+        Write a downloaded OS image to `image_drive`, skipping empty blocks,
+        and report the result as an image write completion. A `.bmap` file
+        next to the image is used if available, else one is generated.
+        :param message: message object associated with notification interaction
+        :param image_file: path to the downloaded image
+        """
+        self._set_work_priority()
+        data = {"device": self.image_drive, "image_file": image_file}
+        try:
+            if not image_file or not os.path.isfile(image_file):
+                raise MediaWriteError("no_image_file", str(image_file))
+            bmap_file = next((f for f in get_block_map_names(image_file)
+                              if os.path.isfile(f)), None)
+            if bmap_file:
+                with open(bmap_file) as f:
+                    bmap = BlockMap.from_xml(f.read())
+            else:
+                bmap = BlockMap.from_image(image_file)
+            self._media_bmap = bmap
+            LOG.info(f"Writing {bmap.mapped_bytes} of {bmap.image_size} "
+                     f"bytes to {self.image_drive}")
+            data.update(write_image_to_device(image_file, self.image_drive,
+                                              bmap))
+            data["success"] = True
+        except MediaWriteError as e:
+            LOG.error(f"Failed to write image to {self.image_drive}: {e}")
+            data.update({"success": False, "error": e.error})
+        except Exception as e:
+            LOG.exception(f"Failed to write image to {self.image_drive}: {e}")
+            data.update({"success": False, "error": "error_unknown"})
+        self.on_write_complete(message.forward(
+            "neon.install_os_image.complete", data))
+
     def on_write_complete(self, message):
         """
         After `continue_os_installation`, this method will be called with the
         image write status. Displays a notification telling the user they may
-        restart and use the new image.
+        restart and use the new image. If enabled, the drive is verified first.
         """
         self.bus.emit(message.forward(
             "ovos.notification.api.remove.controlled"))
+        if message.data.get("success") and self.verify_image_write:
+            if self._media_image_file:
+                self.gui.show_controlled_notification(
+                    self.resources.render_dialog("notify_verifying_image"))
+                Thread(target=self._verify_os_media, args=(message,),
+                       daemon=True).start()
+                return
+            LOG.warning("No image file to verify written drive against")
+        self._show_write_result(message)
+
+    def _verify_os_media(self, message):
+        """
+        Compare the drive at `image_drive` with the image written to it and
+        show the write result.
+        :param message: successful image write completion message
+        """
+        self._set_work_priority()
+        data = dict(message.data)
+        try:
+            result = verify_device(self._media_image_file, self.image_drive,
+                                   self._media_bmap)
+            data.update({"verified": result["verified"],
+                         "verify_rate": result["rate"]})
+            if not result["verified"]:
+                LOG.error(f"Written drive does not match image: "
+                          f"{result['mismatches']}")
+                data.update({"success": False,
+                             "error": "error_verify_failed"})
+        except MediaWriteError as e:
+            LOG.error(f"Failed to verify {self.image_drive}: {e}")
+            data.update({"success": False, "error": e.error})
+        except Exception as e:
+            LOG.exception(f"Failed to verify {self.image_drive}: {e}")
+            data.update({"verified": False, "success": False,
+                         "error": "error_verify_failed"})
+        self.gui.remove_controlled_notification()
+        self._show_write_result(message.forward(message.msg_type, data))
+
+    def _show_write_result(self, message):
+        """
+        Display a notification with the result of writing an image.
+        :param message: image write completion message
+        """
         if message.data.get("success"):
             LOG.info("Showing Write Complete Notification")
             text = self.resources.render_dialog("notify_installation_complete")
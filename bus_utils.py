@@ -0,0 +1,302 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2025 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+
+from collections import deque
+from threading import Event, Lock, Timer
+from time import time
+from typing import Callable, Deque, Dict, List, Optional, Union
+
+from ovos_bus_client.message import Message
+from ovos_utils.log import LOG
+
+
+class EndpointStats:
+    def __init__(self):
+        """
+        Response latency statistics for bus request message types.
+        """
+        self._stats: Dict[str, dict] = dict()
+        self._lock = Lock()
+
+    def record(self, msg_type: str, latency: Optional[float]):
+        """
+        Record the result of a request.
+        @param msg_type: request message type
+        @param latency: seconds until a response, or None if it timed out
+        """
+        with self._lock:
+            stats = self._stats.setdefault(msg_type, {
+                "requests": 0, "responses": 0, "timeouts": 0,
+                "total_latency": 0.0, "max_latency": 0.0,
+                "last_latency": None})
+            stats["requests"] += 1
+            if latency is None:
+                stats["timeouts"] += 1
+                return
+            stats["responses"] += 1
+            stats["total_latency"] += latency
+            stats["max_latency"] = max(stats["max_latency"], latency)
+            stats["last_latency"] = latency
+
+    def get(self) -> Dict[str, dict]:
+        """
+        Get statistics for each requested message type.
+        @return: dict of message type to request counts and latencies
+        """
+        with self._lock:
+            return {msg_type: {"requests": s["requests"],
+                               "responses": s["responses"],
+                               "timeouts": s["timeouts"],
+                               "mean_latency": s["total_latency"] /
+                               s["responses"] if s["responses"] else None,
+                               "max_latency": s["max_latency"],
+                               "last_latency": s["last_latency"]}
+                    for msg_type, s in self._stats.items()}
+
+
+class LatencyTracker(EndpointStats):
+    def __init__(self, path: Optional[str] = None, window: int = 100,
+                 min_samples: int = 5):
+        """
+        EndpointStats that also keeps a rolling window of response latencies
+        per message type to derive request timeouts from.
+        @param path: optional JSON file to persist latency samples to
+        @param window: maximum number of samples kept per message type
+        @param min_samples: samples required before a timeout is derived
+        """
+        EndpointStats.__init__(self)
+        self.path = path
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: Dict[str, Deque[float]] = dict()
+        self._timeout_streak: Dict[str, int] = dict()
+        if path:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                samples = json.load(f)
+            self._samples = {msg_type: deque(latencies, maxlen=self.window)
+                             for msg_type, latencies in samples.items()}
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            LOG.error(f"Failed to load latency samples from {self.path}: {e}")
+
+    def _save(self):
+        try:
+            with open(self.path, 'w+') as f:
+                json.dump({msg_type: list(latencies) for msg_type, latencies
+                           in self._samples.items()}, f)
+        except Exception as e:
+            LOG.error(f"Failed to save latency samples to {self.path}: {e}")
+
+    def record(self, msg_type: str, latency: Optional[float]):
+        EndpointStats.record(self, msg_type, latency)
+        with self._lock:
+            if latency is None:
+                self._timeout_streak[msg_type] = \
+                    self._timeout_streak.get(msg_type, 0) + 1
+                return
+            self._timeout_streak[msg_type] = 0
+            self._samples.setdefault(
+                msg_type, deque(maxlen=self.window)).append(round(latency, 3))
+            if self.path:
+                self._save()
+
+    def percentile(self, msg_type: str, pct: float) -> Optional[float]:
+        """
+        Get a latency percentile for a message type.
+        @param msg_type: request message type
+        @param pct: percentile to get (0-100)
+        @return: latency in seconds, or None if there are no samples
+        """
+        with self._lock:
+            samples = sorted(self._samples.get(msg_type) or [])
+        if not samples:
+            return None
+        idx = max(round(pct / 100 * len(samples)) - 1, 0)
+        return samples[min(idx, len(samples) - 1)]
+
+    def get_timeout(self, msg_type: str, default: float, floor: float,
+                    ceiling: float, margin: float) -> float:
+        """
+        Get a request timeout from observed p99 latency plus a margin. Each
+        consecutive timeout doubles the result (up to 4x) so that slow
+        responses missed by a short timeout can still be observed.
+        @param msg_type: request message type
+        @param default: timeout to use until enough samples are observed
+        @param floor: minimum timeout to return
+        @param ceiling: maximum timeout to return
+        @param margin: seconds added to the observed p99 latency
+        @return: timeout in seconds
+        """
+        with self._lock:
+            num_samples = len(self._samples.get(msg_type) or [])
+            streak = min(self._timeout_streak.get(msg_type, 0), 2)
+        if num_samples < self.min_samples:
+            return default
+        timeout = (self.percentile(msg_type, 99) + margin) * 2 ** streak
+        return min(max(timeout, floor), ceiling)
+
+    def get(self) -> Dict[str, dict]:
+        stats = EndpointStats.get(self)
+        for msg_type in stats:
+            stats[msg_type]["p50_latency"] = self.percentile(msg_type, 50)
+            stats[msg_type]["p99_latency"] = self.percentile(msg_type, 99)
+        return stats
+
+
+def timed_request(bus, message: Message, timeout: float,
+                  stats: Optional[EndpointStats] = None) -> Optional[Message]:
+    """
+    Emit a request and wait for its response, recording response latency.
+    @param bus: MessageBusClient to emit on
+    @param message: request Message
+    @param timeout: seconds to wait for a response
+    @param stats: EndpointStats to record latency to
+    @return: response Message, or None if no response was received
+    """
+    start_time = time()
+    resp = bus.wait_for_response(message, timeout=timeout)
+    if stats:
+        stats.record(message.msg_type, time() - start_time if resp else None)
+    return resp
+
+
+def sequential_request(bus, messages: List[Message],
+                       timeout: Union[float, List[float]],
+                       validator: Callable[[Message], bool],
+                       stats: Optional[EndpointStats] = None) -> \
+        Optional[Message]:
+    """
+    Emit requests one at a time until a valid response is received.
+    @param bus: MessageBusClient to emit on
+    @param messages: request Messages in priority order
+    @param timeout: seconds to wait for each response, or a list of timeouts
+        for each message
+    @param validator: returns True if a response is valid
+    @param stats: EndpointStats to record latency to
+    @return: first valid response, else the first response received
+    """
+    fallback = None
+    timeouts = timeout if isinstance(timeout, list) else \
+        [timeout] * len(messages)
+    for message, timeout in zip(messages, timeouts):
+        resp = timed_request(bus, message, timeout, stats)
+        if resp and validator(resp):
+            return resp
+        fallback = fallback or resp
+    return fallback
+
+
+def hedged_request(bus, messages: List[Message], timeout: float,
+                   validator: Callable[[Message], bool], grace: float = 0.5,
+                   stats: Optional[EndpointStats] = None) -> Optional[Message]:
+    """
+    Emit all requests at once and return the highest priority valid response.
+    A valid response is accepted immediately if no higher priority request is
+    still pending, otherwise after `grace` seconds. If every request is
+    answered without a valid response, this returns without waiting for
+    `timeout`. Slower responses are ignored but still recorded to `stats`
+    until `timeout` expires.
+    @param bus: MessageBusClient to emit on
+    @param messages: request Messages in priority order
+    @param timeout: seconds to wait for any valid response
+    @param validator: returns True if a response is valid
+    @param grace: seconds to wait for a higher priority response
+    @param stats: EndpointStats to record latency to
+    @return: selected valid response, else the first response received
+    """
+    responses: List[Optional[Message]] = [None] * len(messages)
+    received = Event()
+    lock = Lock()
+    handlers = list()
+    start_time = time()
+
+    def _get_handler(idx: int, msg_type: str):
+        def _handler(response: Message):
+            with lock:
+                if responses[idx] is not None:
+                    return
+                responses[idx] = response
+            if stats:
+                stats.record(msg_type, time() - start_time)
+            received.set()
+        return _handler
+
+    def _remove_handlers():
+        for reply_type, handler in handlers:
+            bus.remove(reply_type, handler)
+        if stats:
+            for idx, request in enumerate(messages):
+                if responses[idx] is None:
+                    stats.record(request.msg_type, None)
+
+    for idx, message in enumerate(messages):
+        reply_type = f"{message.msg_type}.response"
+        handlers.append((reply_type, _get_handler(idx, message.msg_type)))
+        bus.on(*handlers[-1])
+    timer = Timer(timeout, _remove_handlers)
+    timer.daemon = True
+    timer.start()
+    for message in messages:
+        bus.emit(message)
+
+    deadline = start_time + timeout
+    accept_time = None
+    while True:
+        received.clear()
+        with lock:
+            valid = [idx for idx, resp in enumerate(responses)
+                     if resp is not None and validator(resp)]
+            pending = [idx for idx, resp in enumerate(responses)
+                       if resp is None]
+        if valid:
+            best = valid[0]
+            accept_time = accept_time or time() + grace
+            if not any(idx < best for idx in pending) or \
+                    time() >= accept_time:
+                LOG.debug(f"Accepted {messages[best].msg_type} response "
+                          f"after {time() - start_time}s")
+                return responses[best]
+        if not pending:
+            # Every request was answered and none were valid
+            break
+        remaining = min(deadline, accept_time or deadline) - time()
+        if remaining <= 0:
+            break
+        received.wait(remaining)
+    with lock:
+        return next((resp for resp in responses
+                     if resp is not None and validator(resp)),
+                    next((resp for resp in responses if resp is not None),
+                         None))
@@ -0,0 +1,205 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2025 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import hashlib
+import json
+import os
+import shutil
+
+from threading import Lock
+from time import time
+from typing import Dict, Optional
+from urllib.request import Request, urlopen
+
+from ovos_utils.log import LOG
+
+
+def get_image_validator(url: str, timeout: float = 30,
+                        sha256: Optional[str] = None) -> Optional[str]:
+    """
+    Get a string that changes when the image at `url` changes.
+    @param url: URL of the image
+    @param timeout: seconds to wait for the server
+    @param sha256: published digest of the image, if known
+    @return: `sha256`, else the image ETag, else its Last-Modified time and
+        size, or None if the server provides none of these
+    """
+    if sha256:
+        return f"sha256:{sha256.lower()}"
+    try:
+        with urlopen(Request(url, method="HEAD"), timeout=timeout) as resp:
+            etag = resp.headers.get("ETag")
+            modified = resp.headers.get("Last-Modified")
+            length = resp.headers.get("Content-Length")
+    except Exception as e:
+        LOG.warning(f"Failed to get image headers for {url}: {e}")
+        return None
+    if etag:
+        return f"etag:{etag}"
+    if modified:
+        return f"modified:{modified}:{length}"
+    return None
+
+
+class ImageCache:
+    def __init__(self, path: str, max_bytes: int):
+        """
+        Content-addressed cache of downloaded OS images. Images are stored by
+        the SHA-256 of their download and looked up by URL and a validator
+        (see `get_image_validator`). The least recently used images are
+        removed to keep the cache within `max_bytes`.
+        @param path: directory to store images in
+        @param max_bytes: maximum total size of cached images; 0 disables
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._index_file = os.path.join(path, "index.json")
+        self._lock = Lock()
+        os.makedirs(path, exist_ok=True)
+        self._index: Dict[str, dict] = self._load()
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            with open(self._index_file) as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return dict()
+        except Exception as e:
+            LOG.error(f"Failed to load image cache index: {e}")
+            return dict()
+        return self._drop_missing(index)
+
+    def _drop_missing(self, index: Dict[str, dict]) -> Dict[str, dict]:
+        # Drop entries for images that were removed outside of the cache
+        return {key: entry for key, entry in index.items()
+                if os.path.isfile(os.path.join(self.path, entry["file"]))}
+
+    def _save(self):
+        try:
+            with open(self._index_file, 'w+') as f:
+                json.dump(self._index, f)
+        except Exception as e:
+            LOG.error(f"Failed to save image cache index: {e}")
+
+    @staticmethod
+    def _get_key(url: str, validator: str) -> str:
+        return hashlib.sha256(f"{url}\0{validator}".encode()).hexdigest()
+
+    def get(self, url: str, validator: Optional[str]) -> Optional[str]:
+        """
+        Get a cached image downloaded from `url` while it had `validator`.
+        @param url: URL of the image
+        @param validator: current validator of the image
+        @return: path to the cached image, else None if it is not cached or
+            its file was removed
+        """
+        with self._lock:
+            entry = self._index.get(self._get_key(url, validator)) \
+                if validator and self.max_bytes > 0 else None
+            if entry and not os.path.isfile(os.path.join(self.path,
+                                                         entry["file"])):
+                LOG.warning(f"Cached image was removed: {entry['file']}")
+                # Drop every entry for the missing file
+                self._index = {key: other for key, other in
+                               self._index.items()
+                               if other["file"] != entry["file"]}
+                self._save()
+                entry = None
+            if not entry:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry["last_used"] = time()
+            self._save()
+            return os.path.join(self.path, entry["file"])
+
+    def put(self, url: str, validator: Optional[str], image_file: str,
+            sha256: str) -> str:
+        """
+        Move a downloaded image into the cache.
+        @param url: URL the image was downloaded from
+        @param validator: validator of the image when it was downloaded
+        @param image_file: path to the downloaded image
+        @param sha256: SHA-256 digest of the download
+        @return: path to the image; unchanged if it was not cached
+        """
+        size = os.path.getsize(image_file)
+        if not validator or not 0 < size <= self.max_bytes:
+            LOG.debug(f"Not caching {image_file} ({size} bytes)")
+            return image_file
+        name = f"{sha256}.img"
+        cached_file = os.path.join(self.path, name)
+        with self._lock:
+            if os.path.abspath(image_file) != cached_file:
+                shutil.move(image_file, cached_file)
+            self._index[self._get_key(url, validator)] = {
+                "file": name, "size": size, "url": url,
+                "validator": validator, "last_used": time()}
+            self._evict()
+            self._save()
+        return cached_file
+
+    def _evict(self):
+        self._index = self._drop_missing(self._index)
+        # Every key for an image shares one file, so sizes are counted per file
+        files = dict()
+        for entry in self._index.values():
+            files[entry["file"]] = max(files.get(entry["file"], 0),
+                                       entry["last_used"])
+        total = sum(os.path.getsize(os.path.join(self.path, name))
+                    for name in files)
+        for name in sorted(files, key=lambda n: files[n]):
+            if total <= self.max_bytes:
+                break
+            path = os.path.join(self.path, name)
+            total -= os.path.getsize(path)
+            os.remove(path)
+            self._index = {key: entry for key, entry in self._index.items()
+                           if entry["file"] != name}
+            LOG.info(f"Evicted cached image: {name}")
+
+    @property
+    def size(self) -> int:
+        """
+        Get the total size of cached images in bytes.
+        """
+        with self._lock:
+            names = {entry["file"] for entry in self._index.values()}
+        paths = [os.path.join(self.path, name) for name in names]
+        return sum(os.path.getsize(path) for path in paths
+                   if os.path.isfile(path))
+
+    @property
+    def stats(self) -> dict:
+        """
+        Get cache hit/miss counters.
+        """
+        return {"hits": self.hits, "misses": self.misses,
+                "entries": len(self._index), "bytes": self.size}
@@ -0,0 +1,1144 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2025 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import hashlib
+import json
+import lzma
+import mmap
+import os
+import re
+import subprocess
+import sys
+import zlib
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, \
+    ThreadPoolExecutor, wait
+from queue import Empty, Full, Queue
+from threading import Event, Lock, Thread, get_native_id
+from time import sleep, time
+from typing import Callable, List, Optional, Tuple
+from urllib.request import Request, urlopen
+from xml.etree import ElementTree
+
+from ovos_utils.log import LOG
+
+
+class MediaWriteError(Exception):
+    def __init__(self, error: str, detail: Optional[str] = None):
+        """
+        Raised when an OS image could not be written to a device.
+        @param error: dialog name describing the failure (`no_valid_device`,
+            `error_download`, `error_image_corrupt`, `error_verify_failed`,
+            `error_unknown`)
+        @param detail: optional description of the underlying failure
+        """
+        Exception.__init__(self, detail or error)
+        self.error = error
+
+
+class BlockMap:
+    def __init__(self, image_size: int, block_size: int,
+                 ranges: List[Tuple[int, int, Optional[str]]],
+                 checksum_type: str = "sha256"):
+        """
+        Map of the blocks in an image that contain data, in the format used by
+        bmaptool. Blocks outside of mapped ranges do not need to be written.
+        @param image_size: size of the image in bytes
+        @param block_size: size of a block in bytes
+        @param ranges: list of (first block, last block, checksum) tuples;
+            checksum may be None if a range is not to be verified
+        @param checksum_type: hashlib algorithm of range checksums
+        """
+        self.image_size = image_size
+        self.block_size = block_size
+        self.ranges = ranges
+        self.checksum_type = checksum_type
+
+    @classmethod
+    def from_xml(cls, text: str):
+        """
+        Parse a bmaptool `.bmap` file (version 1.x or 2.x).
+        @param text: contents of the bmap file
+        @return: BlockMap described by the file
+        """
+        root = ElementTree.fromstring(text)
+        checksum_type = (root.findtext("ChecksumType") or "sha1").strip()
+        ranges = list()
+        for entry in root.find("BlockMap").findall("Range"):
+            blocks = entry.text.strip().split('-')
+            ranges.append((int(blocks[0]), int(blocks[-1]),
+                           entry.get("chksum") or entry.get("sha1")))
+        return cls(int(root.findtext("ImageSize")),
+                   int(root.findtext("BlockSize")), ranges, checksum_type)
+
+    @classmethod
+    def from_image(cls, image_file: str, block_size: int = 4096):
+        """
+        Generate a map of the blocks in an image file that are not holes.
+        Blocks that contain zeros are still mapped, since the drive written
+        to may hold stale data in them. Generated ranges are not given
+        checksums.
+        @param image_file: path to the image file
+        @param block_size: size of a block in bytes
+        @return: BlockMap for the image
+        """
+        image_size = os.path.getsize(image_file)
+        ranges = list()
+        with open(image_file, 'rb') as f:
+            for start, end in _get_data_extents(f.fileno(), image_size):
+                first = start // block_size
+                last = (end - 1) // block_size
+                if ranges and ranges[-1][1] >= first - 1:
+                    ranges[-1][1] = max(ranges[-1][1], last)
+                else:
+                    ranges.append([first, last])
+        ranges = [(first, last, None) for first, last in ranges]
+        return cls(image_size, block_size, ranges)
+
+    def to_xml(self) -> str:
+        """
+        Format this map as a bmaptool `.bmap` file (version 2.0).
+        @return: contents of a bmap file that `from_xml` can parse
+        """
+        ranges = "".join(
+            f'<Range chksum="{chksum}"> {first}-{last} </Range>' if chksum
+            else f"<Range> {first}-{last} </Range>"
+            for first, last, chksum in self.ranges)
+        return (f'<?xml version="1.0" ?><bmap version="2.0">'
+                f"<ImageSize> {self.image_size} </ImageSize>"
+                f"<BlockSize> {self.block_size} </BlockSize>"
+                f"<ChecksumType> {self.checksum_type} </ChecksumType>"
+                f"<BlockMap>{ranges}</BlockMap></bmap>")
+
+    @property
+    def mapped_bytes(self) -> int:
+        """
+        Get the number of bytes in mapped blocks.
+        """
+        return sum(end - start for start, end, _ in self.byte_ranges())
+
+    def byte_ranges(self) -> List[Tuple[int, int, Optional[str]]]:
+        """
+        Get mapped ranges as byte offsets.
+        @return: list of (start, end, checksum) with exclusive `end`
+        """
+        return [(first * self.block_size,
+                 min((last + 1) * self.block_size, self.image_size), chksum)
+                for first, last, chksum in self.ranges]
+
+
+def _get_data_extents(fd: int, size: int) -> List[Tuple[int, int]]:
+    """
+    Get the extents of a file that are not holes.
+    @param fd: file descriptor to check
+    @param size: size of the file
+    @return: list of (start, end) byte offsets
+    """
+    if not hasattr(os, "SEEK_DATA"):
+        return [(0, size)]
+    extents = list()
+    offset = 0
+    while offset < size:
+        try:
+            start = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError:
+            # No data after offset
+            break
+        end = os.lseek(fd, start, os.SEEK_HOLE)
+        extents.append((start, min(end, size)))
+        offset = end
+    return extents
+
+
+def strip_compression(image_path: str) -> str:
+    """
+    Get the path or URL of an image without query parameters or a
+    compression extension, i.e. `image.img` for `image.img.xz?v=1`.
+    @param image_path: path or URL of the image
+    @return: path or URL of the uncompressed image
+    """
+    path = image_path.split('?')[0]
+    for ext in (".xz", ".gz"):
+        if path.endswith(ext):
+            return path[:-len(ext)]
+    return path
+
+
+def get_block_map_names(image_path: str) -> List[str]:
+    """
+    Get the names a block map may be published with alongside an image, i.e.
+    `image.img.bmap` or `image.bmap` for `image.img`, `image.img.xz`, or
+    `image.img.gz`.
+    @param image_path: path or URL of the image
+    @return: list of possible block map paths or URLs
+    """
+    path = strip_compression(image_path)
+    names = [f"{path}.bmap"]
+    base, ext = os.path.splitext(path)
+    if ext and '/' not in ext:
+        names.append(f"{base}.bmap")
+    return names
+
+
+def fetch_block_map(image_url: str, timeout: float = 30) -> \
+        Optional[BlockMap]:
+    """
+    Download the block map published alongside an image.
+    @param image_url: URL of the image
+    @param timeout: seconds to wait for the server
+    @return: BlockMap if one was found, else None
+    """
+    for url in get_block_map_names(image_url):
+        try:
+            with urlopen(Request(url), timeout=timeout) as resp:
+                return BlockMap.from_xml(resp.read().decode())
+        except Exception as e:
+            LOG.debug(f"No block map at {url}: {e}")
+    LOG.info(f"No block map for {image_url}")
+    return None
+
+
+def _pwrite_all(fd: int, data: bytes, offset: int):
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+class _MappedWriter:
+    def __init__(self, fd: int, bmap: Optional[BlockMap],
+                 write_size: int = 4 * 1024 * 1024):
+        """
+        Write image data received in order to a device, skipping data outside
+        of mapped ranges, combining data into writes of up to `write_size`
+        bytes, and verifying the checksum of each mapped range.
+        @param fd: file descriptor of the device to write to
+        @param bmap: BlockMap of the image; if None, all data is written
+        @param write_size: maximum number of bytes per write
+        """
+        self.fd = fd
+        self.write_size = write_size
+        self.checksum_type = bmap.checksum_type if bmap else None
+        self.ranges = bmap.byte_ranges() if bmap else \
+            [(0, sys.maxsize, None)]
+        self.offset = 0
+        self.bytes_written = 0
+        self._range_idx = 0
+        self._hasher = None
+        self._pending = bytearray()
+        self._pending_start = 0
+
+    def seek(self, offset: int):
+        """
+        Skip ahead in the image. Skipped data must not be in a mapped range.
+        @param offset: byte offset of the next data to be written
+        """
+        self.offset = max(offset, self.offset)
+
+    def write(self, chunk: bytes):
+        """
+        Handle the next chunk of image data.
+        @param chunk: image data at the current offset
+        """
+        pos = 0
+        while pos < len(chunk) and self._range_idx < len(self.ranges):
+            start, end, chksum = self.ranges[self._range_idx]
+            current = self.offset + pos
+            if current < start:
+                pos += min(start - current, len(chunk) - pos)
+                continue
+            size = min(end - current, len(chunk) - pos)
+            data = chunk[pos:pos + size]
+            if chksum:
+                if current == start:
+                    self._hasher = hashlib.new(self.checksum_type)
+                self._hasher.update(data)
+            self._buffer(current, data)
+            pos += size
+            if current + size == end:
+                self._finish_range(start, end, chksum)
+        self.offset += len(chunk)
+
+    def _finish_range(self, start: int, end: int, chksum: Optional[str]):
+        self._range_idx += 1
+        if chksum and self._hasher.hexdigest() != chksum:
+            raise MediaWriteError("error_image_corrupt",
+                                  f"Checksum mismatch in bytes {start}-{end}")
+
+    def _buffer(self, offset: int, data: bytes):
+        if self._pending and \
+                self._pending_start + len(self._pending) != offset:
+            self.flush()
+        if not self._pending:
+            self._pending_start = offset
+        self._pending += data
+        if len(self._pending) >= self.write_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write any buffered data to the device.
+        """
+        if self._pending:
+            _pwrite_all(self.fd, self._pending, self._pending_start)
+            self.bytes_written += len(self._pending)
+            self._pending = bytearray()
+
+    def close(self):
+        """
+        Write buffered data and sync the device.
+        @raises MediaWriteError: if mapped data was not received
+        """
+        self.flush()
+        os.fsync(self.fd)
+        if self._range_idx < len(self.ranges) and \
+                self.ranges[self._range_idx][1] != sys.maxsize:
+            raise MediaWriteError("error_download",
+                                  f"Image ended at {self.offset} bytes")
+
+
+def write_image_to_device(image_file: str, device: str,
+                          bmap: Optional[BlockMap] = None,
+                          write_size: int = 4 * 1024 * 1024,
+                          on_progress: Optional[Callable[[dict], None]] =
+                          None) -> dict:
+    """
+    Write a downloaded OS image to a device. If a block map is specified,
+    only mapped ranges are read and written.
+    @param image_file: path to the uncompressed image
+    @param device: path of an existing device (or file) to write the image to
+    @param bmap: optional BlockMap of the image
+    @param write_size: maximum number of bytes per write
+    @param on_progress: optional callback with a progress dict after each write
+    @return: dict with `bytes_written`, `image_size`, and `elapsed` seconds
+    @raises MediaWriteError: if the image could not be written
+    """
+    if not os.path.exists(device):
+        raise MediaWriteError("no_valid_device", device)
+    if not os.path.isfile(image_file):
+        raise MediaWriteError("no_image_file", image_file)
+    image_size = os.path.getsize(image_file)
+    bmap = bmap or BlockMap(image_size, write_size,
+                            [(0, image_size // write_size, None)])
+    start_time = time()
+    try:
+        fd = os.open(device, os.O_WRONLY)
+        try:
+            writer = _MappedWriter(fd, bmap, write_size)
+            with open(image_file, 'rb') as src:
+                for start, end, _ in bmap.byte_ranges():
+                    src.seek(start)
+                    writer.seek(start)
+                    while start < end:
+                        # Keep reads aligned to `write_size` boundaries
+                        size = min(write_size - start % write_size,
+                                   end - start)
+                        chunk = src.read(size)
+                        if not chunk:
+                            break
+                        writer.write(chunk)
+                        start += len(chunk)
+                        if on_progress:
+                            on_progress({"bytes_written":
+                                         writer.bytes_written,
+                                         "total_bytes": bmap.mapped_bytes})
+            writer.close()
+        finally:
+            os.close(fd)
+    except MediaWriteError:
+        raise
+    except OSError as e:
+        raise MediaWriteError("error_unknown", str(e)) from e
+    elapsed = time() - start_time
+    LOG.info(f"Wrote {writer.bytes_written} of {image_size} bytes to "
+             f"{device} in {elapsed}s")
+    return {"bytes_written": writer.bytes_written, "image_size": image_size,
+            "elapsed": elapsed}
+
+
+def _compare_range(image_file: str, device: str, start: int,
+                   end: int) -> bool:
+    """
+    Compare the hash of a range of an image with the same range of a device.
+    This runs in a worker process.
+    @param image_file: path to the image that was written
+    @param device: path of the device the image was written to
+    @param start: first byte of the range
+    @param end: byte after the end of the range
+    @return: True if the device matches the image
+    """
+    offset = start - start % mmap.ALLOCATIONGRANULARITY
+    with open(image_file, 'rb') as f, \
+            mmap.mmap(f.fileno(), end - offset, offset=offset,
+                      access=mmap.ACCESS_READ) as source:
+        expected = hashlib.sha256(source[start - offset:]).digest()
+    fd = os.open(device, os.O_RDONLY)
+    try:
+        # Drop cached pages so data is read back from the device
+        os.posix_fadvise(fd, start, end - start, os.POSIX_FADV_DONTNEED)
+        written = hashlib.sha256()
+        position = start
+        while position < end:
+            data = os.pread(fd, min(end - position, 4 * 1024 * 1024),
+                            position)
+            if not data:
+                return False
+            written.update(data)
+            position += len(data)
+    finally:
+        os.close(fd)
+    return written.digest() == expected
+
+
+def verify_device(image_file: str, device: str,
+                  bmap: Optional[BlockMap] = None,
+                  chunk_size: int = 64 * 1024 * 1024,
+                  workers: Optional[int] = None) -> dict:
+    """
+    Read back an image written to a device and compare it with the image.
+    Fixed-size chunks are compared in parallel worker processes.
+    @param image_file: path to the image that was written
+    @param device: path of the device the image was written to
+    @param bmap: BlockMap used to write the image; only mapped ranges are
+        compared. If None, the whole image is compared.
+    @param chunk_size: number of bytes compared per task
+    @param workers: number of worker processes (default CPU count)
+    @return: dict with `verified`, `mismatches` (list of byte ranges),
+        `bytes_verified`, `elapsed` seconds, and `rate` in bytes/s
+    @raises MediaWriteError: if the image or device could not be read
+    """
+    if not os.path.exists(device):
+        raise MediaWriteError("no_valid_device", device)
+    if not os.path.isfile(image_file):
+        raise MediaWriteError("no_image_file", image_file)
+    ranges = [(start, end) for start, end, _ in bmap.byte_ranges()] if bmap \
+        else [(0, os.path.getsize(image_file))]
+    chunks = [(position, min(position + chunk_size, end))
+              for start, end in ranges
+              for position in range(start, end, chunk_size)]
+    start_time = time()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(
+                _compare_range, [image_file] * len(chunks),
+                [device] * len(chunks), *zip(*chunks))) if chunks else []
+    except OSError as e:
+        raise MediaWriteError("error_unknown", str(e)) from e
+    elapsed = time() - start_time
+    bytes_verified = sum(end - start for start, end in chunks)
+    mismatches = [chunk for chunk, match in zip(chunks, results)
+                  if not match]
+    rate = bytes_verified / elapsed if elapsed else 0.0
+    LOG.info(f"Verified {bytes_verified} bytes of {device} in {elapsed}s "
+             f"({rate / 1024 / 1024:.1f} MiB/s): {len(mismatches)} mismatches")
+    return {"verified": not mismatches, "mismatches": mismatches,
+            "bytes_verified": bytes_verified, "elapsed": elapsed,
+            "rate": rate}
+
+
+def set_background_priority(niceness: int = 10, low_io: bool = True):
+    """
+    Lower the CPU and I/O priority of the calling thread so that it does not
+    compete with audio processing. Threads and processes started by it
+    afterwards inherit the lower priority. This does nothing outside of Linux.
+    @param niceness: minimum nice value to run at
+    @param low_io: if True, do disk I/O at the lowest best-effort priority.
+        The idle class is not used since it can starve writes indefinitely
+        on a busy disk.
+    """
+    if not sys.platform.startswith("linux"):
+        return
+    # On Linux, these apply to the thread rather than the whole process
+    tid = get_native_id()
+    try:
+        os.setpriority(os.PRIO_PROCESS, tid,
+                       max(os.getpriority(os.PRIO_PROCESS, tid), niceness))
+    except OSError as e:
+        LOG.warning(f"Failed to set CPU priority: {e}")
+    if low_io:
+        try:
+            result = subprocess.run(["ionice", "-c", "2", "-n", "7", "-p",
+                                     str(tid)], capture_output=True)
+            if result.returncode != 0:
+                LOG.warning(f"Failed to set I/O priority "
+                            f"(code={result.returncode}): "
+                            f"{result.stderr.decode().strip()}")
+        except OSError as e:
+            LOG.warning(f"Failed to set I/O priority: {e}")
+
+
+class RateLimiter:
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        """
+        Thread-safe token bucket limiting throughput across threads.
+        @param rate: maximum average bytes per second
+        @param burst: maximum bytes allowed at once (default 1s at `rate`)
+        """
+        self.rate = rate
+        self.burst = burst or rate
+        self._tokens = self.burst
+        self._updated = time()
+        self._lock = Lock()
+
+    def consume(self, num_bytes: int):
+        """
+        Wait until `num_bytes` may be transferred without exceeding the rate.
+        @param num_bytes: number of bytes transferred
+        """
+        with self._lock:
+            now = time()
+            refill = (now - self._updated) * self.rate
+            self._tokens = min(self.burst, self._tokens + refill)
+            self._updated = now
+            self._tokens -= num_bytes
+            # Reserve the tokens now so concurrent callers wait their turn
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+        if delay:
+            sleep(delay)
+
+
+def _get_rate_limiter(max_rate: Optional[float]) -> Optional[RateLimiter]:
+    return RateLimiter(max_rate) if max_rate else None
+
+
+def get_compression_suffix(url: str) -> str:
+    """
+    Get the compression extension of an image URL.
+    @param url: URL of an image
+    @return: `.xz`, `.gz`, or an empty string for raw images
+    """
+    path = url.split('?')[0]
+    return next((ext for ext in (".xz", ".gz") if path.endswith(ext)), "")
+
+
+def _get_decompressor(url: str):
+    """
+    Get a streaming decompressor for an image URL based on its extension.
+    @param url: URL of the image to download
+    @return: object with a `decompress` method, or None for raw images
+    """
+    suffix = get_compression_suffix(url)
+    if suffix == ".xz":
+        return lzma.LZMADecompressor()
+    if suffix == ".gz":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    return None
+
+
+class _ImageReader(Thread):
+    def __init__(self, url: str, buffer: Queue, stop: Event, chunk_size: int,
+                 timeout: float, limiter: Optional[RateLimiter] = None,
+                 decompress: bool = True,
+                 mirrors: Optional[List[str]] = None, verified: bool = False,
+                 can_run: Optional[Callable[[], bool]] = None):
+        """
+        Thread that downloads and decompresses an image into a bounded buffer.
+        A chunk of `None` marks the end of the image. A SHA-256 digest of the
+        downloaded (compressed) data is computed as it is received. If the
+        download fails, it continues from the same offset on the next mirror
+        if the mirror serves the same file (by size and ETag) or the download
+        will be verified.
+        @param url: URL of the image to download
+        @param buffer: Queue to put image chunks into
+        @param stop: Event set when the consumer stops reading
+        @param chunk_size: number of bytes to read per request
+        @param timeout: seconds to wait for the server
+        @param limiter: optional RateLimiter to limit download bandwidth
+        @param decompress: if False, put downloaded data as-is
+        @param mirrors: optional URLs of the same file to fail over to
+        @param verified: if True, the digest of the download is checked after
+            it completes, so failover may continue from a mirror that can't be
+            shown to serve the same file
+        @param can_run: optional callback; while it returns False, reading is
+            paused
+        """
+        Thread.__init__(self, daemon=True)
+        self.url = url
+        self.urls = [url] + list(mirrors or [])
+        self.source = url
+        self.buffer = buffer
+        self.stop = stop
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.limiter = limiter
+        self.decompress = decompress
+        self.verified = verified
+        self.can_run = can_run
+        self.paused = False
+        self.bytes_read = 0
+        self.total_bytes = None
+        self.size = None
+        self.etag = None
+        self.sha256 = hashlib.sha256()
+        self.error: Optional[Exception] = None
+
+    def _put(self, chunk: Optional[bytes]) -> bool:
+        while not self.stop.is_set():
+            try:
+                self.buffer.put(chunk, timeout=0.5)
+                return True
+            except Full:
+                continue
+        return False
+
+    def _wait(self):
+        """
+        Wait while `can_run` returns False and the consumer is still reading.
+        """
+        if not self.can_run:
+            return
+        while not self.can_run() and not self.stop.is_set():
+            if not self.paused:
+                LOG.info(f"Pausing download after {self.bytes_read} bytes")
+                self.paused = True
+            self.stop.wait(0.5)
+        if self.paused:
+            LOG.info(f"Resuming download after {self.bytes_read} bytes")
+            self.paused = False
+
+    def _read(self, url: str, decompressor) -> bool:
+        """
+        Read the image from `url`, starting after the bytes already read.
+        @return: False if the consumer stopped reading
+        """
+        headers = {"Range": f"bytes={self.bytes_read}-"} \
+            if self.bytes_read else dict()
+        with urlopen(Request(url, headers=headers),
+                     timeout=self.timeout) as resp:
+            if self.bytes_read:
+                self._check_resumed(resp)
+            self.source = url
+            length = resp.headers.get("Content-Length")
+            self.total_bytes = self.bytes_read + int(length) if length \
+                else None
+            if not self.bytes_read:
+                self.size = self.total_bytes
+                self.etag = resp.headers.get("ETag")
+            while not self.stop.is_set():
+                self._wait()
+                chunk = resp.read(self.chunk_size)
+                if not chunk:
+                    break
+                self.bytes_read += len(chunk)
+                if self.limiter:
+                    self.limiter.consume(len(chunk))
+                self.sha256.update(chunk)
+                if decompressor:
+                    chunk = decompressor.decompress(chunk)
+                if chunk and not self._put(chunk):
+                    return False
+        if self.total_bytes and self.bytes_read != self.total_bytes:
+            raise IOError(f"Expected {self.total_bytes} bytes but read "
+                          f"{self.bytes_read}")
+        return True
+
+    def _check_resumed(self, resp):
+        """
+        Check that a range response continues the file already read.
+        @param resp: response to a request starting at `bytes_read`
+        @raises IOError: if the response can't be appended to the download
+        """
+        if resp.status != 206:
+            raise IOError(f"Range not supported (status={resp.status})")
+        content_range = resp.headers.get("Content-Range") or ""
+        match = re.match(r"bytes (\d+)-\d+/(\d+|\*)", content_range)
+        if not match or int(match.group(1)) != self.bytes_read:
+            raise IOError(f"Range does not start at {self.bytes_read}: "
+                          f"{content_range}")
+        if self.verified:
+            # A different file is caught when the digest is checked
+            return
+        if not self.size or match.group(2) != str(self.size) or \
+                not self.etag or resp.headers.get("ETag") != self.etag:
+            raise IOError(f"Can't verify that the file is unchanged "
+                          f"(ETag={resp.headers.get('ETag')}, "
+                          f"Content-Range={content_range})")
+
+    def run(self):
+        decompressor = _get_decompressor(self.url) if self.decompress \
+            else None
+        for url in self.urls:
+            try:
+                if not self._read(url, decompressor):
+                    return
+                self.error = None
+                break
+            except Exception as e:
+                self.error = e
+                if self.stop.is_set():
+                    break
+                LOG.warning(f"Download from {url} failed after "
+                            f"{self.bytes_read} bytes: {e}")
+        self._put(None)
+
+
+def fetch_digest(image_url: str, timeout: float = 30) -> Optional[str]:
+    """
+    Download the SHA-256 digest published alongside an image as
+    `<image_url>.sha256`, in `sha256sum` output format.
+    @param image_url: URL of the image
+    @param timeout: seconds to wait for the server
+    @return: hex digest if one was found, else None
+    """
+    url = image_url.split('?')[0]
+    try:
+        with urlopen(Request(f"{url}.sha256"), timeout=timeout) as resp:
+            digest = resp.read().decode().split()[0].lower()
+        int(digest, 16)
+        if len(digest) != 64:
+            raise ValueError(f"Invalid SHA-256 digest: {digest}")
+        return digest
+    except Exception as e:
+        LOG.info(f"No digest for {image_url}: {e}")
+        return None
+
+
+def _stream_image(url: str, fd: int, chunk_size: int, buffer_chunks: int,
+                  timeout: float, bmap: Optional[BlockMap],
+                  sha256: Optional[str],
+                  on_progress: Optional[Callable[[dict], None]],
+                  max_rate: Optional[float] = None,
+                  decompress: bool = True,
+                  mirrors: Optional[List[str]] = None,
+                  can_run: Optional[Callable[[], bool]] = None) -> dict:
+    """
+    Download an image and write it to an open file descriptor as it is
+    received. The image is only synced if it matches the expected digest.
+    """
+    buffer = Queue(maxsize=buffer_chunks)
+    stop = Event()
+    reader = _ImageReader(url, buffer, stop, chunk_size, timeout,
+                          _get_rate_limiter(max_rate), decompress, mirrors,
+                          bool(sha256), can_run)
+    start_time = time()
+    reader.start()
+    try:
+        writer = _MappedWriter(fd, bmap)
+        while True:
+            try:
+                chunk = buffer.get(timeout=timeout)
+            except Empty:
+                if reader.paused:
+                    continue
+                raise MediaWriteError("error_download",
+                                      "Timed out waiting for image data")
+            if chunk is None:
+                break
+            writer.write(chunk)
+            if on_progress:
+                on_progress({"bytes_read": reader.bytes_read,
+                             "total_bytes": reader.total_bytes,
+                             "bytes_written": writer.bytes_written})
+        if reader.error:
+            raise MediaWriteError("error_download", str(reader.error)) \
+                from reader.error
+        digest = reader.sha256.hexdigest()
+        if sha256 and digest != sha256.lower():
+            raise MediaWriteError("error_image_corrupt",
+                                  f"Expected SHA-256 {sha256} but downloaded "
+                                  f"{digest}")
+        writer.close()
+        if on_progress:
+            # Report data that was buffered until the writer was closed
+            on_progress({"bytes_read": reader.bytes_read,
+                         "total_bytes": reader.total_bytes,
+                         "bytes_written": writer.bytes_written})
+    except OSError as e:
+        raise MediaWriteError("error_unknown", str(e)) from e
+    finally:
+        stop.set()
+        reader.join(timeout)
+    return {"bytes_read": reader.bytes_read,
+            "bytes_written": writer.bytes_written,
+            "image_size": writer.offset, "sha256": digest,
+            "verified": bool(sha256), "source": reader.source,
+            "elapsed": time() - start_time}
+
+
+def stream_image_to_device(url: str, device: str,
+                           chunk_size: int = 1024 * 1024,
+                           buffer_chunks: int = 16, timeout: float = 30,
+                           bmap: Optional[BlockMap] = None,
+                           sha256: Optional[str] = None,
+                           on_progress: Optional[Callable[[dict], None]] =
+                           None, max_rate: Optional[float] = None,
+                           mirrors: Optional[List[str]] = None) -> dict:
+    """
+    Download an OS image and write it to a device as it is received. At most
+    `buffer_chunks` chunks are held in memory; if the device is slower than
+    the download, the download waits for writes to catch up.
+    @param url: URL of the image to download (raw, `.xz`, or `.gz`)
+    @param device: path of an existing device (or file) to write the image to
+    @param chunk_size: number of bytes to read from the server at a time
+    @param buffer_chunks: maximum number of chunks buffered in memory
+    @param timeout: seconds to wait for the server or for buffered data
+    @param bmap: optional BlockMap of the uncompressed image; only mapped
+        ranges are written
+    @param sha256: optional expected SHA-256 digest of the downloaded file
+    @param on_progress: optional callback with a progress dict after each write
+    @param max_rate: optional maximum download rate in bytes/s
+    @param mirrors: optional URLs of the same image to fail over to
+    @return: dict with `bytes_read`, `bytes_written`, `image_size`, `sha256`
+        of the download, `verified`, the `source` URL, and `elapsed` seconds
+    @raises MediaWriteError: if the image could not be downloaded or written
+    """
+    if not url:
+        raise MediaWriteError("error_download", "No image URL")
+    if not os.path.exists(device):
+        raise MediaWriteError("no_valid_device", device)
+    try:
+        # Devices are not truncated or created; this fails if it is missing
+        fd = os.open(device, os.O_WRONLY)
+    except OSError as e:
+        raise MediaWriteError("no_valid_device", str(e)) from e
+    try:
+        result = _stream_image(url, fd, chunk_size, buffer_chunks, timeout,
+                               bmap, sha256, on_progress, max_rate,
+                               mirrors=mirrors)
+    finally:
+        os.close(fd)
+    LOG.info(f"Wrote {result['bytes_written']} of {result['image_size']} "
+             f"bytes to {device} in {result['elapsed']}s")
+    return result
+
+
+def download_image(url: str, image_file: str, chunk_size: int = 1024 * 1024,
+                   buffer_chunks: int = 16, timeout: float = 30,
+                   sha256: Optional[str] = None,
+                   on_progress: Optional[Callable[[dict], None]] = None,
+                   max_rate: Optional[float] = None,
+                   decompress: bool = True,
+                   mirrors: Optional[List[str]] = None,
+                   can_run: Optional[Callable[[], bool]] = None) -> dict:
+    """
+    Download and decompress an OS image to a file, computing the SHA-256
+    digest of the download as it is received so the file does not need to
+    be read again to be verified. The file is removed if the download fails
+    or does not match `sha256`.
+    @param url: URL of the image to download (raw, `.xz`, or `.gz`)
+    @param image_file: path to write the uncompressed image to
+    @param chunk_size: number of bytes to read from the server at a time
+    @param buffer_chunks: maximum number of chunks buffered in memory
+    @param timeout: seconds to wait for the server or for buffered data
+    @param sha256: optional expected SHA-256 digest of the downloaded file
+    @param on_progress: optional callback with a progress dict after each write
+    @param max_rate: optional maximum download rate in bytes/s
+    @param decompress: if False, save the download without decompressing it
+    @param mirrors: optional URLs of the same image to fail over to
+    @param can_run: optional callback; while it returns False, the download
+        is paused, i.e. to give way to user interaction
+    @return: dict with `bytes_read`, `image_size`, `sha256` of the download,
+        `verified`, the `source` URL, and `elapsed` seconds
+    @raises MediaWriteError: if the image could not be downloaded or verified
+    """
+    if not url:
+        raise MediaWriteError("error_download", "No image URL")
+    try:
+        fd = os.open(image_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+    except OSError as e:
+        raise MediaWriteError("error_unknown", str(e)) from e
+    try:
+        result = _stream_image(url, fd, chunk_size, buffer_chunks, timeout,
+                               None, sha256, on_progress, max_rate,
+                               decompress, mirrors, can_run)
+    except MediaWriteError:
+        os.remove(image_file)
+        raise
+    finally:
+        os.close(fd)
+    LOG.info(f"Downloaded {result['bytes_read']} bytes to {image_file} in "
+             f"{result['elapsed']}s (sha256={result['sha256']})")
+    return result
+
+
+def _get_range_support(url: str, timeout: float) -> Tuple[Optional[int],
+                                                          Optional[str]]:
+    """
+    Check if a server supports range requests for a URL.
+    @param url: URL of the file to download
+    @param timeout: seconds to wait for the server
+    @return: file size (None if ranges are not supported) and ETag
+    """
+    with urlopen(Request(url, method="HEAD"), timeout=timeout) as resp:
+        length = resp.headers.get("Content-Length")
+        ranges = resp.headers.get("Accept-Ranges", "")
+        etag = resp.headers.get("ETag")
+    if "bytes" not in ranges or not length:
+        return None, etag
+    return int(length), etag
+
+
+def _fetch_segment(urls: List[str], fd: int, start: int, end: int,
+                   timeout: float, retries: int, stop: Event,
+                   limiter: Optional[RateLimiter] = None) -> int:
+    """
+    Download a range of a file into the same range of an open file. Failed
+    requests are retried on the next URL.
+    @param urls: URLs of the file to download, in order of preference
+    @param fd: file descriptor to write to
+    @param start: first byte of the range
+    @param end: byte after the end of the range
+    @param timeout: seconds to wait for the server
+    @param retries: number of times to retry a failed request; each URL is
+        tried at least once
+    @param stop: Event set when the download is cancelled
+    @param limiter: optional RateLimiter shared by all segments
+    @return: number of bytes downloaded, including failed attempts
+    """
+    received = 0
+    retries = max(retries, len(urls) - 1)
+    for attempt in range(retries + 1):
+        position = start
+        url = urls[attempt % len(urls)]
+        try:
+            request = Request(url, headers={"Range": f"bytes={start}-{end - 1}"})
+            with urlopen(request, timeout=timeout) as resp:
+                if resp.status != 206:
+                    raise IOError(f"Range not supported (status={resp.status})")
+                while position < end and not stop.is_set():
+                    chunk = resp.read(min(end - position, 1024 * 1024))
+                    if not chunk:
+                        break
+                    if limiter:
+                        limiter.consume(len(chunk))
+                    _pwrite_all(fd, chunk, position)
+                    position += len(chunk)
+                    received += len(chunk)
+            if stop.is_set():
+                return received
+            if position != end:
+                raise IOError(f"Expected {end - start} bytes but read "
+                              f"{position - start}")
+            return received
+        except Exception as e:
+            if attempt == retries or stop.is_set():
+                raise
+            LOG.warning(f"Retrying bytes {start}-{end} of {url}: {e}")
+            if (attempt + 1) % len(urls) == 0:
+                # Back off once every URL has failed
+                stop.wait(min(2 ** (attempt // len(urls)), 30))
+    return received
+
+
+def _download_unsegmented(url: str, image_file: str, timeout: float,
+                          sha256: Optional[str],
+                          on_progress: Optional[Callable[[dict], None]],
+                          max_rate: Optional[float],
+                          mirrors: List[str]) -> dict:
+    """
+    Download an image with `download_image`, reporting progress and results
+    in the same format as `download_segmented`.
+    """
+    start_time = time()
+
+    def _on_progress(progress: dict):
+        if not progress["total_bytes"]:
+            # Progress can't be reported without the size of the download
+            return
+        elapsed = time() - start_time
+        on_progress({"bytes_read": progress["bytes_read"],
+                     "bytes_done": progress["bytes_read"],
+                     "total_bytes": progress["total_bytes"],
+                     "rate": progress["bytes_read"] / elapsed
+                     if elapsed else 0.0})
+
+    result = download_image(url, image_file, timeout=timeout, sha256=sha256,
+                            on_progress=_on_progress if on_progress else None,
+                            max_rate=max_rate, mirrors=mirrors)
+    result["resumed_bytes"] = 0
+    result["rate"] = result["bytes_read"] / result["elapsed"] if \
+        result["elapsed"] else 0.0
+    return result
+
+
+def download_segmented(url: str, image_file: str, connections: int = 4,
+                       segment_size: int = 8 * 1024 * 1024, retries: int = 3,
+                       timeout: float = 30, sha256: Optional[str] = None,
+                       on_progress: Optional[Callable[[dict], None]] = None,
+                       max_rate: Optional[float] = None,
+                       mirrors: Optional[List[str]] = None) -> dict:
+    """
+    Download an OS image with multiple concurrent range requests. Segments
+    are written into a preallocated `<image_file>.part` file and completed
+    segments are saved so an interrupted download can be resumed. Completed
+    segments are hashed (and decompressed) in order while later segments
+    download. If the server does not support range requests, this falls back
+    to `download_image`.
+    @param url: URL of the image to download (raw, `.xz`, or `.gz`)
+    @param image_file: path to write the uncompressed image to
+    @param connections: number of concurrent requests
+    @param segment_size: number of bytes per range request
+    @param retries: number of times to retry each failed segment
+    @param timeout: seconds to wait for the server
+    @param sha256: optional expected SHA-256 digest of the downloaded file
+    @param on_progress: optional callback with a progress dict after each
+        completed segment
+    @param max_rate: optional maximum combined download rate in bytes/s
+    @param mirrors: optional URLs of the same image to retry failed segments
+        on
+    @return: dict with `bytes_read`, `resumed_bytes`, `image_size`, `sha256`
+        of the download, `verified`, `elapsed` seconds, and `rate` in bytes/s
+    @raises MediaWriteError: if the image could not be downloaded or verified
+    """
+    if not url:
+        raise MediaWriteError("error_download", "No image URL")
+    part_file = f"{image_file}.part"
+    state_file = f"{part_file}.json"
+    urls = [url] + list(mirrors or [])
+    try:
+        # Resume from the same source so the saved state stays valid
+        with open(state_file) as f:
+            saved_url = json.load(f).get("url")
+        if saved_url in urls[1:]:
+            urls.remove(saved_url)
+            urls.insert(0, saved_url)
+            url = saved_url
+    except (OSError, ValueError):
+        pass
+    mirrors = urls[1:]
+    try:
+        size, etag = _get_range_support(url, timeout)
+    except Exception as e:
+        LOG.warning(f"Failed to check range support for {url}: {e}")
+        size = None
+    if not size:
+        LOG.info(f"Range requests not supported for {url}")
+        return _download_unsegmented(url, image_file, timeout, sha256,
+                                     on_progress, max_rate, mirrors)
+
+    num_segments = (size + segment_size - 1) // segment_size
+    state = {"url": url, "size": size, "etag": etag,
+             "segment_size": segment_size, "done": "0" * num_segments}
+    try:
+        with open(state_file) as f:
+            saved = json.load(f)
+        if all(saved.get(key) == state[key]
+               for key in ("url", "size", "etag", "segment_size")) and \
+                os.path.getsize(part_file) == size:
+            state = saved
+    except (OSError, ValueError):
+        pass
+    done = [flag == "1" for flag in state["done"]]
+    resumed_bytes = sum(min(segment_size, size - idx * segment_size)
+                        for idx, flag in enumerate(done) if flag)
+    if resumed_bytes:
+        LOG.info(f"Resuming download of {url} ({resumed_bytes} bytes done)")
+
+    def _save_state():
+        # Segments must be on disk before they are saved as done
+        os.fsync(fd)
+        state["done"] = "".join("1" if flag else "0" for flag in done)
+        tmp_path = f"{state_file}.tmp"
+        with open(tmp_path, 'w+') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, state_file)
+
+    decompressor = _get_decompressor(url)
+    hasher = hashlib.sha256()
+    next_segment = 0
+    bytes_read = 0
+    start_time = time()
+    stop = Event()
+    limiter = _get_rate_limiter(max_rate)
+    fd = os.open(part_file, os.O_RDWR | os.O_CREAT)
+    out = open(image_file, 'wb') if decompressor else None
+    try:
+        if not resumed_bytes:
+            os.ftruncate(fd, size)
+        _save_state()
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            futures = {executor.submit(
+                _fetch_segment, urls, fd, idx * segment_size,
+                min((idx + 1) * segment_size, size), timeout, retries,
+                stop, limiter): idx
+                for idx, flag in enumerate(done) if not flag}
+            pending = set(futures)
+            while True:
+                # Hash and decompress completed segments in order
+                while next_segment < num_segments and done[next_segment]:
+                    data = os.pread(fd, segment_size,
+                                    next_segment * segment_size)
+                    hasher.update(data)
+                    if out:
+                        out.write(decompressor.decompress(data))
+                    next_segment += 1
+                if not pending:
+                    break
+                completed, pending = wait(pending,
+                                          return_when=FIRST_COMPLETED)
+                for future in completed:
+                    if future.exception():
+                        stop.set()
+                        raise future.exception()
+                    bytes_read += future.result()
+                    done[futures[future]] = True
+                _save_state()
+                if on_progress:
+                    elapsed = time() - start_time
+                    on_progress({"bytes_read": bytes_read,
+                                 "bytes_done": sum(
+                                     min(segment_size,
+                                         size - idx * segment_size)
+                                     for idx in range(num_segments)
+                                     if done[idx]),
+                                 "total_bytes": size,
+                                 "rate": bytes_read / elapsed
+                                 if elapsed else 0.0})
+    except MediaWriteError:
+        raise
+    except Exception as e:
+        stop.set()
+        LOG.error(f"Download of {url} interrupted: {e}")
+        raise MediaWriteError("error_download", str(e)) from e
+    finally:
+        os.close(fd)
+        if out:
+            out.close()
+    digest = hasher.hexdigest()
+    os.remove(state_file)
+    if sha256 and digest != sha256.lower():
+        os.remove(part_file)
+        if out:
+            os.remove(image_file)
+        raise MediaWriteError("error_image_corrupt",
+                              f"Expected SHA-256 {sha256} but downloaded "
+                              f"{digest}")
+    if out:
+        os.remove(part_file)
+    else:
+        os.replace(part_file, image_file)
+    elapsed = time() - start_time
+    rate = bytes_read / elapsed if elapsed else 0.0
+    LOG.info(f"Downloaded {bytes_read} bytes to {image_file} in {elapsed}s "
+             f"({rate / 1024 / 1024:.1f} MiB/s, {connections} connections)")
+    return {"bytes_read": bytes_read, "resumed_bytes": resumed_bytes,
+            "image_size": os.path.getsize(image_file), "sha256": digest,
+            "verified": bool(sha256), "elapsed": elapsed, "rate": rate}
@@ -0,0 +1,219 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2025 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+import os
+import re
+import shutil
+import socket
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import time
+from typing import List, Optional, Tuple
+
+from ovos_utils.log import LOG
+
+
+_DIGEST = re.compile(r"^[0-9a-f]{64}$")
+
+
+class PeerCache:
+    def __init__(self, path: str, max_bytes: int, http_port: int = 0,
+                 discovery_port: int = 0):
+        """
+        Store of verified update payloads, named by their SHA-256 digest, that
+        are served to other devices on the local network. Peers are found by
+        sending a UDP query for a digest; devices with the payload reply with
+        the port their HTTP server listens on. The least recently used
+        payloads are removed to keep the store within `max_bytes`.
+        @param path: directory to store payloads in
+        @param max_bytes: maximum total size of stored payloads
+        @param http_port: TCP port to serve payloads on (0 for any)
+        @param discovery_port: UDP port to answer queries on (0 for any)
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.http_port = http_port
+        self.discovery_port = discovery_port
+        self.served = 0
+        self._http: Optional[ThreadingHTTPServer] = None
+        self._udp: Optional[socket.socket] = None
+        self._lock = Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def get(self, sha256: str) -> Optional[str]:
+        """
+        Get a stored payload.
+        @param sha256: digest of the payload
+        @return: path to the payload, else None
+        """
+        sha256 = sha256.lower()
+        if not _DIGEST.match(sha256):
+            return None
+        for name in os.listdir(self.path):
+            if name.split('.')[0] == sha256 and not name.endswith(".part"):
+                path = os.path.join(self.path, name)
+                # Modification time is used to evict the least recently used
+                os.utime(path)
+                return path
+        return None
+
+    def put(self, payload_file: str, sha256: str, suffix: str = "") -> str:
+        """
+        Move a payload that has been verified against `sha256` into the store.
+        @param payload_file: path to the payload
+        @param sha256: digest of the payload
+        @param suffix: file extension to keep, i.e. `.xz`
+        @return: path to the stored payload
+        """
+        path = os.path.join(self.path, f"{sha256.lower()}{suffix}")
+        with self._lock:
+            shutil.move(payload_file, path)
+            self._evict(keep=path)
+        return path
+
+    def _evict(self, keep: str):
+        files = [os.path.join(self.path, name)
+                 for name in os.listdir(self.path)
+                 if not name.endswith(".part")]
+        total = sum(os.path.getsize(path) for path in files)
+        for path in sorted(files, key=os.path.getmtime):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            total -= os.path.getsize(path)
+            os.remove(path)
+            LOG.info(f"Evicted peer payload: {path}")
+
+    def start(self, host: str = ""):
+        """
+        Start serving payloads and answering peer queries.
+        @param host: address to listen on (default all interfaces)
+        """
+        cache = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = cache.get(self.path.strip('/'))
+                if not path:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Length",
+                                 str(os.path.getsize(path)))
+                self.end_headers()
+                with open(path, 'rb') as f:
+                    shutil.copyfileobj(f, self.wfile, 1024 * 1024)
+                cache.served += 1
+
+            def log_message(self, *args):
+                pass
+
+        self._http = ThreadingHTTPServer((host, self.http_port), _Handler)
+        self.http_port = self._http.server_port
+        Thread(target=self._http.serve_forever, daemon=True).start()
+        self._udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._udp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._udp.bind((host, self.discovery_port))
+        self.discovery_port = self._udp.getsockname()[1]
+        Thread(target=self._answer_queries, args=(self._udp,),
+               daemon=True).start()
+        LOG.info(f"Serving update payloads on port {self.http_port} "
+                 f"(discovery port {self.discovery_port})")
+
+    def stop(self):
+        """
+        Stop serving payloads.
+        """
+        if self._http:
+            self._http.shutdown()
+            self._http.server_close()
+            self._http = None
+        if self._udp:
+            self._udp.close()
+            self._udp = None
+
+    def _answer_queries(self, sock: socket.socket):
+        while True:
+            try:
+                data, address = sock.recvfrom(1024)
+            except OSError:
+                # Socket closed
+                return
+            try:
+                query = json.loads(data)
+                if query.get("type") != "neon.update.peer.query" or \
+                        not self.get(query["sha256"]):
+                    continue
+                sock.sendto(json.dumps({
+                    "type": "neon.update.peer.available",
+                    "sha256": query["sha256"],
+                    "port": self.http_port}).encode(), address)
+            except Exception as e:
+                LOG.debug(f"Ignoring peer query from {address}: {e}")
+
+
+def find_peers(sha256: str, addresses: List[Tuple[str, int]],
+               timeout: float = 1.0) -> List[str]:
+    """
+    Find devices on the local network that have a payload.
+    @param sha256: digest of the payload
+    @param addresses: (host, port) to send queries to; may be a broadcast
+        address
+    @param timeout: seconds to wait for replies
+    @return: URLs of the payload on peers, in the order they replied
+    """
+    urls = list()
+    query = json.dumps({"type": "neon.update.peer.query",
+                        "sha256": sha256.lower()}).encode()
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        for address in addresses:
+            try:
+                sock.sendto(query, address)
+            except OSError as e:
+                LOG.warning(f"Failed to query peers at {address}: {e}")
+        deadline = time() + timeout
+        while time() < deadline:
+            sock.settimeout(max(deadline - time(), 0.01))
+            try:
+                data, (host, _) = sock.recvfrom(1024)
+                reply = json.loads(data)
+            except socket.timeout:
+                break
+            except ValueError:
+                continue
+            if reply.get("type") == "neon.update.peer.available" and \
+                    reply.get("sha256") == sha256.lower():
+                url = f"http://{host}:{reply['port']}/{sha256.lower()}"
+                if url not in urls:
+                    urls.append(url)
+    LOG.debug(f"Found peers for {sha256}: {urls}")
+    return urls
@@ -0,0 +1,151 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2025 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Fleet simulation of periodic update checks.
+
+N skill instances, each with its own bus and device ID, start at the same time
+as they would after a fleet-wide power event. A local stand-in backend answers
+`neon.check_update_squashfs` and counts requests per time bucket. Checks on
+startup followed by a fixed interval are compared with a background startup
+delay followed by device-jittered periodic checks (`update_check_interval`).
+
+    python test/benchmarks/bench_check_schedule.py --instances 20 \
+        --interval 30 --duration 120 --bucket 5
+"""
+
+import argparse
+
+from collections import Counter
+from os import environ
+from tempfile import mkdtemp
+from threading import Lock, Thread
+from time import sleep, time
+
+from ovos_bus_client import Message
+from ovos_utils.fakebus import FakeBus
+
+
+class _FixedScheduler:
+    """
+    Check at exactly `interval` seconds, without jitter or backoff.
+    """
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.failures = 0
+
+    def first_delay(self) -> float:
+        return self.interval
+
+    def next_delay(self, success: bool) -> float:
+        return self.interval
+
+
+def get_skill(bus: FakeBus, idx: int):
+    environ.setdefault("XDG_DATA_HOME", mkdtemp())
+    environ.setdefault("XDG_CONFIG_HOME", mkdtemp())
+    from neon_minerva.skill import get_skill_object
+    skill = get_skill_object(skill_entrypoint="skill-update.neongeckocom",
+                             skill_id=f"skill-update.fleet{idx}", bus=bus)
+    skill.settings["update_initramfs"] = False
+    skill.settings["update_squashfs"] = True
+    skill.settings["update_python"] = False
+    skill.settings["notify_updates"] = False
+    skill.settings["update_check_ttl"] = 0
+    return skill
+
+
+def add_backend(bus: FakeBus, requests: list, lock: Lock):
+    def _respond(message: Message):
+        with lock:
+            requests.append(time())
+        bus.emit(message.response({"update_available": False,
+                                   "track": message.data.get("track")}))
+
+    bus.on("neon.check_update_squashfs", _respond)
+
+
+def simulate(args, jittered: bool) -> list:
+    from skill_update.update_schedule import CheckScheduler
+    requests = list()
+    lock = Lock()
+    skills = list()
+    for idx in range(args.instances):
+        bus = FakeBus()
+        add_backend(bus, requests, lock)
+        skill = get_skill(bus, idx)
+        skill._clear_update_metadata()
+        skill.settings["update_check_interval"] = args.interval
+        if jittered:
+            skill.settings["background_startup"] = True
+            skill.settings["startup_delay"] = args.interval
+            skill._check_scheduler = CheckScheduler(f"device-{idx}",
+                                                    args.interval)
+        else:
+            skill._check_scheduler = _FixedScheduler(args.interval)
+        skills.append(skill)
+
+    start = time()
+    for skill in skills:
+        Thread(target=skill._on_ready, args=(Message("mycroft.ready"),),
+               daemon=True).start()
+    sleep(args.duration)
+    for skill in skills:
+        skill.shutdown()
+    return [t - start for t in requests if t - start < args.duration]
+
+
+def report(name: str, requests: list, args):
+    counts = Counter(int(t // args.bucket) for t in requests)
+    buckets = int(args.duration // args.bucket)
+    peak = max(counts.values()) if counts else 0
+    print(f"{name}: {len(requests)} requests, peak {peak} per "
+          f"{args.bucket}s ({peak / args.bucket:.1f}/s)")
+    for bucket in range(buckets):
+        count = counts.get(bucket, 0)
+        print(f"  {bucket * args.bucket:6.0f}s {count:4d} {'#' * count}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--instances", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=30,
+                        help="seconds between periodic checks")
+    parser.add_argument("--duration", type=float, default=120)
+    parser.add_argument("--bucket", type=float, default=5,
+                        help="seconds per reported request-rate bucket")
+    args = parser.parse_args()
+
+    print(f"instances={args.instances} interval={args.interval}s "
+          f"duration={args.duration}s")
+    report("startup + fixed interval", simulate(args, False), args)
+    report("jittered startup + periodic", simulate(args, True), args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2025 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Throughput benchmark for OS media creation.
+
+A local HTTP server stands in for the image host and serves a generated image
+at a limited rate. Downloading the whole image and then writing it to the
+device (the `neon.download_os_image` -> `neon.install_os_image` flow) is
+compared with `stream_image_to_device`, which writes while downloading.
+
+The device may be a loopback block device, i.e.:
+
+    truncate -s 256M /tmp/backing.img
+    sudo losetup -f --show /tmp/backing.img
+    sudo python test/benchmarks/bench_os_media.py --device /dev/loop0 \
+        --size-mb 128 --rate-mb 32
+
+Without `--device`, a temporary file is used.
+"""
+
+import argparse
+import os
+import shutil
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tempfile import mkdtemp
+from threading import Thread
+from time import sleep, time
+from urllib.request import urlopen
+
+from skill_update.os_media import stream_image_to_device
+
+
+def get_server(image: bytes, rate: float) -> ThreadingHTTPServer:
+    chunk_size = 256 * 1024
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(image)))
+            self.end_headers()
+            for idx in range(0, len(image), chunk_size):
+                self.wfile.write(image[idx:idx + chunk_size])
+                sleep(chunk_size / rate)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def download_then_write(url: str, device: str, tmp_dir: str):
+    image_file = os.path.join(tmp_dir, "download.img")
+    with urlopen(url) as resp, open(image_file, 'wb') as f:
+        shutil.copyfileobj(resp, f, 1024 * 1024)
+    with open(image_file, 'rb') as src, open(device, 'r+b') as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+        dst.flush()
+        os.fsync(dst.fileno())
+    os.remove(image_file)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--rate-mb", type=float, default=32,
+                        help="server rate limit in MB/s")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    tmp_dir = mkdtemp()
+    device = args.device or os.path.join(tmp_dir, "device")
+    if not args.device:
+        open(device, 'wb').close()
+    image = os.urandom(1024 * 1024) * args.size_mb
+    server = get_server(image, args.rate_mb * 1024 * 1024)
+    url = f"http://127.0.0.1:{server.server_port}/image.img"
+
+    sequential = list()
+    streaming = list()
+    for _ in range(args.runs):
+        start = time()
+        download_then_write(url, device, tmp_dir)
+        sequential.append(time() - start)
+
+        start = time()
+        stream_image_to_device(url, device)
+        streaming.append(time() - start)
+
+    print(f"image={args.size_mb}MB rate={args.rate_mb}MB/s "
+          f"device={device} runs={args.runs}")
+    print(f"download then write: mean={sum(sequential) / len(sequential):.3f}s"
+          f" max={max(sequential):.3f}s")
+    print(f"streaming write: mean={sum(streaming) / len(streaming):.3f}s "
+          f"max={max(streaming):.3f}s")
+    server.shutdown()
+    shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
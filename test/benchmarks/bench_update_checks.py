@@ -0,0 +1,112 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2025 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Latency benchmark for OS update checks.
+
+A fake bus responder answers `neon.check_update_initramfs` and
+`neon.check_update_squashfs` after configurable delays. Sequential checks (the
+previous `handle_update_device` behavior) are compared with the concurrent
+fan-out in `UpdateSkill._check_os_updates`.
+
+    python test/benchmarks/bench_update_checks.py --initramfs-delay 2 \
+        --squashfs-delay 3 --runs 3
+"""
+
+import argparse
+
+from os import environ
+from tempfile import mkdtemp
+from threading import Thread
+from time import sleep, time
+
+from ovos_bus_client import Message
+from ovos_utils.fakebus import FakeBus
+
+
+def get_skill(bus: FakeBus):
+    environ.setdefault("XDG_DATA_HOME", mkdtemp())
+    environ.setdefault("XDG_CONFIG_HOME", mkdtemp())
+    from neon_minerva.skill import get_skill_object
+    skill = get_skill_object(skill_entrypoint="skill-update.neongeckocom",
+                             skill_id="skill-update.benchmark", bus=bus)
+    skill.settings["update_initramfs"] = True
+    skill.settings["update_squashfs"] = True
+    return skill
+
+
+def add_responder(bus: FakeBus, msg_type: str, delay: float, data: dict):
+    def _respond(message: Message):
+        sleep(delay)
+        bus.emit(message.response(data))
+
+    bus.on(msg_type, lambda m: Thread(target=_respond, args=(m,),
+                                      daemon=True).start())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--initramfs-delay", type=float, default=2.0)
+    parser.add_argument("--squashfs-delay", type=float, default=3.0)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    bus = FakeBus()
+    skill = get_skill(bus)
+    add_responder(bus, "neon.check_update_initramfs", args.initramfs_delay,
+                  {"update_available": True})
+    add_responder(bus, "neon.check_update_squashfs", args.squashfs_delay,
+                  {"update_available": True, "track": "master",
+                   "update_metadata": {"build_version": "benchmark"}})
+    message = Message("benchmark")
+
+    sequential = list()
+    concurrent = list()
+    for _ in range(args.runs):
+        start = time()
+        skill._check_initramfs_update(message)
+        skill._check_squashfs_update(message)
+        sequential.append(time() - start)
+
+        start = time()
+        result = skill._check_os_updates(message)
+        concurrent.append(time() - start)
+        assert result.initramfs_available and result.squashfs_available, \
+            result
+
+    print(f"initramfs delay={args.initramfs_delay}s "
+          f"squashfs delay={args.squashfs_delay}s runs={args.runs}")
+    print(f"sequential: mean={sum(sequential) / len(sequential):.3f}s "
+          f"max={max(sequential):.3f}s")
+    print(f"concurrent: mean={sum(concurrent) / len(concurrent):.3f}s "
+          f"max={max(concurrent):.3f}s")
+    skill.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2025 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Voice response latency benchmark for update work run by this skill.
+
+A stand-in voice pipeline runs in a separate process, like the speech and audio
+services do; each "utterance" it receives is answered after a fixed amount of
+CPU work (standing in for STT, intent matching and TTS) and a small disk read.
+Utterance-to-speech latency is measured with no update running, with an OS
+image download, write and verification running at normal priority, and with
+the same update work at background priority and an optional bandwidth cap.
+A local HTTP server stands in for the image host.
+
+To approximate Raspberry Pi-class hardware, limit the benchmark to a few CPUs:
+
+    python test/benchmarks/bench_voice_latency.py --cpus 2 --size-mb 128 \
+        --rate-mb 16 --max-rate-mb 8
+"""
+
+import argparse
+import gzip
+import hashlib
+import os
+import shutil
+import zlib
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Pipe, Process
+from statistics import mean, quantiles
+from tempfile import mkdtemp
+from threading import Event, Thread
+from time import sleep, time
+
+from skill_update.os_media import download_image, set_background_priority, \
+    verify_device, write_image_to_device
+
+
+def get_server(image: bytes, rate: float) -> ThreadingHTTPServer:
+    chunk_size = 256 * 1024
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(image)))
+            self.end_headers()
+            for idx in range(0, len(image), chunk_size):
+                self.wfile.write(image[idx:idx + chunk_size])
+                sleep(chunk_size / rate)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def voice_pipeline(conn, model_file: str):
+    """
+    Answer each utterance after CPU work and a read of `model_file`.
+    """
+    audio = os.urandom(512 * 1024)
+    while conn.recv():
+        digest = hashlib.sha256()
+        for _ in range(10):
+            digest.update(zlib.compress(audio, 1))
+        with open(model_file, 'rb') as f:
+            f.seek(int.from_bytes(os.urandom(2), "big") * 1024)
+            f.read(256 * 1024)
+        conn.send(digest.hexdigest())
+
+
+def run_update(url: str, tmp_dir: str, background: bool,
+               max_rate: float = None):
+    """
+    Download, write, and verify an OS image like the skill does when creating
+    new boot media.
+    """
+    if background:
+        set_background_priority()
+    image_file = os.path.join(tmp_dir, "image.img")
+    device = os.path.join(tmp_dir, "device")
+    open(device, 'wb').close()
+    download_image(url, image_file, max_rate=max_rate)
+    write_image_to_device(image_file, device)
+    verify_device(image_file, device)
+    os.remove(image_file)
+    os.remove(device)
+
+
+def measure(conn, interval: float, done: Event, count: int) -> list:
+    """
+    Send utterances until `done` is set (or `count` are sent if `done` is
+    None) and return the response latency of each.
+    """
+    latency = list()
+    while (done and not done.is_set()) or (not done and len(latency) < count):
+        start = time()
+        conn.send(True)
+        conn.recv()
+        latency.append(time() - start)
+        sleep(interval)
+    return latency
+
+
+def report(name: str, latency: list):
+    p95 = quantiles(latency, n=20, method="inclusive")[-1] \
+        if len(latency) > 1 else latency[0]
+    print(f"{name}: n={len(latency)} mean={mean(latency) * 1000:.1f}ms "
+          f"p95={p95 * 1000:.1f}ms max={max(latency) * 1000:.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=128)
+    parser.add_argument("--rate-mb", type=float, default=16,
+                        help="server rate limit in MB/s")
+    parser.add_argument("--max-rate-mb", type=float, default=0,
+                        help="download cap for background updates in MB/s")
+    parser.add_argument("--interval", type=float, default=0.25,
+                        help="seconds between utterances")
+    parser.add_argument("--cpus", type=int, default=0,
+                        help="number of CPUs to run on (default all)")
+    args = parser.parse_args()
+
+    if args.cpus:
+        os.sched_setaffinity(0, set(sorted(os.sched_getaffinity(0))
+                                    [:args.cpus]))
+    tmp_dir = mkdtemp()
+    model_file = os.path.join(tmp_dir, "model.bin")
+    with open(model_file, 'wb') as f:
+        f.write(os.urandom(64 * 1024 * 1024 + 256 * 1024))
+    # Mostly incompressible so download, hashing and writes take a while
+    image = gzip.compress(b"".join(
+        os.urandom(768 * 1024) + bytes(256 * 1024)
+        for _ in range(args.size_mb)), compresslevel=1)
+    server = get_server(image, args.rate_mb * 1024 * 1024)
+    url = f"http://127.0.0.1:{server.server_port}/image.img.gz"
+
+    conn, child_conn = Pipe()
+    pipeline = Process(target=voice_pipeline, args=(child_conn, model_file),
+                       daemon=True)
+    pipeline.start()
+
+    print(f"image={args.size_mb}MB rate={args.rate_mb}MB/s "
+          f"cpus={len(os.sched_getaffinity(0))}")
+    report("no update", measure(conn, args.interval, None, 40))
+    for name, background, max_rate in (
+            ("update", False, None),
+            ("background update", True,
+             args.max_rate_mb * 1024 * 1024 or None)):
+        done = Event()
+
+        def _update():
+            start = time()
+            run_update(url, tmp_dir, background, max_rate)
+            print(f"{name} took {time() - start:.1f}s")
+            done.set()
+
+        Thread(target=_update, daemon=True).start()
+        report(name, measure(conn, args.interval, done, 0))
+
+    conn.send(False)
+    pipeline.join(5)
+    server.shutdown()
+    shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -28,16 +28,108 @@
 
 import pytest
 
+import os
+
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 from os import environ
+from os.path import join
+from tempfile import mkdtemp
 from threading import Event, Thread
 from time import time, sleep
-from mock import Mock
+from mock import ANY, Mock
 from ovos_bus_client import Message
 from neon_minerva.tests.skill_unit_test_base import SkillTestCase
 
 environ["TEST_SKILL_ENTRYPOINT"] = "skill-update.neongeckocom"
 
 
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class _RangeHandler(_QuietHandler):
+    failures = 0
+
+    def send_head(self):
+        """
+        Serve files with support for single `Range` requests. The next
+        `failures` range requests are answered with an error.
+        """
+        import re
+        from io import BytesIO
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            return SimpleHTTPRequestHandler.send_head(self)
+        with open(path, 'rb') as f:
+            data = f.read()
+        requested = re.match(r"bytes=(\d+)-(\d*)",
+                             self.headers.get("Range") or "")
+        if requested and _RangeHandler.failures:
+            _RangeHandler.failures -= 1
+            self.send_error(500)
+            return None
+        size = len(data)
+        if requested:
+            start, end = requested.groups()
+            data = data[int(start):int(end) + 1 if end else None]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-"
+                             f"{int(start) + len(data) - 1}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", f'"{os.path.getmtime(path)}"')
+        self.end_headers()
+        return BytesIO(data)
+
+
+class _UnreliableHandler(_RangeHandler):
+    delay = 0
+    truncate = False
+
+    def send_head(self):
+        """
+        Serve files with range support after `delay` seconds, optionally
+        closing the connection halfway through each response.
+        """
+        from io import BytesIO
+        sleep(self.delay)
+        data = _RangeHandler.send_head(self)
+        if data and self.truncate:
+            content = data.read()
+            return BytesIO(content[:len(content) // 2])
+        return data
+
+
+def serve_directory(path: str, ranges: bool = False,
+                    handler: type = None) -> ThreadingHTTPServer:
+    """
+    Serve files in `path` over HTTP on an available local port, optionally
+    with support for range requests or with a custom request handler.
+    """
+    handler = handler or (_RangeHandler if ranges else _QuietHandler)
+    server = ThreadingHTTPServer(("127.0.0.1", 0),
+                                 partial(handler, directory=path))
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _run_peer(path: str, ports, stop):
+    """
+    Run a PeerCache for `path` until `stop` is set, reporting its
+    (http_port, discovery_port) to the `ports` queue.
+    """
+    from skill_update.peer_cache import PeerCache
+    cache = PeerCache(path, 1024 * 1024)
+    cache.start("127.0.0.1")
+    ports.put((cache.http_port, cache.discovery_port))
+    stop.wait(60)
+    cache.stop()
+
+
 class TestSkill(SkillTestCase):
     def test_00_skill_init(self):
         # Test any parameters expected to be set in init or initialize methods
@@ -80,6 +172,8 @@ class TestSkill(SkillTestCase):
         self.skill._check_latest_release = real_check_release
 
     def test_handle_update_device(self):
+        # Responses change between requests; disable check caching
+        self.skill.settings["update_check_ttl"] = 0
         real_ask_yesno = self.skill.ask_yesno
         self.skill.ask_yesno = Mock()
         self.skill.ask_yesno.return_value = None
@@ -169,6 +263,7 @@ class TestSkill(SkillTestCase):
         self.skill._updating = False
         self.skill.settings["update_squashfs"] = True
         self.skill.settings["update_python"] = False
+        real_check_squashfs = self.skill._check_squashfs_update
         self.skill._check_squashfs_update = Mock(
             return_value={"core": {"version": "old"}, "build_version": "new"})
 
@@ -179,11 +274,17 @@ class TestSkill(SkillTestCase):
                    daemon=True)
         t.start()
         sleep(1)
+        # Handler returns once the update is confirmed
+        self.assertFalse(t.is_alive())
+        self.assertTrue(self.skill._update_worker.is_alive())
         self.assertTrue(self.skill._updating)
+        self.assertEqual(self.skill._update_state.state,
+                         "squashfs_downloading")
         self.assertFalse(self.skill._download_completed.is_set())
         download_success = False
         plugin_downloading = False
         t.join(10)
+        self.skill._update_worker.join(10)
         self.skill._handle_download_failure.assert_called_once()
         self.assertFalse(self.skill._updating)
         self.assertTrue(self.skill._download_completed.is_set())
@@ -201,6 +302,7 @@ class TestSkill(SkillTestCase):
         download_success = True
         plugin_downloading = False
         t.join(10)
+        self.skill._update_worker.join(10)
         self.assertTrue(self.skill._download_completed.is_set())
         self.assertFalse(self.skill._updating)
         self.skill.speak_dialog.assert_called_with("error_updating_os",
@@ -220,14 +322,1122 @@ class TestSkill(SkillTestCase):
         download_success = True
         plugin_downloading = False
         t.join(10)
+        self.skill._update_worker.join(10)
         self.assertTrue(self.skill._download_completed.is_set())
         self.skill.speak_dialog.assert_called_with("update_restarting",
                                                    wait=True)
+        self.assertEqual(self.skill._update_state.state, "reboot_pending")
+        self.skill._updating = False
 
         self.skill.bus.remove_all_listeners("neon.core_updater.check_update")
         self.skill.bus.remove_all_listeners("neon.core_updater.start_update")
         self.skill.ask_yesno = real_ask_yesno
         self.skill._handle_download_failure = real_failure
+        self.skill._check_squashfs_update = real_check_squashfs
+        self.skill.settings.pop("update_check_ttl")
+
+    def test_check_os_updates(self):
+        from skill_update.update_checks import OSUpdateCheck
+        delay = 1
+        squashfs_data = {"update_available": True, "track": "master",
+                         "update_metadata": {"build_version": "new"}}
+
+        def check_initramfs(message: Message):
+            sleep(delay)
+            self.skill.bus.emit(message.response({"update_available": True}))
+
+        def check_squashfs(message: Message):
+            sleep(delay)
+            self.skill.bus.emit(message.response(squashfs_data))
+
+        def threaded(handler):
+            return lambda m: Thread(target=handler, args=(m,),
+                                    daemon=True).start()
+
+        self.skill.settings["update_initramfs"] = True
+        self.skill.settings["update_squashfs"] = True
+        self.skill.settings["update_check_ttl"] = 0
+        self.skill.settings["adaptive_timeouts"] = False
+        self.skill.bus.on("neon.check_update_initramfs",
+                          threaded(check_initramfs))
+        self.skill.bus.on("neon.check_update_squashfs",
+                          threaded(check_squashfs))
+
+        # Both checks answered concurrently
+        result = self.skill._check_os_updates(Message("test"))
+        self.assertIsInstance(result, OSUpdateCheck)
+        self.assertTrue(result.initramfs_available)
+        self.assertTrue(result.squashfs_available)
+        self.assertTrue(result.update_available)
+        self.assertEqual(result.squashfs_meta, {"build_version": "new"})
+        self.assertEqual(result.timed_out, [])
+        self.assertLess(result.elapsed, 2 * delay)
+
+        # Slow responders share one deadline
+        real_timeout = self.skill._os_check_timeout
+        self.skill._os_check_timeout = 1
+        delay = 3
+        start = time()
+        result = self.skill._check_os_updates(Message("test"))
+        self.assertLess(time() - start, 2)
+        self.assertFalse(result.update_available)
+        self.assertEqual(set(result.timed_out), {"initramfs", "squashfs"})
+        sleep(delay)
+
+        # Disabled checks are not sent
+        self.skill.settings["update_initramfs"] = False
+        self.skill.settings["update_squashfs"] = False
+        result = self.skill._check_os_updates(Message("test"))
+        self.assertFalse(result.update_available)
+        self.assertEqual(result.timed_out, [])
+
+        self.skill._os_check_timeout = real_timeout
+        self.skill.settings.pop("update_check_ttl")
+        self.skill.settings.pop("adaptive_timeouts")
+        self.skill.bus.remove_all_listeners("neon.check_update_initramfs")
+        self.skill.bus.remove_all_listeners("neon.check_update_squashfs")
+
+    def test_check_cache(self):
+        squashfs_requests = list()
+        core_requests = list()
+
+        def check_squashfs(message: Message):
+            squashfs_requests.append(message)
+            self.skill.bus.emit(message.response(
+                {"update_available": True, "track": message.data["track"],
+                 "update_metadata": {"build_version": "new"}}))
+
+        def check_core(message: Message):
+            core_requests.append(message)
+            self.skill.bus.emit(message.response(
+                {"installed_version": "1.0.0", "latest_version": "1.1.0"}))
+
+        self.skill.bus.on("neon.check_update_squashfs", check_squashfs)
+        self.skill.bus.remove_all_listeners("neon.core_updater.check_update")
+        self.skill.bus.on("neon.core_updater.check_update", check_core)
+        self.skill.settings["update_check_ttl"] = 60
+        self.skill._check_cache.invalidate()
+        hits = self.skill._check_cache.hits
+        misses = self.skill._check_cache.misses
+        self.skill.include_prerelease = False
+
+        # First check is requested, later checks are cached
+        meta = self.skill._check_squashfs_update(Message("test"))
+        self.assertEqual(meta, {"build_version": "new"})
+        self.assertEqual(len(squashfs_requests), 1)
+        self.assertEqual(self.skill._check_squashfs_update(Message("test")),
+                         meta)
+        self.assertEqual(len(squashfs_requests), 1)
+        self.assertEqual(self.skill._check_cache.hits, hits + 1)
+        self.assertEqual(self.skill._check_cache.misses, misses + 1)
+
+        # Components are cached separately
+        self.skill._check_latest_release(Message("test"))
+        self.skill._check_latest_release(Message("test"))
+        self.assertEqual(len(core_requests), 1)
+        self.assertEqual(self.skill.latest_ver, "1.1.0")
+
+        # Changing track invalidates cached checks
+        self.skill.include_prerelease = True
+        self.skill._check_squashfs_update(Message("test"))
+        self.assertEqual(len(squashfs_requests), 2)
+        self.assertEqual(squashfs_requests[-1].data["track"], "dev")
+        self.skill._check_latest_release(Message("test"))
+        self.assertEqual(len(core_requests), 2)
+
+        # Expired entries are requested again
+        self.skill.settings["update_check_ttl"] = 0
+        self.skill._check_squashfs_update(Message("test"))
+        self.assertEqual(len(squashfs_requests), 3)
+
+        self.skill.settings.pop("update_check_ttl")
+        self.skill.settings.pop("include_prerelease")
+        self.skill._check_cache.invalidate()
+        self.skill.bus.remove_all_listeners("neon.check_update_squashfs")
+        self.skill.bus.remove_all_listeners("neon.core_updater.check_update")
+
+    def test_rollout_gate(self):
+        from skill_update.update_checks import RolloutGate, \
+            get_rollout_percent
+        self.assertEqual(get_rollout_percent(None), 100)
+        self.assertEqual(get_rollout_percent(25), 25)
+        self.assertEqual(get_rollout_percent({"percent": 150}), 100)
+        schedule = {"start": 1000, "end": 2000}
+        self.assertEqual(get_rollout_percent(schedule, 500), 0)
+        self.assertEqual(get_rollout_percent(schedule, 1250), 25)
+        self.assertEqual(get_rollout_percent(schedule, 3000), 100)
+        self.assertEqual(get_rollout_percent(
+            {"start": "2025-01-01T00:00:00+00:00",
+             "end": "2025-01-02T00:00:00+00:00"}, 1735732800), 50)
+
+        # Devices are included in proportion to the rollout percentage
+        gates = [RolloutGate(f"device_{i}") for i in range(1000)]
+        eligible = [gate.is_eligible("squashfs", "2.0.0", 25)
+                    for gate in gates]
+        self.assertAlmostEqual(sum(eligible), 250, delta=50)
+        # Positions are stable per device and differ between versions
+        self.assertEqual([RolloutGate(f"device_{i}").position("2.0.0")
+                          for i in range(10)],
+                         [gate.position("2.0.0") for gate in gates[:10]])
+        self.assertNotEqual(gates[0].position("2.0.0"),
+                            gates[0].position("2.0.1"))
+
+        # Eligible devices stay eligible; ineligible results are cached
+        gate = RolloutGate("device", ttl=60)
+        position = gate.position("2.0.0")
+        self.assertFalse(gate.is_eligible("core", "2.0.0", position / 2,
+                                          now=0))
+        self.assertFalse(gate.is_eligible("core", "2.0.0", 100, now=30))
+        self.assertTrue(gate.is_eligible("core", "2.0.0", 100, now=61))
+        self.assertTrue(gate.is_eligible("core", "2.0.0", 0, now=200))
+        # Invalid rollout specs do not block updates
+        self.assertTrue(gate.is_eligible("core", "3.0.0", {"bad": 1}))
+
+        # Notifications are limited to devices in the rollout
+        self.skill.settings["update_squashfs"] = True
+        checks = {"squashfs": {"update_available": True, "update_metadata": {
+            "build_version": "3.0.0", "rollout": 0}}}
+        self.assertIsNone(self.skill._render_update_notification(checks))
+        # The cached result for 3.0.0 is reused, so check another version
+        checks["squashfs"]["update_metadata"] = {"build_version": "3.0.1",
+                                                 "rollout": 100}
+        self.assertIn("3.0.1", self.skill._render_update_notification(checks))
+        self.skill.settings.pop("update_squashfs")
+
+    def test_check_single_flight(self):
+        requests = list()
+
+        def check_squashfs(message: Message):
+            requests.append(message)
+            sleep(1)
+            self.skill.bus.emit(message.response(
+                {"update_available": True, "track": message.data["track"],
+                 "update_metadata": {"build_version": "new"}}))
+
+        self.skill.bus.on("neon.check_update_squashfs",
+                          lambda m: Thread(target=check_squashfs, args=(m,),
+                                           daemon=True).start())
+        self.skill.settings["update_check_ttl"] = 0
+        coalesced = self.skill._check_flights.coalesced
+        results = list()
+
+        def _check():
+            results.append(self.skill._check_squashfs_update(Message("test")))
+
+        # Concurrent checks share one request
+        threads = [Thread(target=_check, daemon=True) for _ in range(3)]
+        for t in threads:
+            t.start()
+            sleep(0.1)
+        for t in threads:
+            t.join(5)
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(results, [{"build_version": "new"}] * 3)
+        self.assertEqual(self.skill._check_flights.coalesced, coalesced + 2)
+        self.assertEqual(self.skill._check_flights.stats["in_flight"], 0)
+
+        # Later checks are requested again
+        self.skill._check_squashfs_update(Message("test"))
+        self.assertEqual(len(requests), 2)
+
+        self.skill.settings.pop("update_check_ttl")
+        self.skill.bus.remove_all_listeners("neon.check_update_squashfs")
+
+    def test_on_ready(self):
+        real_show_notification = self.skill.gui.show_notification
+        self.skill.gui.show_notification = Mock()
+        real_dismiss = self.skill._dismiss_notification
+        self.skill._dismiss_notification = Mock()
+        self.skill._clear_update_metadata()
+        self.skill.settings["update_squashfs"] = True
+        self.skill.settings["update_check_ttl"] = 0
+        delay = 0
+        version = "1.0.0"
+        check_event = Event()
+
+        def check_squashfs(message: Message):
+            sleep(delay)
+            self.skill.bus.emit(message.response(
+                {"update_available": True, "track": message.data["track"],
+                 "update_metadata": {"build_version": version}}))
+            check_event.set()
+
+        self.skill.bus.on("neon.check_update_squashfs",
+                          lambda m: Thread(target=check_squashfs, args=(m,),
+                                           daemon=True).start())
+        message = Message("mycroft.ready")
+
+        # No saved metadata, check before notifying
+        self.skill._on_ready(message)
+        self.skill.gui.show_notification.assert_called_once()
+        text = self.skill.gui.show_notification.call_args[0][0]
+        self.assertIn(version, text)
+        saved = self.skill._load_update_metadata()
+        self.assertEqual(saved["track"], self.skill.update_track)
+        self.assertEqual(saved["checks"]["squashfs"]["update_metadata"],
+                         {"build_version": version})
+        self.skill.gui.show_notification.reset_mock()
+
+        # Saved metadata is served immediately and revalidated
+        delay = 2
+        check_event.clear()
+        start = time()
+        self.skill._on_ready(message)
+        self.assertLess(time() - start, delay)
+        self.skill.gui.show_notification.assert_called_once_with(
+            text, action="update.gui.install_update",
+            callback_data={"notification": text})
+        self.assertTrue(check_event.wait(5))
+        sleep(0.5)
+        self.skill.gui.show_notification.assert_called_once()
+        self.skill._dismiss_notification.assert_not_called()
+        self.skill.gui.show_notification.reset_mock()
+
+        # Changed result replaces the saved notification
+        delay = 1
+        version = "1.1.0"
+        check_event.clear()
+        self.skill._on_ready(message)
+        self.skill.gui.show_notification.assert_called_once()
+        self.assertTrue(check_event.wait(5))
+        sleep(0.5)
+        self.assertEqual(self.skill.gui.show_notification.call_count, 2)
+        self.assertIn(version,
+                      self.skill.gui.show_notification.call_args[0][0])
+        self.skill._dismiss_notification.assert_called_once()
+        self.assertEqual(
+            self.skill._dismiss_notification.call_args[0][0].data,
+            {"notification": text})
+
+        # Interrupted updates are offered without blocking the handler
+        real_ask_yesno = self.skill.ask_yesno
+        asked = Event()
+        answer = Event()
+        self.skill.ask_yesno = Mock(
+            side_effect=lambda *_: asked.set() or answer.wait(5) and "no")
+        txn = self.skill._update_journal.begin("squashfs", "downloading")
+        start = time()
+        self.skill._on_ready(message)
+        self.assertLess(time() - start, 4)
+        self.assertTrue(asked.wait(5))
+        self.skill.ask_yesno.assert_called_once_with("ask_restart_update")
+        answer.set()
+        sleep(0.5)
+        self.assertNotIn(txn, self.skill._update_journal.get_pending())
+        self.skill.ask_yesno = real_ask_yesno
+
+        self.skill._clear_update_metadata()
+        self.assertIsNone(self.skill._load_update_metadata())
+        self.skill.settings.pop("update_squashfs")
+        self.skill.settings.pop("update_check_ttl")
+        self.skill.bus.remove_all_listeners("neon.check_update_squashfs")
+        self.skill.gui.show_notification = real_show_notification
+        self.skill._dismiss_notification = real_dismiss
+
+    def test_on_ready_background(self):
+        real_startup = self.skill._handle_startup
+        started = Event()
+
+        def _handle_startup(message, delay=0):
+            sleep(1)
+            real_startup(message, delay)
+            started.set()
+
+        self.skill._handle_startup = Mock(side_effect=_handle_startup)
+        self.skill._write_update_signal("squashfs")
+        self.skill.current_ver = "1.0.0"
+        self.skill.settings["update_squashfs"] = False
+        self.skill.settings["update_python"] = False
+        message = Message("mycroft.ready")
+
+        # Default startup blocks the ready handler
+        self.skill._on_ready(message)
+        self.assertTrue(started.is_set())
+        self.skill._handle_startup.assert_called_once_with(message)
+        self.skill.speak_dialog.assert_called_once_with(
+            "notify_update_success", {"version": "1 point 0 point 0"})
+        started.clear()
+        self.skill.speak_dialog.reset_mock()
+        self.skill._handle_startup.reset_mock()
+
+        # Background startup returns immediately with a bounded delay
+        self.skill._write_update_signal("squashfs")
+        self.skill.settings["background_startup"] = True
+        self.skill.settings["startup_delay"] = 1
+        self.skill._on_ready(message)
+        self.assertFalse(started.is_set())
+        self.skill.speak_dialog.assert_not_called()
+        self.skill._handle_startup.assert_called_once()
+        self.assertLessEqual(self.skill._handle_startup.call_args[0][1], 1)
+        self.assertTrue(started.wait(5))
+        self.skill.speak_dialog.assert_called_once_with(
+            "notify_update_success", {"version": "1 point 0 point 0"})
+
+        self.skill.settings.pop("background_startup")
+        self.skill.settings.pop("startup_delay")
+        self.skill.settings.pop("update_squashfs")
+        self.skill.settings.pop("update_python")
+        self.skill._handle_startup = real_startup
+
+    def test_update_journal(self):
+        from skill_update.update_journal import UpdateJournal
+        path = join(mkdtemp(), "journal.jsonl")
+        journal = UpdateJournal(path, progress_interval=60)
+        self.assertEqual(journal.get_pending(), dict())
+
+        core = journal.begin("core", "applying", version="1.0.0")
+        squashfs = journal.begin("squashfs", "downloading", track="beta")
+        journal.progress(squashfs, "downloading", bytes_done=10)
+        # Progress is throttled
+        journal.progress(squashfs, "downloading", bytes_done=20)
+        journal.finish(core, "complete")
+        pending = journal.get_pending()
+        self.assertEqual(list(pending.keys()), [squashfs])
+        self.assertEqual(pending[squashfs]["track"], "beta")
+        self.assertEqual(pending[squashfs]["bytes_done"], 10)
+        with self.assertRaises(ValueError):
+            journal.finish(squashfs, "done")
+
+        # A partially written record is ignored
+        with open(path, 'a') as f:
+            f.write('{"txn": "squashfs-')
+        self.assertEqual(journal.get_pending(), pending)
+
+        journal.compact()
+        self.assertEqual(len(journal.records()), 1)
+        self.assertEqual(journal.get_pending(), pending)
+
+    def test_offer_interrupted_updates(self):
+        from skill_update.update_journal import UpdateJournal
+        real_journal = self.skill._update_journal
+        real_ask_yesno = self.skill.ask_yesno
+        real_restart = self.skill._restart_squashfs_update
+        self.skill._update_journal = UpdateJournal(
+            join(mkdtemp(), "journal.jsonl"))
+        self.skill._restart_squashfs_update = Mock()
+        self.skill.ask_yesno = Mock(return_value="yes")
+        message = Message("mycroft.ready")
+
+        # Interrupted update is restarted
+        old = self.skill._update_journal.begin("squashfs", "downloading")
+        txn = self.skill._update_journal.begin("squashfs", "downloading")
+        self.skill._offer_interrupted_updates(message)
+        self.skill.ask_yesno.assert_called_once_with("ask_restart_update")
+        self.skill._restart_squashfs_update.assert_called_once_with(message,
+                                                                   txn)
+        self.assertEqual(list(self.skill._update_journal.get_pending()),
+                         [txn])
+        self.assertNotIn(old, self.skill._update_journal.get_pending())
+
+        # Declined download is cancelled and partial files removed
+        self.skill._update_journal.finish(txn, "cancelled")
+        self.skill.ask_yesno.reset_mock(return_value=True)
+        self.skill.ask_yesno.return_value = "no"
+        part_file = join(mkdtemp(), "image.img.part")
+        for path in (part_file, f"{part_file}.json"):
+            with open(path, 'w') as f:
+                f.write("test")
+        self.skill._update_journal.begin("os_image", "downloading",
+                                         part_file=part_file)
+        self.skill._offer_interrupted_updates(message)
+        self.skill.ask_yesno.assert_called_once_with("ask_resume_download")
+        self.assertEqual(self.skill._update_journal.get_pending(), dict())
+        self.assertFalse(os.path.exists(part_file))
+        self.assertFalse(os.path.exists(f"{part_file}.json"))
+
+        # Applied updates are checked and not offered for resume
+        self.skill.current_ver = "1.0.0"
+        self.skill._write_update_signal("1.0.0")
+        self.assertTrue(self.skill._check_update_status())
+        self.skill._write_update_signal("2.0.0")
+        self.assertFalse(self.skill._check_update_status())
+        self.assertIsNone(self.skill._check_update_status())
+        self.assertEqual(len(self.skill._update_journal.records()), 0)
+
+        self.skill._update_journal = real_journal
+        self.skill.ask_yesno = real_ask_yesno
+        self.skill._restart_squashfs_update = real_restart
+
+    def test_hedged_version_requests(self):
+        from skill_update.bus_utils import hedged_request
+        device_delay = 2
+        core_delay = 0
+        device_version = "2.0.0"
+
+        def _respond(message: Message, delay: float, data: dict):
+            sleep(delay)
+            self.skill.bus.emit(message.response(data))
+
+        def get_build_info(message: Message):
+            Thread(target=_respond, daemon=True,
+                   args=(message, device_delay,
+                         {"build_version": device_version})).start()
+
+        def get_version(message: Message):
+            Thread(target=_respond, daemon=True,
+                   args=(message, core_delay, {"version": "1.0.0"})).start()
+
+        self.skill.bus.on("neon.device_updater.get_build_info",
+                          get_build_info)
+        self.skill.bus.on("neon.core_updater.get_version", get_version)
+        real_os_supported = self.skill._os_updates_supported
+        self.skill._os_updates_supported = True
+        self.skill.settings["hedge_requests"] = True
+        self.skill.settings["hedge_grace"] = 0.5
+
+        # Slow device updater; core updater accepted after grace period
+        self.skill.current_ver = None
+        start = time()
+        self.assertEqual(self.skill.current_ver, "1.0.0")
+        self.assertLess(time() - start, device_delay)
+
+        # Preferred device updater response within grace period
+        sleep(device_delay)
+        device_delay = 0.2
+        self.skill.current_ver = None
+        self.assertEqual(self.skill.current_ver, device_version)
+
+        # Invalid preferred response falls back to core updater
+        sleep(device_delay)
+        device_version = None
+        self.skill.current_ver = None
+        start = time()
+        self.assertEqual(self.skill.current_ver, "1.0.0")
+        self.assertLess(time() - start, 0.5)
+
+        # Latency is recorded per endpoint
+        sleep(device_delay)
+        stats = self.skill.endpoint_stats
+        self.assertEqual(
+            stats["neon.device_updater.get_build_info"]["responses"], 3)
+        self.assertEqual(
+            stats["neon.core_updater.get_version"]["responses"], 3)
+        self.assertGreater(
+            stats["neon.device_updater.get_build_info"]["max_latency"], 1)
+
+        # Invalid responses are returned without waiting for the timeout
+        start = time()
+        resp = hedged_request(
+            self.skill.bus, [Message("neon.device_updater.get_build_info"),
+                             Message("neon.core_updater.get_version")],
+            10, lambda _: False)
+        self.assertLess(time() - start, 2)
+        self.assertIsNotNone(resp)
+
+        self.skill._os_updates_supported = real_os_supported
+        self.skill.settings.pop("hedge_requests")
+        self.skill.settings.pop("hedge_grace")
+        self.skill.current_ver = None
+        self.skill.bus.remove_all_listeners(
+            "neon.device_updater.get_build_info")
+        self.skill.bus.remove_all_listeners("neon.core_updater.get_version")
+
+    def test_adaptive_timeouts(self):
+        from tempfile import mkdtemp
+        from os.path import join
+        from skill_update.bus_utils import LatencyTracker
+
+        path = join(mkdtemp(), "latency.json")
+        tracker = LatencyTracker(path, window=10, min_samples=3)
+        kwargs = {"floor": 1, "ceiling": 30, "margin": 2}
+
+        # Default timeout until enough samples are observed
+        tracker.record("test", 0.5)
+        tracker.record("test", 0.5)
+        self.assertEqual(tracker.get_timeout("test", 15, **kwargs), 15)
+        tracker.record("test", 1.0)
+        self.assertEqual(tracker.get_timeout("test", 15, **kwargs), 3.0)
+        self.assertEqual(tracker.percentile("test", 50), 0.5)
+
+        # Timeouts back off up to 4x until a response is observed
+        tracker.record("test", None)
+        self.assertEqual(tracker.get_timeout("test", 15, **kwargs), 6.0)
+        tracker.record("test", None)
+        tracker.record("test", None)
+        self.assertEqual(tracker.get_timeout("test", 15, **kwargs), 12.0)
+        tracker.record("test", 1.0)
+        self.assertEqual(tracker.get_timeout("test", 15, **kwargs), 3.0)
+
+        # Floor and ceiling are applied
+        self.assertEqual(tracker.get_timeout("test", 15, floor=5, ceiling=30,
+                                             margin=0), 5)
+        for _ in range(10):
+            tracker.record("test", 60)
+        self.assertEqual(tracker.get_timeout("test", 15, **kwargs), 30)
+        stats = tracker.get()["test"]
+        self.assertEqual(stats["timeouts"], 3)
+        self.assertEqual(stats["p99_latency"], 60)
+
+        # Samples are persisted
+        self.assertEqual(LatencyTracker(path).percentile("test", 50), 60)
+
+        # Skill timeouts use observed latency
+        real_tracker = self.skill._endpoint_stats
+        self.skill._endpoint_stats = LatencyTracker(min_samples=1)
+        self.skill._endpoint_stats.record("neon.check_update_squashfs", 0.1)
+        self.assertEqual(
+            self.skill._get_timeout("neon.check_update_squashfs", 10), 2.1)
+
+        # Long-running requests don't time out sooner than the default
+        for _ in range(5):
+            self.skill._endpoint_stats.record("neon.update_initramfs", 1)
+        self.assertEqual(self.skill._get_timeout("neon.update_initramfs", 60,
+                                                 long_running=True), 60)
+        for _ in range(5):
+            self.skill._endpoint_stats.record("neon.update_initramfs", 90)
+        self.assertEqual(self.skill._get_timeout("neon.update_initramfs", 60,
+                                                 long_running=True), 92)
+        self.skill.settings["adaptive_timeouts"] = False
+        self.assertEqual(
+            self.skill._get_timeout("neon.check_update_squashfs", 10), 10)
+        self.skill.settings.pop("adaptive_timeouts")
+        self.skill._endpoint_stats = real_tracker
+
+    def test_download_progress_events(self):
+        from skill_update.update_checks import OSUpdateCheck
+        real_ask_yesno = self.skill.ask_yesno
+        real_check = self.skill._check_os_updates
+        real_failure = self.skill._handle_download_failure
+        self.skill.ask_yesno = Mock(return_value="yes")
+        self.skill._check_os_updates = Mock(return_value=OSUpdateCheck(
+            squashfs_meta={"build_version": "new"}))
+        self.skill._handle_download_failure = Mock(side_effect=real_failure)
+        self.skill._download_check_interval = 300
+        self.skill._download_heartbeat_timeout = 1
+        status_requests = list()
+        downloading = True
+
+        def get_download_status(message: Message):
+            status_requests.append(message)
+            self.skill.bus.emit(message.response({"downloading": downloading}))
+
+        self.skill.bus.on("neon.device_updater.get_download_status",
+                          get_download_status)
+        message = Message("recognizer_loop:utterance",
+                          context={"neon_should_respond": True})
+
+        def _start_update():
+            self.skill.handle_update_device(message)
+            sleep(0.5)
+            self.assertTrue(self.skill._update_worker.is_alive())
+            return self.skill._update_worker
+
+        # Error event fails the download without polling
+        t = _start_update()
+        self.skill.bus.emit(Message("neon.update_squashfs.progress",
+                                    {"progress": 10, "bytes": 1024,
+                                     "rate": 1024}))
+        sleep(0.5)
+        self.assertEqual(self.skill._download_progress["progress"], 10)
+        self.skill.bus.emit(Message("neon.update_squashfs.progress",
+                                    {"error": "connection reset"}))
+        t.join(2)
+        self.assertFalse(t.is_alive())
+        self.skill._handle_download_failure.assert_called_once()
+        self.assertEqual(status_requests, [])
+        self.assertFalse(self.skill._updating)
+        self.skill._handle_download_failure.reset_mock()
+
+        # Progress events keep the download alive without polling
+        t = _start_update()
+        for progress in range(3):
+            self.skill.bus.emit(Message("neon.update_squashfs.progress",
+                                        {"progress": progress}))
+            sleep(0.5)
+        self.assertTrue(t.is_alive())
+        self.assertEqual(status_requests, [])
+
+        # Missed heartbeat is checked with the plugin
+        sleep(1)
+        self.assertEqual(len(status_requests), 1)
+        self.assertTrue(t.is_alive())
+        downloading = False
+        t.join(3)
+        self.assertFalse(t.is_alive())
+        self.skill._handle_download_failure.assert_called_once()
+        self.assertEqual(len(self.skill.bus.ee.listeners(
+            "neon.update_squashfs.progress")), 0)
+
+        self.skill.bus.remove_all_listeners(
+            "neon.device_updater.get_download_status")
+        self.skill.ask_yesno = real_ask_yesno
+        self.skill._check_os_updates = real_check
+        self.skill._handle_download_failure = real_failure
+        self.skill._download_heartbeat_timeout = 15
+
+    def test_prestage_squashfs_update(self):
+        from skill_update.update_checks import OSUpdateCheck
+        from skill_update.update_journal import UpdateJournal
+        real_ask_yesno = self.skill.ask_yesno
+        real_check = self.skill._check_os_updates
+        real_journal = self.skill._update_journal
+        self.skill._update_journal = UpdateJournal(
+            join(mkdtemp(), "journal.jsonl"))
+        test_dir = mkdtemp()
+        os.makedirs(join(test_dir, "rpi4", "updates"))
+        squashfs = os.urandom(100000)
+        with open(join(test_dir, "rpi4", "updates", "neon-2.0.0.squashfs"),
+                  'wb') as f:
+            f.write(squashfs)
+        server = serve_directory(test_dir)
+        slow_server = serve_directory(test_dir, handler=type(
+            "_SlowHandler", (_UnreliableHandler,), {"delay": 1}))
+        meta = {"build_version": "2.0.0", "base_os": {"platform": "rpi4"},
+                "download_url": f"http://127.0.0.1:{server.server_port}/"
+                                f"rpi4/neon-2.0.0.img.xz"}
+        download_dir = mkdtemp()
+        self.skill._check_os_updates = Mock(return_value=OSUpdateCheck(
+            squashfs_meta=meta))
+        self.skill._download_check_interval = 300
+        self.skill.settings["update_check_ttl"] = 0
+        self.skill.settings["prestage_updates"] = True
+        self.skill.settings["squashfs_download_dir"] = download_dir
+        updates = list()
+
+        def check_squashfs(message: Message):
+            self.skill.bus.emit(message.response(
+                {"update_available": True, "track": message.data["track"],
+                 "update_metadata": meta}))
+
+        def update_squashfs(message: Message):
+            # The plugin stages a downloaded file without downloading again
+            updates.append(message)
+            self.skill.bus.emit(message.response(
+                {"new_version": join(download_dir, "2.0.0")}))
+
+        def _prestage() -> dict:
+            self.skill._check_squashfs_update(message)
+            timeout = time() + 5
+            while not self.skill._prestage and time() < timeout:
+                sleep(0.1)
+            self.assertTrue(self.skill._prestage["done"].wait(5))
+            return self.skill._prestage
+
+        on_reboot = Mock()
+        self.skill.bus.on("neon.check_update_squashfs", check_squashfs)
+        self.skill.bus.on("neon.update_squashfs", update_squashfs)
+        self.skill.bus.on("system.reboot", on_reboot)
+        message = Message("recognizer_loop:utterance",
+                          context={"neon_should_respond": True})
+
+        # Available update is downloaded once when found, but not staged
+        prestage = _prestage()
+        self.assertTrue(prestage["staged"])
+        with open(prestage["file"], 'rb') as f:
+            self.assertEqual(f.read(), squashfs)
+        self.skill._check_squashfs_update(message)
+        sleep(0.5)
+        self.assertIs(self.skill._prestage, prestage)
+        self.assertEqual(updates, list())
+        self.skill.speak_dialog.assert_not_called()
+        pending = list(self.skill._update_journal.get_pending().values())
+        self.assertEqual([p["phase"] for p in pending], ["staged"])
+
+        # Declined update is discarded
+        self.skill.ask_yesno = Mock(return_value="no")
+        self.skill.handle_update_device(message)
+        self.skill.speak_dialog.assert_called_with("not_updating")
+        self.assertEqual(self.skill._prestage, dict())
+        self.assertFalse(os.path.isfile(prestage["file"]))
+        self.assertEqual(self.skill._update_journal.get_pending(), dict())
+        self.assertEqual(updates, list())
+
+        # Pre-staged update is not applied or reported after a restart
+        self.skill._updating = False
+        prestage = _prestage()
+        self.assertIsNone(self.skill._check_update_status())
+        self.skill._prestage = dict()
+        self.skill._offer_interrupted_updates(message)
+        self.assertFalse(os.path.isfile(prestage["file"]))
+        self.assertEqual(self.skill._update_journal.get_pending(), dict())
+        self.assertEqual(updates, list())
+        on_reboot.assert_not_called()
+
+        # Confirmed update is handed to the plugin without downloading again
+        self.skill.ask_yesno = Mock(return_value="yes")
+        prestage = _prestage()
+        self.skill.handle_update_device(message)
+        self.skill._update_worker.join(5)
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(updates[0].data["update_metadata"], meta)
+        with open(join(download_dir, "2.0.0"), 'rb') as f:
+            self.assertEqual(f.read(), squashfs)
+        self.assertFalse(os.path.isfile(prestage["file"]))
+        self.skill.speak_dialog.assert_called_with("update_restarting",
+                                                   wait=True)
+        on_reboot.assert_called_once()
+        self.assertEqual(self.skill._update_state.state, "reboot_pending")
+        pending = list(self.skill._update_journal.get_pending().values())
+        self.assertEqual([p["phase"] for p in pending], ["applying"])
+        self.assertEqual(self.skill._prestage, dict())
+
+        # Update confirmed while pre-staging waits for the download
+        self.skill._updating = False
+        os.remove(join(download_dir, "2.0.0"))
+        meta["download_url"] = meta["download_url"].replace(
+            str(server.server_port), str(slow_server.server_port))
+        self.skill._check_squashfs_update(message)
+        sleep(0.5)
+        self.skill.handle_update_device(message)
+        sleep(0.2)
+        self.assertTrue(self.skill._update_worker.is_alive())
+        self.assertEqual(self.skill._update_state.state,
+                         "squashfs_downloading")
+        self.skill._update_worker.join(5)
+        self.assertEqual(len(updates), 2)
+        self.assertTrue(os.path.isfile(join(download_dir, "2.0.0")))
+        self.assertEqual(on_reboot.call_count, 2)
+        self.assertEqual(self.skill._update_state.state, "reboot_pending")
+
+        self.skill._updating = False
+        server.shutdown()
+        slow_server.shutdown()
+        self.skill.bus.remove("neon.check_update_squashfs", check_squashfs)
+        self.skill.bus.remove("neon.update_squashfs", update_squashfs)
+        self.skill.bus.remove("system.reboot", on_reboot)
+        for setting in ("prestage_updates", "update_check_ttl",
+                        "squashfs_download_dir"):
+            self.skill.settings.pop(setting)
+        self.skill.ask_yesno = real_ask_yesno
+        self.skill._check_os_updates = real_check
+        self.skill._update_journal = real_journal
+
+    def test_idle_scheduler(self):
+        from time import mktime
+        from skill_update.update_schedule import IdleScheduler
+        scheduler = IdleScheduler(idle_seconds=0.5)
+        self.assertFalse(scheduler.can_run())
+        self.assertFalse(scheduler.wait(0.1))
+        self.assertTrue(scheduler.wait(1))
+        self.assertTrue(scheduler.can_run())
+
+        # Interaction resets the idle time and response latency is measured
+        scheduler.on_activity(Message("recognizer_loop:utterance"))
+        self.assertFalse(scheduler.can_run())
+        scheduler.on_activity(Message("speak"))
+        with scheduler.work():
+            self.assertTrue(scheduler.working)
+            scheduler.on_activity(Message("recognizer_loop:utterance"))
+            sleep(0.2)
+            scheduler.on_activity(Message("speak"))
+        self.assertFalse(scheduler.working)
+        stats = scheduler.latency_stats
+        self.assertEqual(stats["not_updating"]["count"], 1)
+        self.assertEqual(stats["updating"]["count"], 1)
+        self.assertGreaterEqual(stats["updating"]["mean"], 0.2)
+
+        # Quiet hours may span midnight
+        night = mktime((2026, 1, 1, 23, 0, 0, 0, 0, -1))
+        scheduler.quiet_hours = (22, 6)
+        self.assertTrue(scheduler.in_quiet_hours(night))
+        self.assertTrue(scheduler.in_quiet_hours(night + 4 * 3600))
+        self.assertFalse(scheduler.in_quiet_hours(night + 12 * 3600))
+        scheduler.quiet_hours = (1, 5)
+        self.assertFalse(scheduler.in_quiet_hours(night))
+        self.assertTrue(scheduler.in_quiet_hours(night + 3 * 3600))
+        scheduler.quiet_hours = None
+        self.assertTrue(scheduler.in_quiet_hours(night))
+
+    def test_check_scheduler(self):
+        from skill_update.update_schedule import CheckScheduler, get_device_id
+        self.assertIsInstance(get_device_id(), str)
+        interval = 3600
+
+        # Schedules are reproducible per device and differ between devices
+        delays = [CheckScheduler("device_a", interval).first_delay()
+                  for _ in range(2)]
+        self.assertEqual(delays[0], delays[1])
+        first = [CheckScheduler(f"device_{i}", interval).first_delay()
+                 for i in range(100)]
+        self.assertTrue(all(0 <= delay <= interval for delay in first))
+        self.assertGreater(max(first) - min(first), interval / 2)
+
+        scheduler = CheckScheduler("device_a", interval, jitter=0.1,
+                                   retry_delay=60)
+        delay = scheduler.next_delay(True)
+        self.assertTrue(interval * 0.9 <= delay <= interval * 1.1)
+
+        # Failures back off exponentially up to the interval
+        backoff = [scheduler.next_delay(False) for _ in range(8)]
+        self.assertEqual(scheduler.failures, 8)
+        for failures, delay in enumerate(backoff, 1):
+            limit = min(interval, 60 * 2 ** (failures - 1))
+            self.assertTrue(limit / 2 <= delay <= limit, (failures, delay))
+        scheduler.next_delay(True)
+        self.assertEqual(scheduler.failures, 0)
+
+    def test_periodic_checks(self):
+        real_refresh = self.skill._refresh_update_metadata
+        checks = list()
+        succeed = False
+
+        def _refresh(message, text):
+            checks.append(message)
+            if succeed:
+                self.skill._record_check_result("master", "squashfs",
+                                                {"update_available": False})
+
+        self.skill._refresh_update_metadata = Mock(side_effect=_refresh)
+        self.skill.settings["update_check_interval"] = 1
+        self.skill.settings["update_squashfs"] = True
+        self.skill._check_scheduler.retry_delay = 0.2
+        self.skill._updating = False
+
+        # Failed checks are retried with backoff
+        self.skill._start_periodic_checks()
+        sleep(2.5)
+        self.assertGreaterEqual(len(checks), 3)
+        self.assertGreaterEqual(self.skill._check_scheduler.failures, 3)
+        self.assertEqual(checks[0].msg_type, "neon.update.periodic_check")
+
+        # Successful checks reset the backoff
+        succeed = True
+        sleep(1.5)
+        self.assertEqual(self.skill._check_scheduler.failures, 0)
+
+        # Disabled checks are not rescheduled
+        self.skill.settings["update_check_interval"] = 0
+        sleep(1.5)
+        count = len(checks)
+        sleep(1.5)
+        self.assertEqual(len(checks), count)
+
+        # Cached responses are not reused by periodic checks
+        requests = Mock(return_value={"update_available": False})
+        self.skill._refresh_update_metadata = Mock(
+            side_effect=lambda message, text: self.skill._cached_check(
+                "squashfs", requests))
+        self.skill.settings["update_check_interval"] = 3600
+        self.skill.settings["update_check_ttl"] = 3600
+        self.skill._run_periodic_check()
+        self.skill._run_periodic_check()
+        self.assertEqual(requests.call_count, 2)
+        self.assertEqual(self.skill._check_scheduler.failures, 0)
+        self.skill._check_timer.cancel()
+
+        self.skill.settings.pop("update_check_interval")
+        self.skill.settings.pop("update_check_ttl")
+        self.skill.settings.pop("update_squashfs")
+        self.skill._refresh_update_metadata = real_refresh
+
+    def test_idle_prestage(self):
+        test_dir = mkdtemp()
+        with open(join(test_dir, "neon-3.0.0.squashfs"), 'wb') as f:
+            f.write(os.urandom(1000))
+        server = serve_directory(test_dir)
+        self.skill.settings["prestage_updates"] = True
+        self.skill.settings["idle_updates"] = True
+        self.skill.settings["idle_seconds"] = 1
+        self.skill._prestage = dict()
+        self.skill._updating = False
+        working = list()
+        priority = list()
+        real_end_work = self.skill._idle_scheduler.end_work
+
+        def _end_work():
+            from os import getpriority, PRIO_PROCESS
+            from threading import get_native_id
+            working.append(self.skill._idle_scheduler.working)
+            priority.append(getpriority(PRIO_PROCESS, get_native_id()))
+            real_end_work()
+
+        # Pre-staging is rate limited and low priority by default
+        self.assertFalse(self.skill.background_priority)
+        self.assertEqual(self.skill.prestage_rate, 2 * 1024 * 1024)
+        self.skill.settings["max_download_rate_mb"] = 1
+        self.assertEqual(self.skill.prestage_rate, 1024 * 1024)
+        self.skill.settings.pop("max_download_rate_mb")
+
+        self.skill._idle_scheduler.end_work = _end_work
+        self.skill.bus.emit(Message("recognizer_loop:utterance"))
+        thread = Thread(target=self.skill._prestage_squashfs_update, args=(
+            Message("test"), {"build_version": "3.0.0",
+                              "base_os": {"platform": "rpi4"},
+                              "download_url": f"http://127.0.0.1:"
+                                              f"{server.server_port}/"
+                                              f"neon-3.0.0.img.xz"}))
+        thread.start()
+        thread.join(10)
+        self.assertGreaterEqual(self.skill._idle_scheduler.idle_time, 1)
+        self.assertEqual(working, [True])
+        self.assertGreaterEqual(priority[0], 10)
+        self.assertFalse(self.skill._idle_scheduler.working)
+        self.assertTrue(self.skill._prestage["staged"])
+
+        self.skill._discard_prestaged_update()
+        self.skill._idle_scheduler.end_work = real_end_work
+        server.shutdown()
+        self.skill.settings.pop("prestage_updates")
+        self.skill.settings.pop("idle_updates")
+        self.skill.settings.pop("idle_seconds")
+
+    def test_idle_prestage_paused(self):
+        test_dir = mkdtemp()
+        with open(join(test_dir, "neon-3.0.0.squashfs"), 'wb') as f:
+            f.write(os.urandom(12 * 1024 * 1024))
+        server = serve_directory(test_dir)
+        self.skill.settings["prestage_updates"] = True
+        self.skill.settings["idle_updates"] = True
+        self.skill.settings["idle_seconds"] = 0.5
+        self.skill.settings["prestage_rate_mb"] = 4
+        self.skill._prestage = dict()
+        self.skill._updating = False
+        self.skill._idle_scheduler.idle_seconds = 0.5
+        self.assertTrue(self.skill._idle_scheduler.wait(5))
+        thread = Thread(target=self.skill._prestage_squashfs_update, args=(
+            Message("test"), {"build_version": "3.0.0",
+                              "base_os": {"platform": "rpi4"},
+                              "download_url": f"http://127.0.0.1:"
+                                              f"{server.server_port}/"
+                                              f"neon-3.0.0.img.xz"}))
+        thread.start()
+        timeout = time() + 5
+        while not (self.skill._prestage and
+                   os.path.isfile(f"{self.skill._prestage['file']}.part") and
+                   os.path.getsize(f"{self.skill._prestage['file']}.part")) \
+                and time() < timeout:
+            sleep(0.05)
+        part_file = f"{self.skill._prestage['file']}.part"
+
+        # An utterance pauses the download until the device is idle again
+        self.skill._idle_scheduler.idle_seconds = 2
+        self.skill.bus.emit(Message("recognizer_loop:utterance"))
+        paused_time = time()
+        sleep(0.5)
+        paused_size = os.path.getsize(part_file)
+        self.assertLess(paused_size, 12 * 1024 * 1024)
+        sleep(1)
+        self.assertEqual(os.path.getsize(part_file), paused_size)
+        self.assertTrue(self.skill._prestage["done"].wait(10))
+        self.assertGreaterEqual(time() - paused_time, 2)
+        self.assertTrue(self.skill._prestage["staged"])
+        self.assertEqual(os.path.getsize(self.skill._prestage["file"]),
+                         12 * 1024 * 1024)
+        thread.join(5)
+
+        self.skill._discard_prestaged_update()
+        server.shutdown()
+        self.skill.settings.pop("prestage_updates")
+        self.skill.settings.pop("idle_updates")
+        self.skill.settings.pop("idle_seconds")
+        self.skill.settings.pop("prestage_rate_mb")
+
+    def test_handle_get_state(self):
+        plugin_requests = Mock()
+        for msg_type in ("neon.device_updater.get_build_info",
+                         "neon.core_updater.get_version",
+                         "neon.core_updater.check_update",
+                         "neon.check_update_squashfs"):
+            self.skill.bus.on(msg_type, plugin_requests)
+        self.skill.current_ver = None
+        self.skill._updating = False
+        self.skill._check_results = dict()
+        self.skill._download_progress = dict()
+        self.skill._last_update_result = None
+
+        # Nothing known yet
+        resp = self.skill.bus.wait_for_response(
+            Message("neon.update.get_state"))
+        self.assertIsNone(resp.data["installed_version"])
+        self.assertEqual(resp.data["tracks"], dict())
+        self.assertIsNone(resp.data["last_check"])
+        self.assertEqual(resp.data["state"], "idle")
+        self.assertFalse(resp.data["updating"])
+        self.assertIsNone(resp.data["last_result"])
+        plugin_requests.assert_not_called()
+
+        # State reflects completed checks and update progress
+        self.skill.current_ver = "1.0.0"
+        self.skill._record_check_result("master", "core", {
+            "installed_version": "1.0.0", "latest_version": "1.1.0"})
+        self.skill._record_check_result("dev", "squashfs", {
+            "update_available": True,
+            "update_metadata": {"build_version": "2.0.0b1"}})
+        self.skill._update_state.reset(
+            self.skill._update_state.state.SQUASHFS_DOWNLOADING)
+        self.skill._download_progress = {"progress": 50}
+        self.skill._set_update_result(False, "download_failed")
+        start = time()
+        resp = self.skill.bus.wait_for_response(
+            Message("neon.update.get_state"))
+        self.assertLess(time() - start, 0.5)
+        self.assertEqual(resp.data["installed_version"], "1.0.0")
+        self.assertEqual(resp.data["tracks"]["master"]["core"]
+                         ["latest_version"], "1.1.0")
+        self.assertTrue(resp.data["tracks"]["master"]["core"]
+                        ["update_available"])
+        self.assertEqual(resp.data["tracks"]["dev"]["squashfs"]
+                         ["latest_version"], "2.0.0b1")
+        self.assertIsInstance(resp.data["last_check"], float)
+        self.assertEqual(resp.data["state"], "squashfs_downloading")
+        self.assertTrue(resp.data["updating"])
+        self.assertEqual(resp.data["download_progress"], {"progress": 50})
+        self.assertFalse(resp.data["last_result"]["success"])
+        self.assertEqual(resp.data["last_result"]["error"], "download_failed")
+        plugin_requests.assert_not_called()
+
+        self.skill._updating = False
+        self.skill.current_ver = None
+        for msg_type in ("neon.device_updater.get_build_info",
+                         "neon.core_updater.get_version",
+                         "neon.core_updater.check_update",
+                         "neon.check_update_squashfs"):
+            self.skill.bus.remove(msg_type, plugin_requests)
+
+    def test_update_state_machine(self):
+        from skill_update.update_state import UpdateState, UpdateStateMachine
+        state = UpdateStateMachine()
+        self.assertEqual(state.state, UpdateState.IDLE)
+        self.assertFalse(state.busy)
+
+        # Only one caller may start checking
+        self.assertTrue(state.start_check())
+        self.assertFalse(state.start_check())
+        self.assertTrue(state.busy)
+
+        # Invalid transitions are rejected
+        self.assertFalse(state.transition(UpdateState.REBOOT_PENDING))
+        self.assertEqual(state.state, UpdateState.CHECKING)
+        self.assertFalse(state.transition(UpdateState.IDLE,
+                                          (UpdateState.CONFIRMED,)))
+
+        # Full update flow
+        for next_state in (UpdateState.CONFIRMED, UpdateState.INITRAMFS,
+                           UpdateState.SQUASHFS_DOWNLOADING,
+                           UpdateState.REBOOT_PENDING):
+            self.assertTrue(state.transition(next_state))
+        self.assertTrue(state.busy)
+        self.assertEqual([s[1] for s in state.history[-5:]],
+                         [UpdateState.CHECKING, UpdateState.CONFIRMED,
+                          UpdateState.INITRAMFS,
+                          UpdateState.SQUASHFS_DOWNLOADING,
+                          UpdateState.REBOOT_PENDING])
+
+        # A failed update may be retried
+        state.reset(UpdateState.FAILED)
+        self.assertFalse(state.busy)
+        self.assertTrue(state.start_check())
+
+    def test_os_update_exception(self):
+        from skill_update.update_state import UpdateState
+        real_apply = self.skill._apply_os_update
+        self.skill._apply_os_update = Mock(side_effect=RuntimeError("boom"))
+        self.skill._updating = True
+        txn = self.skill._update_journal.begin("squashfs", "downloading")
+        self.skill._update_txn = txn
+
+        # Unexpected errors end the update as failed
+        self.skill._run_os_update(Message("test"), False, True)
+        self.assertEqual(self.skill._update_state.state, UpdateState.FAILED)
+        self.assertFalse(self.skill._updating)
+        self.assertIsNone(self.skill._update_txn)
+        self.assertNotIn(txn, self.skill._update_journal.get_pending())
+        self.assertFalse(self.skill._last_update_result["success"])
+        self.skill.speak_dialog.assert_called_with(
+            "error_updating_os", {"help": ANY})
+
+        self.skill._apply_os_update = real_apply
+        self.skill._updating = False
 
     def test_handle_switch_update_track(self):
         real_ask_yesno = self.skill.ask_yesno
@@ -334,6 +1544,1292 @@ class TestSkill(SkillTestCase):
 
         self.skill.ask_yesno = real_ask_yesno
 
+    def test_stream_image_to_device(self):
+        import lzma
+        from skill_update.os_media import MediaWriteError, \
+            stream_image_to_device
+        test_dir = mkdtemp()
+        image = bytes(range(256)) * 4096 * 3
+        with open(join(test_dir, "image.img"), 'wb') as f:
+            f.write(image)
+        with open(join(test_dir, "image.img.xz"), 'wb') as f:
+            f.write(lzma.compress(image))
+        device = join(test_dir, "device")
+        server = serve_directory(test_dir)
+        base_url = f"http://127.0.0.1:{server.server_port}"
+
+        # Raw image through a buffer smaller than the image
+        open(device, 'wb').close()
+        progress = Mock()
+        result = stream_image_to_device(f"{base_url}/image.img", device,
+                                        chunk_size=65536, buffer_chunks=2,
+                                        on_progress=progress)
+        self.assertEqual(result["bytes_written"], len(image))
+        self.assertEqual(result["bytes_read"], len(image))
+        self.assertIsInstance(result["elapsed"], float)
+        self.assertEqual(progress.call_args[0][0]["bytes_written"],
+                         len(image))
+        with open(device, 'rb') as f:
+            self.assertEqual(f.read(), image)
+
+        # Compressed image is decompressed while writing
+        open(device, 'wb').close()
+        result = stream_image_to_device(f"{base_url}/image.img.xz", device)
+        self.assertEqual(result["bytes_written"], len(image))
+        self.assertLess(result["bytes_read"], len(image))
+        with open(device, 'rb') as f:
+            self.assertEqual(f.read(), image)
+
+        # Missing device
+        with self.assertRaises(MediaWriteError) as e:
+            stream_image_to_device(f"{base_url}/image.img",
+                                   join(test_dir, "missing"))
+        self.assertEqual(e.exception.error, "no_valid_device")
+
+        # Missing image
+        with self.assertRaises(MediaWriteError) as e:
+            stream_image_to_device(f"{base_url}/missing.img", device)
+        self.assertEqual(e.exception.error, "error_download")
+        server.shutdown()
+
+        # Unexpected errors are reported as a failed write
+        real_write_complete = self.skill.on_write_complete
+        real_get_sources = self.skill._get_image_sources
+        self.skill.on_write_complete = Mock()
+        self.skill._get_image_sources = Mock(side_effect=RuntimeError("test"))
+        self.skill.settings["image_drive"] = device
+        self.skill._write_os_media(Message("test"))
+        complete = self.skill.on_write_complete.call_args[0][0]
+        self.assertFalse(complete.data["success"])
+        self.assertEqual(complete.data["error"], "error_unknown")
+        self.skill.settings["image_drive"] = None
+        self.skill._get_image_sources = real_get_sources
+        self.skill.on_write_complete = real_write_complete
+
+    def test_block_map(self):
+        import hashlib
+        from skill_update.os_media import BlockMap, MediaWriteError, \
+            fetch_block_map, stream_image_to_device, write_image_to_device
+        test_dir = mkdtemp()
+        block_size = 4096
+        mapped = (0, 1, 2, 10, 40, 63)
+        image = bytearray(block_size * 64)
+        for block in mapped:
+            image[block * block_size:(block + 1) * block_size] = \
+                bytes([block + 1]) * block_size
+        image = bytes(image)
+        image_file = join(test_dir, "image.img")
+        with open(image_file, 'wb') as f:
+            f.write(image)
+        device = join(test_dir, "device")
+
+        def _reset_device():
+            with open(device, 'wb') as d:
+                d.write(b"\xff" * len(image))
+
+        def _check_device():
+            with open(device, 'rb') as d:
+                written = d.read()
+            for b in range(64):
+                expected = image[b * block_size:(b + 1) * block_size] \
+                    if b in mapped else b"\xff" * block_size
+                self.assertEqual(
+                    written[b * block_size:(b + 1) * block_size], expected)
+
+        # Generated map skips holes but not blocks of zeros
+        self.assertEqual(BlockMap.from_image(image_file).ranges,
+                         [(0, 63, None)])
+        sparse_file = join(test_dir, "sparse.img")
+        with open(sparse_file, 'wb') as f:
+            f.seek(block_size * 100)
+            f.write(b"data")
+            f.truncate(block_size * 200)
+        self.assertEqual(BlockMap.from_image(sparse_file).ranges,
+                         [(100, 100, None)])
+
+        # Only mapped blocks are written
+        bmap = BlockMap(len(image), block_size,
+                        [(0, 2, None), (10, 10, None), (40, 40, None),
+                         (63, 63, None)])
+        self.assertEqual(bmap.mapped_bytes, len(mapped) * block_size)
+        _reset_device()
+        result = write_image_to_device(image_file, device, bmap,
+                                       write_size=8192)
+        self.assertEqual(result["bytes_written"], bmap.mapped_bytes)
+        self.assertEqual(result["image_size"], len(image))
+        _check_device()
+
+        # Published bmap with checksums
+        ranges = ((0, 2), (10, 10), (40, 40), (63, 63))
+        xml = ""
+        for first, last in ranges:
+            chksum = hashlib.sha256(
+                image[first * block_size:(last + 1) * block_size]).hexdigest()
+            xml += f'<Range chksum="{chksum}"> {first}-{last} </Range>'
+        xml = f"<?xml version=\"1.0\" ?><bmap version=\"2.0\">" \
+              f"<ImageSize> {len(image)} </ImageSize>" \
+              f"<BlockSize> {block_size} </BlockSize>" \
+              f"<ChecksumType> sha256 </ChecksumType>" \
+              f"<BlockMap>{xml}</BlockMap></bmap>"
+        with open(join(test_dir, "image.bmap"), 'w') as f:
+            f.write(xml)
+        server = serve_directory(test_dir)
+        url = f"http://127.0.0.1:{server.server_port}/image.img"
+        bmap = fetch_block_map(url)
+        self.assertEqual(bmap.checksum_type, "sha256")
+        self.assertEqual(bmap.image_size, len(image))
+        self.assertEqual([r[:2] for r in bmap.ranges], list(ranges))
+        self.assertIsNone(fetch_block_map(f"{url}.missing"))
+        _reset_device()
+        result = stream_image_to_device(url, device, chunk_size=5000,
+                                        bmap=bmap)
+        self.assertEqual(result["bytes_written"], bmap.mapped_bytes)
+        _check_device()
+
+        # Checksum mismatch
+        bad_map = BlockMap(len(image), block_size, [(0, 2, "0" * 64)])
+        with self.assertRaises(MediaWriteError) as e:
+            write_image_to_device(image_file, device, bad_map)
+        self.assertEqual(e.exception.error, "error_image_corrupt")
+        with self.assertRaises(MediaWriteError) as e:
+            stream_image_to_device(url, device, bmap=bad_map)
+        self.assertEqual(e.exception.error, "error_image_corrupt")
+        server.shutdown()
+
+    def test_sparse_os_installation(self):
+        from skill_update.os_media import BlockMap
+        real_dismiss_method = self.skill._dismiss_notification
+        real_get_response = self.skill.get_response
+        real_write_complete = self.skill.on_write_complete
+        self.skill._dismiss_notification = Mock()
+        self.skill.get_response = Mock(return_value=True)
+        written = Event()
+        self.skill.on_write_complete = Mock(
+            side_effect=lambda m: written.set())
+        self.skill.settings["sparse_image_write"] = True
+        on_install_os = Mock()
+        self.skill.bus.on("neon.install_os_image", on_install_os)
+        test_dir = mkdtemp()
+        image_file = join(test_dir, "image.img")
+        with open(image_file, 'wb') as f:
+            f.write(b"data" * 1024)
+            f.truncate(4096 * 11)
+        device = join(test_dir, "device")
+        open(device, 'wb').close()
+        self.skill.settings["image_drive"] = device
+
+        message = Message("neon.download_os_image.complete",
+                          {"success": True, "image_file": image_file,
+                           "notification": "OS Download Completed"})
+        self.skill.continue_os_installation(message)
+        self.assertTrue(written.wait(10))
+        complete = self.skill.on_write_complete.call_args[0][0]
+        self.assertTrue(complete.data["success"])
+        self.assertEqual(complete.data["bytes_written"], 4096)
+        self.assertEqual(complete.data["image_size"], 4096 * 11)
+        with open(device, 'rb') as f:
+            self.assertEqual(f.read(), b"data" * 1024)
+
+        # Missing image file
+        written.clear()
+        self.skill.continue_os_installation(Message(
+            "neon.download_os_image.complete",
+            {"success": True, "image_file": join(test_dir, "missing")}))
+        self.assertTrue(written.wait(10))
+        complete = self.skill.on_write_complete.call_args[0][0]
+        self.assertFalse(complete.data["success"])
+        self.assertEqual(complete.data["error"], "no_image_file")
+        on_install_os.assert_not_called()
+
+        # Downloaded images are written with their published block map
+        block_size = 4096
+        image = bytearray(block_size * 16)
+        image[:block_size] = os.urandom(block_size)
+        image[block_size * 8:block_size * 9] = os.urandom(block_size)
+        image = bytes(image)
+        with open(join(test_dir, "published.img"), 'wb') as f:
+            f.write(image)
+        with open(join(test_dir, "published.bmap"), 'w') as f:
+            f.write(BlockMap(len(image), block_size,
+                             [(0, 0, None), (8, 8, None)]).to_xml())
+        server = serve_directory(test_dir)
+        self.skill.settings["image_url"] = \
+            f"http://127.0.0.1:{server.server_port}/published.img"
+        real_download_complete = self.skill.on_download_complete
+        self.skill.on_download_complete = Mock()
+        self.skill._download_os_image(Message("test"))
+        downloaded = self.skill.on_download_complete.call_args[0][0]
+        self.assertTrue(downloaded.data["success"])
+        with open(device, 'wb') as f:
+            f.write(b"\xff" * len(image))
+        written.clear()
+        self.skill.continue_os_installation(downloaded)
+        self.assertTrue(written.wait(10))
+        complete = self.skill.on_write_complete.call_args[0][0]
+        self.assertTrue(complete.data["success"])
+        self.assertEqual(complete.data["bytes_written"], block_size * 2)
+        with open(device, 'rb') as f:
+            written_image = f.read()
+        self.assertEqual(written_image[:block_size], image[:block_size])
+        self.assertEqual(written_image[block_size:block_size * 2],
+                         b"\xff" * block_size)
+        self.assertEqual(written_image[block_size * 8:block_size * 9],
+                         image[block_size * 8:block_size * 9])
+        server.shutdown()
+        self.skill.on_download_complete = real_download_complete
+        self.skill.settings["image_url"] = None
+
+        self.skill.bus.remove("neon.install_os_image", on_install_os)
+        self.skill.settings["sparse_image_write"] = False
+        self.skill.settings["image_drive"] = None
+        self.skill._dismiss_notification = real_dismiss_method
+        self.skill.get_response = real_get_response
+        self.skill.on_write_complete = real_write_complete
+
+    def test_download_image(self):
+        import hashlib
+        import lzma
+        from os.path import exists
+        from skill_update.os_media import MediaWriteError, download_image, \
+            fetch_digest, stream_image_to_device
+        test_dir = mkdtemp()
+        image = b"image data" * 30000
+        compressed = lzma.compress(image)
+        digest = hashlib.sha256(compressed).hexdigest()
+        with open(join(test_dir, "image.img.xz"), 'wb') as f:
+            f.write(compressed)
+        with open(join(test_dir, "image.img.xz.sha256"), 'w') as f:
+            f.write(f"{digest}  image.img.xz\n")
+        server = serve_directory(test_dir)
+        url = f"http://127.0.0.1:{server.server_port}/image.img.xz"
+        image_file = join(test_dir, "image.img")
+
+        # Published digest
+        self.assertEqual(fetch_digest(url), digest)
+        self.assertIsNone(fetch_digest(f"{url}.missing"))
+
+        # Download is verified and decompressed in one pass
+        result = download_image(url, image_file, sha256=digest)
+        self.assertEqual(result["sha256"], digest)
+        self.assertTrue(result["verified"])
+        self.assertEqual(result["bytes_read"], len(compressed))
+        with open(image_file, 'rb') as f:
+            self.assertEqual(f.read(), image)
+
+        # Digest is reported without an expected value
+        result = download_image(url, image_file)
+        self.assertEqual(result["sha256"], digest)
+        self.assertFalse(result["verified"])
+
+        # Corrupt download is removed
+        with self.assertRaises(MediaWriteError) as e:
+            download_image(url, image_file, sha256="0" * 64)
+        self.assertEqual(e.exception.error, "error_image_corrupt")
+        self.assertFalse(exists(image_file))
+
+        # Streamed writes are verified
+        device = join(test_dir, "device")
+        open(device, 'wb').close()
+        self.assertTrue(stream_image_to_device(url, device,
+                                               sha256=digest)["verified"])
+        with self.assertRaises(MediaWriteError) as e:
+            stream_image_to_device(url, device, sha256="0" * 64)
+        self.assertEqual(e.exception.error, "error_image_corrupt")
+        server.shutdown()
+
+    def test_verified_os_download(self):
+        import hashlib
+        real_ask_yesno = self.skill.ask_yesno
+        real_download_complete = self.skill.on_download_complete
+        self.skill.ask_yesno = Mock(return_value="yes")
+        downloaded = Event()
+        self.skill.on_download_complete = Mock(
+            side_effect=lambda m: downloaded.set())
+        self.skill.settings["verify_image_download"] = True
+        on_download = Mock()
+        self.skill.bus.on("neon.download_os_image", on_download)
+        test_dir = mkdtemp()
+        image = b"image" * 10000
+        with open(join(test_dir, "test.img"), 'wb') as f:
+            f.write(image)
+        with open(join(test_dir, "test.img.sha256"), 'w') as f:
+            f.write(hashlib.sha256(image).hexdigest())
+        server = serve_directory(test_dir)
+        self.skill.settings["image_url"] = \
+            f"http://127.0.0.1:{server.server_port}/test.img"
+        message = Message("test", context={"test": time()})
+
+        # Verified against published digest
+        self.skill.handle_create_os_media(message)
+        self.skill.speak_dialog.assert_any_call("downloading_image")
+        self.assertTrue(downloaded.wait(10))
+        complete = self.skill.on_download_complete.call_args[0][0]
+        self.assertEqual(complete.msg_type, "neon.download_os_image.complete")
+        self.assertEqual(complete.context, message.context)
+        self.assertTrue(complete.data["success"])
+        self.assertTrue(complete.data["verified"])
+        with open(complete.data["image_file"], 'rb') as f:
+            self.assertEqual(f.read(), image)
+
+        # Configured digest does not match
+        downloaded.clear()
+        self.skill.settings["image_sha256"] = "0" * 64
+        self.skill.handle_create_os_media(message)
+        self.assertTrue(downloaded.wait(10))
+        complete = self.skill.on_download_complete.call_args[0][0]
+        self.assertFalse(complete.data["success"])
+        self.assertEqual(complete.data["error"], "error_image_corrupt")
+        on_download.assert_not_called()
+
+        self.skill.bus.remove("neon.download_os_image", on_download)
+        server.shutdown()
+        self.skill.settings["verify_image_download"] = False
+        self.skill.settings["image_sha256"] = None
+        self.skill.settings["image_url"] = None
+        self.skill.ask_yesno = real_ask_yesno
+        self.skill.on_download_complete = real_download_complete
+
+    def test_image_cache(self):
+        from os.path import exists
+        from skill_update.image_cache import ImageCache, get_image_validator
+        test_dir = mkdtemp()
+        with open(join(test_dir, "image.img"), 'wb') as f:
+            f.write(b"image")
+        server = serve_directory(test_dir)
+        url = f"http://127.0.0.1:{server.server_port}/image.img"
+
+        # Validators
+        self.assertTrue(get_image_validator(url).startswith("modified:"))
+        self.assertEqual(get_image_validator(url, sha256="AB"), "sha256:ab")
+        self.assertIsNone(get_image_validator(f"{url}.missing"))
+        server.shutdown()
+
+        def _get_image(name: str, size: int = 100) -> str:
+            path = join(test_dir, name)
+            with open(path, 'wb') as f:
+                f.write(name.encode()[:1] * size)
+            return path
+
+        cache = ImageCache(join(test_dir, "cache"), 250)
+        cached = cache.put("url1", "v1", _get_image("a"), "digest1")
+        self.assertEqual(cached, join(test_dir, "cache", "digest1.img"))
+        self.assertFalse(exists(join(test_dir, "a")))
+        self.assertEqual(cache.get("url1", "v1"), cached)
+        self.assertIsNone(cache.get("url1", "v2"))
+        self.assertIsNone(cache.get("url1", None))
+
+        # Same content from another URL is stored once
+        cache.put("url2", "v1", _get_image("a"), "digest1")
+        self.assertEqual(cache.get("url2", "v1"), cached)
+        self.assertEqual(cache.size, 100)
+
+        # Least recently used image is evicted
+        cache.put("url3", "v1", _get_image("b"), "digest2")
+        cache.get("url1", "v1")
+        cache.put("url4", "v1", _get_image("c"), "digest3")
+        self.assertIsNone(cache.get("url3", "v1"))
+        self.assertFalse(exists(join(test_dir, "cache", "digest2.img")))
+        self.assertEqual(cache.get("url1", "v1"), cached)
+        self.assertIsNotNone(cache.get("url4", "v1"))
+        self.assertEqual(cache.size, 200)
+
+        # Image larger than the cache is not cached
+        large = _get_image("d", 300)
+        self.assertEqual(cache.put("url5", "v1", large, "digest4"), large)
+        self.assertIsNone(cache.get("url5", "v1"))
+
+        # Index is persisted
+        cache = ImageCache(join(test_dir, "cache"), 250)
+        self.assertEqual(cache.get("url1", "v1"), cached)
+        self.assertEqual(cache.stats["entries"], 3)
+
+        # Image removed outside of the cache is a miss
+        os.remove(cached)
+        misses = cache.misses
+        self.assertIsNone(cache.get("url1", "v1"))
+        self.assertEqual(cache.misses, misses + 1)
+        self.assertIsNone(cache.get("url2", "v1"))
+        self.assertEqual(cache.stats["entries"], 1)
+
+        # Removed images are ignored by size and eviction
+        os.remove(join(test_dir, "cache", "digest3.img"))
+        self.assertEqual(cache.size, 0)
+        cached = cache.put("url6", "v1", _get_image("e", 200), "digest5")
+        self.assertEqual(cache.get("url6", "v1"), cached)
+        self.assertEqual(cache.stats["entries"], 1)
+        self.assertEqual(cache.size, 200)
+
+    def test_cached_os_media(self):
+        from skill_update.image_cache import get_image_validator
+        real_ask_yesno = self.skill.ask_yesno
+        real_download_complete = self.skill.on_download_complete
+        real_continue = self.skill.continue_os_installation
+        self.skill.ask_yesno = Mock(return_value="yes")
+        downloaded = Event()
+        self.skill.on_download_complete = Mock(
+            side_effect=lambda m: downloaded.set())
+        self.skill.continue_os_installation = Mock()
+        self.skill.settings["image_cache_mb"] = 1
+        on_download = Mock()
+        self.skill.bus.on("neon.download_os_image", on_download)
+        test_dir = mkdtemp()
+        with open(join(test_dir, "cached.img"), 'wb') as f:
+            f.write(b"image" * 1000)
+        server = serve_directory(test_dir)
+        self.skill.settings["image_url"] = \
+            f"http://127.0.0.1:{server.server_port}/cached.img"
+        message = Message("test", context={"test": time()})
+
+        # First request downloads and caches the image
+        self.skill.handle_create_os_media(message)
+        self.assertTrue(downloaded.wait(10))
+        complete = self.skill.on_download_complete.call_args[0][0]
+        self.assertTrue(complete.data["success"])
+        image_file = complete.data["image_file"]
+        self.assertEqual(image_file, self.skill._image_cache.get(
+            self.skill.image_url,
+            get_image_validator(self.skill.image_url)))
+        self.skill.continue_os_installation.assert_not_called()
+
+        # Second request skips to drive confirmation
+        self.skill.on_download_complete.reset_mock()
+        self.skill.handle_create_os_media(message)
+        self.skill.on_download_complete.assert_not_called()
+        self.skill.continue_os_installation.assert_called_once()
+        cont = self.skill.continue_os_installation.call_args[0][0]
+        self.assertEqual(cont.data["image_file"], image_file)
+        self.assertEqual(cont.context, message.context)
+
+        # Changed image is downloaded again
+        sleep(1)
+        with open(join(test_dir, "cached.img"), 'wb') as f:
+            f.write(b"new image" * 1000)
+        downloaded.clear()
+        self.skill.handle_create_os_media(message)
+        self.assertTrue(downloaded.wait(10))
+        self.skill.continue_os_installation.assert_called_once()
+        on_download.assert_not_called()
+
+        self.skill.bus.remove("neon.download_os_image", on_download)
+        server.shutdown()
+        self.skill.settings["image_cache_mb"] = 0
+        self.skill.settings["image_url"] = None
+        self.skill.ask_yesno = real_ask_yesno
+        self.skill.on_download_complete = real_download_complete
+        self.skill.continue_os_installation = real_continue
+
+    def test_download_segmented(self):
+        import hashlib
+        import json
+        import lzma
+        from os.path import exists
+        from skill_update.os_media import MediaWriteError, download_segmented
+        test_dir = mkdtemp()
+        image = os.urandom(1000000)
+        compressed = lzma.compress(image)
+        with open(join(test_dir, "image.img"), 'wb') as f:
+            f.write(image)
+        with open(join(test_dir, "image.img.xz"), 'wb') as f:
+            f.write(compressed)
+        server = serve_directory(test_dir, ranges=True)
+        url = f"http://127.0.0.1:{server.server_port}/image.img"
+        image_file = join(test_dir, "download.img")
+
+        def _check_download():
+            with open(image_file, 'rb') as file:
+                self.assertEqual(file.read(), image)
+            self.assertFalse(exists(f"{image_file}.part"))
+            self.assertFalse(exists(f"{image_file}.part.json"))
+
+        # Concurrent segments with progress
+        progress = Mock()
+        result = download_segmented(url, image_file, connections=4,
+                                    segment_size=65536,
+                                    sha256=hashlib.sha256(image).hexdigest(),
+                                    on_progress=progress)
+        self.assertTrue(result["verified"])
+        self.assertEqual(result["bytes_read"], len(image))
+        self.assertEqual(result["resumed_bytes"], 0)
+        self.assertGreater(result["rate"], 0)
+        self.assertEqual(progress.call_args[0][0]["bytes_done"], len(image))
+        self.assertEqual(progress.call_args[0][0]["total_bytes"], len(image))
+        _check_download()
+
+        # Compressed segments are decompressed in order
+        result = download_segmented(f"{url}.xz", image_file,
+                                    segment_size=4096)
+        self.assertEqual(result["sha256"],
+                         hashlib.sha256(compressed).hexdigest())
+        self.assertEqual(result["image_size"], len(image))
+        _check_download()
+
+        # Failed segments are retried
+        _RangeHandler.failures = 3
+        download_segmented(url, image_file, connections=2,
+                           segment_size=100000, retries=2)
+        _check_download()
+
+        # Interrupted download is resumed from saved segments
+        _RangeHandler.failures = 100
+        with self.assertRaises(MediaWriteError) as e:
+            download_segmented(url, image_file, connections=1,
+                               segment_size=100000, retries=0)
+        self.assertEqual(e.exception.error, "error_download")
+        with open(f"{image_file}.part.json") as f:
+            state = json.load(f)
+        with open(f"{image_file}.part", 'r+b') as f:
+            f.write(image[:300000])
+        state["done"] = "111" + state["done"][3:]
+        with open(f"{image_file}.part.json", 'w') as f:
+            json.dump(state, f)
+        _RangeHandler.failures = 0
+        result = download_segmented(url, image_file, connections=2,
+                                    segment_size=100000)
+        self.assertEqual(result["resumed_bytes"], 300000)
+        self.assertEqual(result["bytes_read"], 700000)
+        _check_download()
+
+        # Corrupt download is removed
+        with self.assertRaises(MediaWriteError) as e:
+            download_segmented(url, image_file, sha256="0" * 64)
+        self.assertEqual(e.exception.error, "error_image_corrupt")
+        self.assertFalse(exists(f"{image_file}.part"))
+        server.shutdown()
+
+        # Servers without range support use a single request
+        server = serve_directory(test_dir)
+        progress = Mock()
+        result = download_segmented(
+            f"http://127.0.0.1:{server.server_port}/image.img", image_file,
+            on_progress=progress)
+        self.assertIn("source", result)
+        self.assertEqual(result["resumed_bytes"], 0)
+        self.assertEqual(progress.call_args[0][0]["bytes_done"], len(image))
+        self.assertEqual(progress.call_args[0][0]["total_bytes"], len(image))
+        self.assertIn("rate", progress.call_args[0][0])
+        _check_download()
+        server.shutdown()
+
+    def test_segmented_os_download(self):
+        real_ask_yesno = self.skill.ask_yesno
+        real_download_complete = self.skill.on_download_complete
+        self.skill.ask_yesno = Mock(return_value="yes")
+        downloaded = Event()
+        self.skill.on_download_complete = Mock(
+            side_effect=lambda m: downloaded.set())
+        self.skill.settings["download_connections"] = 4
+        self.skill._media_progress_time = 0
+        on_download = Mock()
+        on_controlled = Mock()
+        self.skill.bus.on("neon.download_os_image", on_download)
+        self.skill.bus.on("ovos.notification.api.set.controlled",
+                          on_controlled)
+        test_dir = mkdtemp()
+        image = os.urandom(100000)
+        with open(join(test_dir, "segmented.img"), 'wb') as f:
+            f.write(image)
+        server = serve_directory(test_dir, ranges=True)
+        self.skill.settings["image_url"] = \
+            f"http://127.0.0.1:{server.server_port}/segmented.img"
+
+        self.skill.handle_create_os_media(Message("test"))
+        self.assertTrue(downloaded.wait(10))
+        complete = self.skill.on_download_complete.call_args[0][0]
+        self.assertTrue(complete.data["success"])
+        self.assertIn("rate", complete.data)
+        with open(complete.data["image_file"], 'rb') as f:
+            self.assertEqual(f.read(), image)
+        texts = [call[0][0].data["text"] for call in
+                 on_controlled.call_args_list]
+        self.assertEqual(texts[0], "Downloading NeonOS Image")
+        self.assertTrue(texts[-1].startswith("Downloading NeonOS Image: 100%"),
+                        texts)
+        on_download.assert_not_called()
+
+        # Servers without range support fall back to a single download
+        fallback = serve_directory(test_dir)
+        self.skill.settings["image_url"] = \
+            f"http://127.0.0.1:{fallback.server_port}/segmented.img"
+        downloaded.clear()
+        on_controlled.reset_mock()
+        self.skill._media_progress_time = 0
+        self.skill.handle_create_os_media(Message("test"))
+        self.assertTrue(downloaded.wait(10))
+        complete = self.skill.on_download_complete.call_args[0][0]
+        self.assertTrue(complete.data["success"])
+        self.assertEqual(complete.data["resumed_bytes"], 0)
+        with open(complete.data["image_file"], 'rb') as f:
+            self.assertEqual(f.read(), image)
+        texts = [call[0][0].data["text"] for call in
+                 on_controlled.call_args_list]
+        self.assertTrue(texts[-1].startswith("Downloading NeonOS Image: 100%"),
+                        texts)
+        self.assertEqual(self.skill._update_journal.get_pending(), dict())
+
+        # A download resumed with one connection is restarted and finished
+        self.skill.settings["download_connections"] = 1
+        image_file = complete.data["image_file"]
+        txn = self.skill._update_journal.begin(
+            "os_image", "downloading", url=self.skill.image_url,
+            image_file=image_file, part_file=f"{image_file}.part")
+        with open(f"{image_file}.part", 'wb') as f:
+            f.write(image[:1000])
+        downloaded.clear()
+        self.skill._download_os_image(Message("test"), txn)
+        self.assertTrue(downloaded.wait(10))
+        complete = self.skill.on_download_complete.call_args[0][0]
+        self.assertTrue(complete.data["success"])
+        self.assertFalse(os.path.isfile(f"{image_file}.part"))
+        self.assertEqual(self.skill._update_journal.get_pending(), dict())
+        fallback.shutdown()
+
+        self.skill.bus.remove("neon.download_os_image", on_download)
+        self.skill.bus.remove("ovos.notification.api.set.controlled",
+                              on_controlled)
+        server.shutdown()
+        self.skill.settings["download_connections"] = 1
+        self.skill.settings["image_url"] = None
+        self.skill.ask_yesno = real_ask_yesno
+        self.skill.on_download_complete = real_download_complete
+
+    def test_stream_os_media(self):
+        real_ask_yesno = self.skill.ask_yesno
+        real_get_response = self.skill.get_response
+        real_write_complete = self.skill.on_write_complete
+        self.skill.ask_yesno = Mock(return_value="yes")
+        self.skill.get_response = Mock(return_value=None)
+        self.skill.on_write_complete = Mock()
+        self.skill.settings["stream_image_write"] = True
+        test_dir = mkdtemp()
+        image = b"image" * 100000
+        with open(join(test_dir, "image.img"), 'wb') as f:
+            f.write(image)
+        server = serve_directory(test_dir)
+        device = join(test_dir, "device")
+        open(device, 'wb').close()
+        self.skill.settings["image_url"] = \
+            f"http://127.0.0.1:{server.server_port}/image.img"
+        self.skill.settings["image_drive"] = device
+        on_download = Mock()
+        self.skill.bus.on("neon.download_os_image", on_download)
+        message = Message("test", context={"test": time()})
+
+        # Drive not confirmed
+        self.skill.handle_create_os_media(message)
+        self.assertEqual(self.skill.get_response.call_args[0][0],
+                         "ask_overwrite_drive")
+        self.skill.speak_dialog.assert_called_with("not_updating")
+        self.skill.on_write_complete.assert_not_called()
+
+        # Drive confirmed before the download starts
+        written = Event()
+        self.skill.on_write_complete.side_effect = lambda m: written.set()
+        self.skill.get_response.return_value = True
+        self.skill.handle_create_os_media(message)
+        self.skill.speak_dialog.assert_called_with("starting_installation")
+        self.assertTrue(written.wait(10))
+        complete = self.skill.on_write_complete.call_args[0][0]
+        self.assertEqual(complete.msg_type, "neon.install_os_image.complete")
+        self.assertEqual(complete.context, message.context)
+        self.assertTrue(complete.data["success"])
+        self.assertEqual(complete.data["bytes_written"], len(image))
+        with open(device, 'rb') as f:
+            self.assertEqual(f.read(), image)
+
+        # Write failure is reported as an install failure
+        written.clear()
+        self.skill.settings["image_drive"] = join(test_dir, "missing")
+        self.skill.handle_create_os_media(message)
+        self.assertTrue(written.wait(10))
+        complete = self.skill.on_write_complete.call_args[0][0]
+        self.assertFalse(complete.data["success"])
+        self.assertEqual(complete.data["error"], "no_valid_device")
+        on_download.assert_not_called()
+
+        self.skill.bus.remove("neon.download_os_image", on_download)
+        server.shutdown()
+        self.skill.settings["stream_image_write"] = False
+        self.skill.settings["image_url"] = None
+        self.skill.settings["image_drive"] = None
+        self.skill.ask_yesno = real_ask_yesno
+        self.skill.get_response = real_get_response
+        self.skill.on_write_complete = real_write_complete
+
+    def test_verify_device(self):
+        from os import urandom
+        from skill_update.os_media import BlockMap, verify_device, \
+            write_image_to_device
+        test_dir = mkdtemp()
+        block_size = 4096
+        image = bytearray(urandom(block_size * 300))
+        image[block_size * 10:block_size * 200] = bytes(block_size * 190)
+        image = bytes(image)
+        image_file = join(test_dir, "image.img")
+        with open(image_file, 'wb') as f:
+            # Leave a hole where the image is empty
+            f.write(image[:block_size * 10])
+            f.seek(block_size * 200)
+            f.write(image[block_size * 200:])
+        device = join(test_dir, "device")
+        with open(device, 'wb') as f:
+            f.write(b"\xff" * len(image))
+
+        # Sparse write is verified against the map used to write it
+        bmap = BlockMap.from_image(image_file)
+        write_image_to_device(image_file, device, bmap)
+        result = verify_device(image_file, device, bmap,
+                               chunk_size=block_size * 7, workers=2)
+        self.assertTrue(result["verified"])
+        self.assertEqual(result["mismatches"], [])
+        self.assertEqual(result["bytes_verified"], bmap.mapped_bytes)
+        self.assertGreater(result["rate"], 0)
+
+        # Unwritten blocks do not match the full image
+        result = verify_device(image_file, device,
+                               chunk_size=block_size * 50)
+        self.assertFalse(result["verified"])
+        self.assertEqual(result["bytes_verified"], len(image))
+
+        # Corrupted range is reported
+        with open(device, 'r+b') as f:
+            f.seek(block_size * 250 + 5)
+            f.write(b"!")
+        result = verify_device(image_file, device, bmap,
+                               chunk_size=block_size * 7)
+        self.assertEqual(len(result["mismatches"]), 1)
+        start, end = result["mismatches"][0]
+        self.assertTrue(start <= block_size * 250 + 5 < end)
+
+    def test_background_priority(self):
+        import subprocess
+        from os import getpriority, PRIO_PROCESS
+        from threading import get_native_id
+        from skill_update.os_media import RateLimiter, download_image, \
+            set_background_priority
+
+        # Rate is shared across threads after the initial burst
+        limiter = RateLimiter(100000)
+        start = time()
+        threads = [Thread(target=lambda: [limiter.consume(25000)
+                                          for _ in range(4)])
+                   for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertAlmostEqual(time() - start, 2, delta=0.5)
+
+        # Download bandwidth is capped
+        test_dir = mkdtemp()
+        with open(join(test_dir, "image.img"), 'wb') as f:
+            f.write(os.urandom(300000))
+        server = serve_directory(test_dir)
+        start = time()
+        download_image(f"http://127.0.0.1:{server.server_port}/image.img",
+                       join(test_dir, "download.img"), chunk_size=10000,
+                       max_rate=100000)
+        self.assertGreaterEqual(time() - start, 1.5)
+        server.shutdown()
+
+        # Priority is lowered for the calling thread and its children
+        priority = dict()
+
+        def _worker():
+            set_background_priority(niceness=5)
+            priority["worker"] = getpriority(PRIO_PROCESS, get_native_id())
+            priority["io"] = subprocess.run(
+                ["ionice", "-p", str(get_native_id())],
+                capture_output=True).stdout.decode().strip()
+            child = Thread(target=lambda: priority.setdefault(
+                "child", getpriority(PRIO_PROCESS, get_native_id())))
+            child.start()
+            child.join()
+
+        thread = Thread(target=_worker)
+        thread.start()
+        thread.join()
+        self.assertGreaterEqual(priority["worker"], 5)
+        self.assertEqual(priority["io"], "best-effort: prio 7")
+        self.assertEqual(priority["child"], priority["worker"])
+        self.assertLess(getpriority(PRIO_PROCESS, get_native_id()), 5)
+
+    def test_peer_cache(self):
+        import hashlib
+        import lzma
+        from multiprocessing import get_context
+        from skill_update.os_media import download_image
+        from skill_update.peer_cache import PeerCache, find_peers
+
+        payload = lzma.compress(os.urandom(100000))
+        digest = hashlib.sha256(payload).hexdigest()
+        ctx = get_context("spawn")
+        ports = ctx.Queue()
+        stop = ctx.Event()
+        peers = list()
+        for idx in range(3):
+            path = mkdtemp()
+            if idx < 2:
+                with open(join(path, f"{digest}.xz"), 'wb') as f:
+                    f.write(payload)
+            process = ctx.Process(target=_run_peer,
+                                  args=(path, ports, stop), daemon=True)
+            process.start()
+            peers.append(ports.get(timeout=30))
+        addresses = [("127.0.0.1", discovery) for _, discovery in peers]
+
+        # Only peers with the payload reply
+        urls = find_peers(digest, addresses)
+        self.assertEqual(set(urls),
+                         {f"http://127.0.0.1:{http}/{digest}"
+                          for http, _ in peers[:2]})
+        self.assertEqual(find_peers("0" * 64, addresses, 0.2), list())
+
+        # Payloads are verified, stored, and shared
+        cache = PeerCache(mkdtemp(), len(payload) + 100)
+        cache.start("127.0.0.1")
+        part_file = join(cache.path, f"{digest}.xz.part")
+        result = download_image(urls[0], part_file, sha256=digest,
+                                decompress=False)
+        self.assertEqual(result["sha256"], digest)
+        self.assertIsNone(cache.get(digest))
+        stored = cache.put(part_file, digest, ".xz")
+        self.assertEqual(cache.get(digest.upper()), stored)
+        self.assertEqual(len(find_peers(
+            digest, addresses + [("127.0.0.1", cache.discovery_port)])), 3)
+
+        # Only valid digests are served
+        with self.assertRaises(Exception):
+            download_image(f"http://127.0.0.1:{cache.http_port}/../../etc",
+                           join(mkdtemp(), "fail"))
+
+        # Least recently used payloads are evicted
+        extra_file = join(mkdtemp(), "extra")
+        with open(extra_file, 'wb') as f:
+            f.write(b"extra" * 40)
+        cache.put(extra_file, "1" * 64)
+        self.assertIsNone(cache.get(digest))
+        self.assertIsNotNone(cache.get("1" * 64))
+
+        cache.stop()
+        stop.set()
+
+    def test_peer_os_download(self):
+        import hashlib
+        import lzma
+        from skill_update.peer_cache import PeerCache
+        real_ask_yesno = self.skill.ask_yesno
+        real_download_complete = self.skill.on_download_complete
+        self.skill.ask_yesno = Mock(return_value="yes")
+        downloaded = Event()
+        self.skill.on_download_complete = Mock(
+            side_effect=lambda m: downloaded.set())
+        image = os.urandom(100000)
+        payload = lzma.compress(image)
+        digest = hashlib.sha256(payload).hexdigest()
+        peer = PeerCache(mkdtemp(), 1024 * 1024)
+        with open(join(peer.path, f"{digest}.xz"), 'wb') as f:
+            f.write(payload)
+        peer.start("127.0.0.1")
+        # The origin is unavailable, so the image must come from the peer
+        self.skill.settings["image_url"] = "http://127.0.0.1:1/peer.img.xz"
+        self.skill.settings["image_sha256"] = digest
+        self.skill.settings["peer_cache"] = True
+        self.skill.settings["peer_port"] = 0
+        self.skill.settings["peer_discovery_port"] = 0
+        self.skill.settings["peer_addresses"] = \
+            [f"127.0.0.1:{peer.discovery_port}"]
+
+        self.skill.handle_create_os_media(Message("test"))
+        self.assertTrue(downloaded.wait(10))
+        complete = self.skill.on_download_complete.call_args[0][0]
+        self.assertTrue(complete.data["success"])
+        self.assertEqual(complete.data["source"],
+                         f"http://127.0.0.1:{peer.http_port}/{digest}")
+        with open(complete.data["image_file"], 'rb') as f:
+            self.assertEqual(f.read(), image)
+        self.assertEqual(peer.served, 1)
+
+        # The payload is now shared by this device
+        shared = self.skill._peer_cache.get(digest)
+        self.assertIsNotNone(shared)
+        downloaded.clear()
+        peer.stop()
+        self.skill.handle_create_os_media(Message("test"))
+        self.assertTrue(downloaded.wait(10))
+        complete = self.skill.on_download_complete.call_args[0][0]
+        self.assertTrue(complete.data["success"])
+        self.assertEqual(complete.data["source"], shared)
+
+        # Unexpected errors sharing the image fall back to a direct download
+        origin_dir = mkdtemp()
+        with open(join(origin_dir, "peer.img.xz"), 'wb') as f:
+            f.write(payload)
+        origin = serve_directory(origin_dir)
+        origin_url = f"http://127.0.0.1:{origin.server_port}/peer.img.xz"
+        self.skill.settings["image_url"] = origin_url
+        real_get_peer_payload = self.skill._get_peer_payload
+        self.skill._get_peer_payload = Mock(side_effect=RuntimeError("test"))
+        downloaded.clear()
+        self.skill.handle_create_os_media(Message("test"))
+        self.assertTrue(downloaded.wait(10))
+        complete = self.skill.on_download_complete.call_args[0][0]
+        self.assertTrue(complete.data["success"])
+        self.assertEqual(complete.data["source"], origin_url)
+        with open(complete.data["image_file"], 'rb') as f:
+            self.assertEqual(f.read(), image)
+        self.skill._get_peer_payload = real_get_peer_payload
+        origin.shutdown()
+
+        self.skill._peer_cache.stop()
+        self.skill._peer_cache = None
+        for setting in ("image_url", "image_sha256", "peer_addresses"):
+            self.skill.settings[setting] = None
+        self.skill.settings["peer_cache"] = False
+        self.skill.ask_yesno = real_ask_yesno
+        self.skill.on_download_complete = real_download_complete
+
+    def test_update_mirror(self):
+        import json
+        from urllib.request import urlopen
+        from skill_update.update_mirror import UpdateMirror, get_mirror_url
+
+        test_dir = mkdtemp()
+        image = os.urandom(100000)
+        with open(join(test_dir, "image.img.xz"), 'wb') as f:
+            f.write(image)
+        upstream = serve_directory(test_dir)
+        base = f"http://127.0.0.1:{upstream.server_port}/"
+        with open(join(test_dir, "release.json"), 'w') as f:
+            json.dump({"url": f"{base}image.img.xz"}, f)
+        mirror = UpdateMirror(mkdtemp(), {"upstream": base}, max_age=0)
+        mirror.start(host="127.0.0.1")
+        mirror_url = f"http://127.0.0.1:{mirror.port}"
+        self.assertEqual(get_mirror_url(f"{base}image.img.xz", mirror_url,
+                                        mirror.upstreams),
+                         f"{mirror_url}/upstream/image.img.xz")
+        self.assertEqual(get_mirror_url("https://example.com/image.img",
+                                        mirror_url, mirror.upstreams),
+                         "https://example.com/image.img")
+
+        # Upstream URLs in metadata point at the mirror
+        with urlopen(f"{mirror_url}/upstream/release.json") as resp:
+            release = json.load(resp)
+        self.assertEqual(release["url"], f"{mirror_url}/upstream/image.img.xz")
+        with urlopen(release["url"]) as resp:
+            self.assertEqual(resp.read(), image)
+        # The download is streamed to the client before it is saved
+        timeout = time() + 5
+        while mirror.stats["fetched"] < 2 and time() < timeout:
+            sleep(0.1)
+        self.assertEqual(mirror.stats["fetched"], 2)
+
+        # Unchanged files are revalidated without downloading them again
+        with urlopen(release["url"]) as resp:
+            self.assertEqual(resp.read(), image)
+        self.assertEqual(mirror.stats["revalidated"], 1)
+        self.assertEqual(mirror.stats["fetched"], 2)
+        mirror.max_age = 60
+        with urlopen(release["url"]) as resp:
+            self.assertEqual(resp.read(), image)
+        self.assertEqual(mirror.stats["hits"], 1)
+
+        # Cached files are served while the upstream is unavailable
+        upstream.shutdown()
+        upstream.server_close()
+        mirror.max_age = 0
+        with urlopen(release["url"]) as resp:
+            self.assertEqual(resp.read(), image)
+        self.assertEqual(mirror.stats["stale"], 1)
+        with self.assertRaises(Exception):
+            urlopen(f"{mirror_url}/unknown/image.img.xz")
+
+        # Upstream failures while streaming close the client connection and
+        # don't leave partial files behind
+        broken = serve_directory(test_dir, handler=type(
+            "_TruncatingHandler", (_UnreliableHandler,), {"truncate": True}))
+        mirror.upstreams["broken"] = \
+            f"http://127.0.0.1:{broken.server_port}/"
+        with urlopen(f"{mirror_url}/broken/image.img.xz") as resp:
+            self.assertEqual(resp.status, 200)
+            with self.assertRaises(Exception):
+                resp.read()
+        sleep(0.5)
+        self.assertEqual([f for f in os.listdir(mirror.path)
+                          if f.endswith(".part")], [])
+        self.assertEqual(mirror.stats["entries"], 2)
+        broken.shutdown()
+        mirror.stop()
+
+    def test_mirror_os_download(self):
+        real_download_complete = self.skill.on_download_complete
+        self.skill.on_download_complete = Mock()
+        test_dir = mkdtemp()
+        image = os.urandom(100000)
+        with open(join(test_dir, "mirrored.img"), 'wb') as f:
+            f.write(image)
+        upstream = serve_directory(test_dir)
+        base = f"http://127.0.0.1:{upstream.server_port}/"
+        self.skill.settings["mirror_upstreams"] = {"upstream": base}
+        self.skill.settings["mirror_port"] = 0
+        self.skill.settings["update_mirror"] = True
+        self.skill._start_update_mirror()
+        mirror = self.skill._update_mirror
+        self.skill.settings["update_mirror_url"] = \
+            f"http://127.0.0.1:{mirror.port}"
+        self.skill.settings["image_url"] = f"{base}mirrored.img"
+        self.assertEqual(self.skill.image_url,
+                         f"http://127.0.0.1:{mirror.port}/upstream/"
+                         f"mirrored.img")
+
+        self.skill._download_os_image(Message("test"))
+        complete = self.skill.on_download_complete.call_args[0][0]
+        self.assertTrue(complete.data["success"])
+        with open(complete.data["image_file"], 'rb') as f:
+            self.assertEqual(f.read(), image)
+        self.assertEqual(mirror.stats["fetched"], 1)
+
+        mirror.stop()
+        upstream.shutdown()
+        self.skill._update_mirror = None
+        for setting in ("mirror_upstreams", "update_mirror_url", "image_url"):
+            self.skill.settings[setting] = None
+        self.skill.settings["update_mirror"] = False
+        self.skill.on_download_complete = real_download_complete
+
+    def test_image_failover(self):
+        import hashlib
+        from skill_update.os_media import MediaWriteError, download_image, \
+            download_segmented
+
+        test_dir = mkdtemp()
+        image = os.urandom(300000)
+        with open(join(test_dir, "image.img"), 'wb') as f:
+            f.write(image)
+        good = serve_directory(test_dir, ranges=True)
+        bad = serve_directory(test_dir, handler=type(
+            "_TruncatingHandler", (_UnreliableHandler,), {"truncate": True}))
+        good_url = f"http://127.0.0.1:{good.server_port}/image.img"
+        bad_url = f"http://127.0.0.1:{bad.server_port}/image.img"
+
+        # A failed download continues on the next mirror
+        result = download_image(bad_url, join(test_dir, "download.img"),
+                                chunk_size=10000, mirrors=[good_url])
+        self.assertEqual(result["source"], good_url)
+        self.assertEqual(result["bytes_read"], len(image))
+        with open(join(test_dir, "download.img"), 'rb') as f:
+            self.assertEqual(f.read(), image)
+
+        # A mirror that can't be shown to serve the same file is only used
+        # if the download is verified
+        copy_dir = mkdtemp()
+        with open(join(copy_dir, "image.img"), 'wb') as f:
+            f.write(image)
+        os.utime(join(copy_dir, "image.img"), (1, 1))
+        copy = serve_directory(copy_dir, ranges=True)
+        copy_url = f"http://127.0.0.1:{copy.server_port}/image.img"
+        with self.assertRaises(MediaWriteError) as e:
+            download_image(bad_url, join(test_dir, "download.img"),
+                           chunk_size=10000, mirrors=[copy_url])
+        self.assertEqual(e.exception.error, "error_download")
+        result = download_image(bad_url, join(test_dir, "download.img"),
+                                chunk_size=10000, mirrors=[copy_url],
+                                sha256=hashlib.sha256(image).hexdigest())
+        self.assertEqual(result["source"], copy_url)
+        self.assertTrue(result["verified"])
+        copy.shutdown()
+
+        # A mirror that doesn't continue from the failed offset is not used
+        def _ignore_range(handler):
+            handler.headers.replace_header("Range", "bytes=0-")
+            return _RangeHandler.send_head(handler)
+
+        wrong = serve_directory(test_dir, handler=type(
+            "_WrongRangeHandler", (_RangeHandler,),
+            {"send_head": _ignore_range}))
+        with self.assertRaises(MediaWriteError) as e:
+            download_image(bad_url, join(test_dir, "download.img"),
+                           chunk_size=10000, mirrors=[
+                               f"http://127.0.0.1:{wrong.server_port}/"
+                               f"image.img"],
+                           sha256=hashlib.sha256(image).hexdigest())
+        self.assertEqual(e.exception.error, "error_download")
+        wrong.shutdown()
+
+        # Failed segments are retried on the next mirror
+        result = download_segmented(bad_url, join(test_dir, "segmented.img"),
+                                    connections=2, segment_size=50000,
+                                    retries=0, mirrors=[good_url])
+        self.assertTrue(result["sha256"])
+        with open(join(test_dir, "segmented.img"), 'rb') as f:
+            self.assertEqual(f.read(), image)
+
+        good.shutdown()
+        bad.shutdown()
+
+    def test_mirror_selector(self):
+        from skill_update.update_mirror import MirrorSelector, probe_source
+
+        test_dir = mkdtemp()
+        with open(join(test_dir, "image.img"), 'wb') as f:
+            f.write(os.urandom(100000))
+        fast = serve_directory(test_dir, ranges=True)
+        slow = serve_directory(test_dir, handler=type(
+            "_SlowHandler", (_UnreliableHandler,), {"delay": 0.5}))
+        fast_url = f"http://127.0.0.1:{fast.server_port}/image.img"
+        slow_url = f"http://127.0.0.1:{slow.server_port}/image.img"
+        dead_url = "http://127.0.0.1:1/image.img"
+
+        probe = probe_source(slow_url)
+        self.assertGreaterEqual(probe["latency"], 0.5)
+        self.assertGreater(probe["rate"], 0)
+        self.assertIsNone(probe_source(dead_url))
+
+        # Sources are probed concurrently and ranked fastest first
+        selector = MirrorSelector(ttl=60)
+        start = time()
+        self.assertEqual(selector.rank([dead_url, slow_url, fast_url]),
+                         [fast_url, slow_url])
+        self.assertLess(time() - start, 1)
+        self.assertIsNone(selector.stats[dead_url])
+
+        # Rankings are cached until they expire or are invalidated
+        fast.shutdown()
+        fast.server_close()
+        self.assertEqual(selector.rank([dead_url, slow_url, fast_url]),
+                         [fast_url, slow_url])
+        selector.invalidate()
+        self.assertEqual(selector.rank([dead_url, slow_url, fast_url]),
+                         [slow_url])
+
+        # Servers that answer with an error are available but ranked last
+        missing_url = f"http://127.0.0.1:{slow.server_port}/missing.img"
+        self.assertEqual(probe_source(missing_url)["status"], 404)
+        selector.invalidate()
+        self.assertEqual(selector.rank([missing_url, dead_url, slow_url]),
+                         [slow_url, missing_url])
+        slow.shutdown()
+
+    def test_ranked_os_download(self):
+        real_download_complete = self.skill.on_download_complete
+        self.skill.on_download_complete = Mock()
+        test_dir = mkdtemp()
+        image = os.urandom(100000)
+        with open(join(test_dir, "ranked.img"), 'wb') as f:
+            f.write(image)
+        server = serve_directory(test_dir, ranges=True)
+        mirror_url = f"http://127.0.0.1:{server.server_port}/ranked.img"
+        self.skill.settings["image_url"] = "http://127.0.0.1:1/ranked.img"
+        self.skill.settings["image_mirrors"] = [mirror_url]
+
+        self.assertEqual(self.skill._get_image_sources(),
+                         [mirror_url, self.skill.image_url])
+        self.skill._download_os_image(Message("test"))
+        complete = self.skill.on_download_complete.call_args[0][0]
+        self.assertTrue(complete.data["success"])
+        self.assertEqual(complete.data["source"], mirror_url)
+        with open(complete.data["image_file"], 'rb') as f:
+            self.assertEqual(f.read(), image)
+
+        # Core updates need at least one available update source
+        self.skill.settings["update_sources"] = [mirror_url,
+                                                 self.skill.image_url]
+        self.assertEqual(self.skill._rank_sources(self.skill.update_sources),
+                         [mirror_url])
+        self.skill.settings["update_sources"] = [self.skill.image_url,
+                                                 f"{self.skill.image_url}.xz"]
+        self.assertEqual(self.skill._rank_sources(self.skill.update_sources),
+                         list())
+
+        # An offline site can update from a mirror whose root returns 404
+        from skill_update.update_mirror import UpdateMirror
+        mirror = UpdateMirror(mkdtemp(), {"upstream": "http://127.0.0.1:1/"})
+        mirror.start(host="127.0.0.1")
+        self.skill.settings["update_mirror_url"] = \
+            f"http://127.0.0.1:{mirror.port}"
+        self.skill.settings["update_sources"] = ["http://127.0.0.1:1/"]
+        self.assertEqual(self.skill._rank_sources(self.skill.update_sources),
+                         [self.skill.update_mirror_url])
+        mirror.stop()
+        self.skill.settings["update_mirror_url"] = None
+
+        server.shutdown()
+        self.skill._mirror_selector.invalidate()
+        for setting in ("image_url", "image_mirrors", "update_sources"):
+            self.skill.settings[setting] = None
+        self.skill.on_download_complete = real_download_complete
+
+    def test_verify_os_media(self):
+        real_dismiss_method = self.skill._dismiss_notification
+        real_get_response = self.skill.get_response
+        real_show_result = self.skill._show_write_result
+        self.skill._dismiss_notification = Mock()
+        self.skill.get_response = Mock(return_value=True)
+        shown = Event()
+        self.skill._show_write_result = Mock(side_effect=lambda m: shown.set())
+        self.skill.settings["verify_image_write"] = True
+        test_dir = mkdtemp()
+        image_file = join(test_dir, "image.img")
+        with open(image_file, 'wb') as f:
+            f.write(b"image" * 10000)
+        device = join(test_dir, "device")
+        with open(device, 'wb') as f:
+            f.write(b"image" * 10000)
+        self.skill.settings["image_drive"] = device
+        self.skill.bus.once("neon.install_os_image", Mock())
+        self.skill.continue_os_installation(Message(
+            "neon.download_os_image.complete",
+            {"success": True, "image_file": image_file}))
+        self.skill.remove_event("neon.install_os_image.complete")
+
+        # Written drive matches
+        message = Message("neon.install_os_image.complete", {"success": True},
+                          {"test": time()})
+        self.skill.on_write_complete(message)
+        self.assertTrue(shown.wait(10))
+        result = self.skill._show_write_result.call_args[0][0]
+        self.assertEqual(result.context, message.context)
+        self.assertTrue(result.data["success"])
+        self.assertTrue(result.data["verified"])
+        self.assertGreater(result.data["verify_rate"], 0)
+
+        # Written drive does not match
+        shown.clear()
+        with open(device, 'r+b') as f:
+            f.write(b"bad")
+        self.skill.on_write_complete(message)
+        self.assertTrue(shown.wait(10))
+        result = self.skill._show_write_result.call_args[0][0]
+        self.assertFalse(result.data["success"])
+        self.assertFalse(result.data["verified"])
+        self.assertEqual(result.data["error"], "error_verify_failed")
+
+        # Unexpected errors are reported as a failed verification
+        shown.clear()
+        real_bmap = self.skill._media_bmap
+        self.skill._media_bmap = Mock(byte_ranges=Mock(
+            side_effect=RuntimeError("broken")))
+        self.skill.on_write_complete(message)
+        self.assertTrue(shown.wait(10))
+        result = self.skill._show_write_result.call_args[0][0]
+        self.assertFalse(result.data["success"])
+        self.assertFalse(result.data["verified"])
+        self.assertEqual(result.data["error"], "error_verify_failed")
+        self.skill._media_bmap = real_bmap
+
+        # Failed writes are not verified
+        shown.clear()
+        self.skill.on_write_complete(Message("neon.install_os_image.complete",
+                                             {"success": False}))
+        self.assertTrue(shown.is_set())
+        self.assertNotIn("verified",
+                         self.skill._show_write_result.call_args[0][0].data)
+
+        self.skill.settings["verify_image_write"] = False
+        self.skill.settings["image_drive"] = None
+        self.skill._dismiss_notification = real_dismiss_method
+        self.skill.get_response = real_get_response
+        self.skill._show_write_result = real_show_result
+
     def test_on_download_complete(self):
         # Mock event handling from intent handler
         self.skill.add_event("neon.download_os_image.complete",
@@ -0,0 +1,299 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2025 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import hashlib
+
+from datetime import datetime
+from threading import Event, Lock
+from time import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple, \
+    Union
+
+from ovos_utils.log import LOG
+
+
+class OSUpdateCheck:
+    def __init__(self, initramfs_available: bool = False,
+                 squashfs_meta: Optional[dict] = None,
+                 timed_out: Optional[List[str]] = None,
+                 elapsed: float = 0.0):
+        """
+        Combined result of concurrent initramfs and squashfs update checks.
+        @param initramfs_available: True if an initramfs update is available
+        @param squashfs_meta: Metadata for an available squashfs update
+        @param timed_out: list of checks that did not complete before deadline
+        @param elapsed: seconds spent waiting for all checks
+        """
+        self.initramfs_available = initramfs_available
+        self.squashfs_meta = squashfs_meta
+        self.timed_out = timed_out or list()
+        self.elapsed = elapsed
+
+    @property
+    def squashfs_available(self) -> bool:
+        """
+        Returns True if a squashfs update is available
+        """
+        return isinstance(self.squashfs_meta, dict)
+
+    @property
+    def update_available(self) -> bool:
+        """
+        Returns True if any OS update is available
+        """
+        return self.initramfs_available or self.squashfs_available
+
+    def __repr__(self):
+        return (f"OSUpdateCheck(initramfs_available={self.initramfs_available}"
+                f", squashfs_meta={self.squashfs_meta}, "
+                f"timed_out={self.timed_out}, elapsed={self.elapsed:.3f})")
+
+
+class CheckCache:
+    def __init__(self, ttl: float):
+        """
+        Cache of update check responses keyed by update track and component
+        (`core`, `initramfs`, `squashfs`).
+        @param ttl: seconds a cached response remains valid; 0 disables caching
+        """
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[Tuple[str, str], Tuple[float, dict]] = dict()
+        self._lock = Lock()
+
+    def get(self, track: str, component: str) -> Optional[dict]:
+        """
+        Get a cached response if one exists and has not expired.
+        @param track: update track the check was made for
+        @param component: component that was checked
+        @return: cached response data, else None
+        """
+        with self._lock:
+            entry = self._entries.get((track, component))
+            if entry and time() - entry[0] < self.ttl:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, track: str, component: str, data: dict):
+        """
+        Cache a check response.
+        @param track: update track the check was made for
+        @param component: component that was checked
+        @param data: response data to cache
+        """
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[(track, component)] = (time(), data)
+
+    def invalidate(self, track: Optional[str] = None,
+                   component: Optional[str] = None):
+        """
+        Remove cached responses. Any unspecified key matches all entries.
+        @param track: update track to invalidate
+        @param component: component to invalidate
+        """
+        with self._lock:
+            for key in list(self._entries.keys()):
+                if track not in (None, key[0]) or \
+                        component not in (None, key[1]):
+                    continue
+                self._entries.pop(key)
+
+    @property
+    def stats(self) -> dict:
+        """
+        Get cache hit/miss counters.
+        """
+        return {"hits": self.hits, "misses": self.misses,
+                "entries": len(self._entries)}
+
+
+class _InFlightCall:
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error: Optional[Exception] = None
+
+
+class SingleFlight:
+    def __init__(self):
+        """
+        Coalesce concurrent calls with the same key so only one is executed
+        and every caller receives its result.
+        """
+        self.requests = 0
+        self.coalesced = 0
+        self._calls: Dict[Hashable, _InFlightCall] = dict()
+        self._lock = Lock()
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        """
+        Call `func`, or wait for the result of an in-flight call with the
+        same key.
+        @param key: key identifying equivalent calls
+        @param func: method to call if no equivalent call is in flight
+        @return: result of `func`
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            in_flight = call is not None
+            if in_flight:
+                self.coalesced += 1
+            else:
+                call = _InFlightCall()
+                self._calls[key] = call
+                self.requests += 1
+        if in_flight:
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.result
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key)
+            call.done.set()
+        return call.result
+
+    @property
+    def stats(self) -> dict:
+        """
+        Get counts of executed and coalesced calls.
+        """
+        return {"requests": self.requests, "coalesced": self.coalesced,
+                "in_flight": len(self._calls)}
+
+
+def _parse_time(value: Union[int, float, str]) -> float:
+    """
+    Parse a rollout schedule time as epoch seconds or an ISO 8601 string.
+    """
+    if isinstance(value, str):
+        return datetime.fromisoformat(value).timestamp()
+    return float(value)
+
+
+def get_rollout_percent(rollout: Union[None, int, float, dict],
+                        now: Optional[float] = None) -> float:
+    """
+    Get the percentage of devices an update is currently rolled out to.
+    @param rollout: rollout spec from update metadata; a percentage, a dict
+        with `percent`, or a dict with `start` and `end` times to ramp from 0
+        to 100 percent between. No spec means a full rollout.
+    @param now: epoch time to evaluate a schedule at (default now)
+    @return: percentage of devices (0-100) that are eligible
+    """
+    if rollout is None:
+        return 100.0
+    if isinstance(rollout, (int, float)):
+        return max(0.0, min(100.0, float(rollout)))
+    if "percent" in rollout:
+        return get_rollout_percent(rollout["percent"])
+    start = _parse_time(rollout["start"])
+    end = _parse_time(rollout["end"])
+    now = time() if now is None else now
+    if now >= end:
+        return 100.0
+    if now < start:
+        return 0.0
+    return 100.0 * (now - start) / (end - start)
+
+
+class RolloutGate:
+    def __init__(self, device_id: str, ttl: float = 3600):
+        """
+        Decide if this device is eligible for a staged update rollout. Each
+        device has a stable position from 0 to 100 for each version, derived
+        by hashing its ID with the version, and becomes eligible once the
+        rollout percentage passes that position. Once eligible, a version
+        stays eligible; ineligible results are reused for `ttl` seconds.
+        @param device_id: unique identifier of this device
+        @param ttl: seconds to reuse an ineligible result for
+        """
+        self.device_id = device_id
+        self.ttl = ttl
+        self._entries: Dict[Tuple[str, str], Tuple[float, bool]] = dict()
+        self._lock = Lock()
+
+    def position(self, version: str) -> float:
+        """
+        Get this device's position in the rollout of a version.
+        @param version: version being rolled out
+        @return: position from 0 (first) to 100 (last)
+        """
+        digest = hashlib.sha256(f"{self.device_id}:{version}".encode())
+        return int(digest.hexdigest()[:8], 16) / 0x100000000 * 100
+
+    def is_eligible(self, component: str, version: str,
+                    rollout: Union[None, int, float, dict],
+                    now: Optional[float] = None) -> bool:
+        """
+        Check if this device should act on an update yet.
+        @param component: component being updated
+        @param version: version being rolled out
+        @param rollout: rollout spec from update metadata
+        @param now: epoch time to evaluate a schedule at (default now)
+        @return: True if this device is included in the rollout
+        """
+        now = time() if now is None else now
+        with self._lock:
+            entry = self._entries.get((component, version))
+            if entry and (entry[1] or now - entry[0] < self.ttl):
+                return entry[1]
+            try:
+                eligible = self.position(version) < \
+                    get_rollout_percent(rollout, now)
+            except (KeyError, TypeError, ValueError) as e:
+                LOG.error(f"Invalid rollout for {component} {version}: "
+                          f"{rollout} ({e})")
+                eligible = True
+            self._entries[(component, version)] = (now, eligible)
+            return eligible
+
+
+def get_squashfs_url(meta: dict) -> Optional[str]:
+    """
+    Get the URL of the squashfs file for an update, derived from the OS image
+    URL in its metadata in the same way as the device updater plugin.
+    @param meta: squashfs update metadata
+    @return: URL of the squashfs file, or None if it can't be determined
+    """
+    url = meta.get("download_url")
+    platform = (meta.get("base_os") or dict()).get("platform")
+    if not url or not platform:
+        return None
+    return url.replace(f"/{platform}/", f"/{platform}/updates/").replace(
+        ".img.xz", ".squashfs")
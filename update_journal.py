@@ -0,0 +1,161 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2025 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+import os
+
+from threading import Lock
+from time import time
+from typing import Dict, List
+from uuid import uuid4
+
+from ovos_utils.log import LOG
+
+
+FINISHED_PHASES = ("complete", "failed", "cancelled")
+
+
+class UpdateJournal:
+    def __init__(self, path: str, progress_interval: float = 10):
+        """
+        Append-only journal of update transactions. Each line is a JSON record
+        of a transaction (`txn`) moving to a new `phase` with optional data,
+        such as bytes done or the location of a partial file. Records are
+        synced to disk as they are written so that an interrupted update can
+        be found after a restart.
+        @param path: path to the journal file
+        @param progress_interval: minimum seconds between progress records
+        """
+        self.path = path
+        self.progress_interval = progress_interval
+        self._last_progress: Dict[str, float] = dict()
+        self._lock = Lock()
+
+    def _append(self, record: dict):
+        record["time"] = time()
+        with self._lock:
+            with open(self.path, 'ab+') as f:
+                # Start a new line if the last record was partially written
+                if f.tell():
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        f.write(b"\n")
+                f.write(json.dumps(record).encode() + b"\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def records(self) -> List[dict]:
+        """
+        Read all records in the journal. A partially written last record (i.e.
+        from a power loss) is ignored.
+        @return: list of records, oldest first
+        """
+        if not os.path.isfile(self.path):
+            return list()
+        records = list()
+        with self._lock:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        LOG.warning(f"Ignoring invalid journal record: {line}")
+        return records
+
+    def begin(self, component: str, phase: str, **data) -> str:
+        """
+        Start a new transaction.
+        @param component: component being updated (`core`, `squashfs`,
+            `os_image`)
+        @param phase: initial phase of the transaction
+        @param data: additional data to record
+        @return: transaction ID
+        """
+        txn = f"{component}-{uuid4().hex}"
+        self._append({**data, "txn": txn, "component": component,
+                      "phase": phase})
+        return txn
+
+    def record(self, txn: str, phase: str, **data):
+        """
+        Record a transaction moving to a new phase.
+        @param txn: transaction ID
+        @param phase: new phase of the transaction
+        @param data: additional data to record
+        """
+        self._append({**data, "txn": txn, "phase": phase})
+
+    def progress(self, txn: str, phase: str, **data):
+        """
+        Record transaction progress, at most every `progress_interval` seconds.
+        @param txn: transaction ID
+        @param phase: current phase of the transaction
+        @param data: progress data, i.e. `bytes_done`
+        """
+        if time() - self._last_progress.get(txn, 0) < self.progress_interval:
+            return
+        self._last_progress[txn] = time()
+        self.record(txn, phase, **data)
+
+    def finish(self, txn: str, result: str, **data):
+        """
+        Record the end of a transaction.
+        @param txn: transaction ID
+        @param result: one of `complete`, `failed`, or `cancelled`
+        @param data: additional data to record
+        """
+        if result not in FINISHED_PHASES:
+            raise ValueError(f"Invalid result: {result}")
+        self._last_progress.pop(txn, None)
+        self.record(txn, result, **data)
+
+    def get_pending(self) -> Dict[str, dict]:
+        """
+        Get transactions that have not finished.
+        @return: dict of transaction ID to the latest value of each recorded
+            field, in the order transactions were started
+        """
+        transactions = dict()
+        for record in self.records():
+            transactions.setdefault(record["txn"], dict()).update(record)
+        return {txn: state for txn, state in transactions.items()
+                if state["phase"] not in FINISHED_PHASES}
+
+    def compact(self):
+        """
+        Rewrite the journal with one record per unfinished transaction.
+        """
+        pending = self.get_pending()
+        tmp_path = f"{self.path}.tmp"
+        with self._lock:
+            with open(tmp_path, 'w') as f:
+                for state in pending.values():
+                    f.write(json.dumps(state) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
@@ -0,0 +1,460 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2025 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import hashlib
+import json
+import os
+import shutil
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import time
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from ovos_utils.log import LOG
+
+from .update_checks import SingleFlight
+
+
+DEFAULT_UPSTREAMS = {"github": "https://github.com/",
+                     "github-api": "https://api.github.com/",
+                     "pypi": "https://pypi.org/",
+                     "pythonhosted": "https://files.pythonhosted.org/"}
+
+
+def get_mirror_url(url: Optional[str], mirror: Optional[str],
+                   upstreams: Dict[str, str]) -> Optional[str]:
+    """
+    Get the URL of an upstream artifact on a local update mirror.
+    @param url: upstream URL
+    @param mirror: base URL of the mirror, i.e. `http://192.168.1.10:31852`
+    @param upstreams: dict of mirror path names to upstream base URLs
+    @return: URL on the mirror, else `url` if it is not mirrored
+    """
+    if not url or not mirror:
+        return url
+    for name, base in upstreams.items():
+        if url.startswith(base):
+            return f"{mirror.rstrip('/')}/{name}/{url[len(base):]}"
+    return url
+
+
+_DownloadCallback = Callable[[dict], Optional[BinaryIO]]
+
+
+def _is_text(content_type: Optional[str]) -> bool:
+    content_type = (content_type or "").lower()
+    return content_type.startswith("text/") or \
+        any(kind in content_type for kind in ("json", "html", "xml"))
+
+
+class UpdateMirror:
+    def __init__(self, path: str, upstreams: Dict[str, str],
+                 max_age: float = 300, max_bytes: int = 0,
+                 timeout: float = 30):
+        """
+        Caching mirror of update artifacts (release metadata, OS images,
+        packages) for other devices on the local network. Files are served
+        at `/<name>/<path>` for each upstream `name`. A cached file is
+        revalidated with a conditional request once it is older than
+        `max_age`, so unchanged artifacts are not downloaded again, and is
+        served as-is if the upstream is unreachable. Upstream URLs in text
+        responses are rewritten to point at the mirror.
+        @param path: directory to store files in
+        @param upstreams: dict of path names to upstream base URLs
+        @param max_age: seconds a cached file is served without revalidation
+        @param max_bytes: maximum total size of cached files; 0 for no limit
+        @param timeout: seconds to wait for an upstream server
+        """
+        self.path = path
+        self.upstreams = upstreams
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.port = None
+        self.hits = 0
+        self.revalidated = 0
+        self.fetched = 0
+        self.stale = 0
+        self.bytes_fetched = 0
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._flights = SingleFlight()
+        self._index_file = os.path.join(path, "index.json")
+        self._lock = Lock()
+        os.makedirs(path, exist_ok=True)
+        self._index: Dict[str, dict] = self._load()
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            with open(self._index_file) as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return dict()
+        except Exception as e:
+            LOG.error(f"Failed to load mirror index: {e}")
+            return dict()
+        return {url: entry for url, entry in index.items()
+                if os.path.isfile(os.path.join(self.path, entry["file"]))}
+
+    def _save(self):
+        try:
+            with open(self._index_file, 'w+') as f:
+                json.dump(self._index, f)
+        except Exception as e:
+            LOG.error(f"Failed to save mirror index: {e}")
+
+    def get(self, url: str,
+            on_download: Optional[_DownloadCallback] = None) -> dict:
+        """
+        Get a current copy of an upstream file. Concurrent requests for the
+        same file share one upstream request.
+        @param url: upstream URL
+        @param on_download: optional callback with the new entry when the
+            file is downloaded; may return a stream to copy the download to
+        @return: dict with the `path`, `content_type`, `size`, `etag`, and
+            `modified` time of the cached file
+        @raises HTTPError: if the upstream returned an error
+        @raises OSError: if the file is not cached and the upstream could
+            not be reached
+        """
+        entry = self._flights.do(url, lambda: self._refresh(url, on_download))
+        with self._lock:
+            entry["last_used"] = time()
+        return {**entry, "path": os.path.join(self.path, entry["file"])}
+
+    def _refresh(self, url: str,
+                 on_download: Optional[_DownloadCallback]) -> dict:
+        with self._lock:
+            entry = self._index.get(url)
+        if entry and time() - entry["checked"] < self.max_age:
+            self.hits += 1
+            return entry
+        headers = dict()
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("modified"):
+            headers["If-Modified-Since"] = entry["modified"]
+        try:
+            resp = urlopen(Request(url, headers=headers), timeout=self.timeout)
+        except HTTPError as e:
+            if e.code == 304 and entry:
+                LOG.debug(f"Mirror copy of {url} is current")
+                self.revalidated += 1
+                with self._lock:
+                    entry["checked"] = time()
+                    self._save()
+                return entry
+            raise
+        except OSError as e:
+            if not entry:
+                raise
+            LOG.warning(f"Serving mirror copy of {url} ({e})")
+            self.stale += 1
+            return entry
+        name = hashlib.sha256(url.encode()).hexdigest()
+        part_file = os.path.join(self.path, f"{name}.part")
+        try:
+            with resp:
+                length = resp.headers.get("Content-Length")
+                new_entry = {"file": name,
+                             "content_type": resp.headers.get("Content-Type"),
+                             "size": int(length) if length else None,
+                             "etag": resp.headers.get("ETag"),
+                             "modified": resp.headers.get("Last-Modified"),
+                             "checked": time(), "last_used": time()}
+                out = on_download(new_entry) if on_download else None
+                with open(part_file, 'wb') as f:
+                    while True:
+                        chunk = resp.read(1024 * 1024)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                        self.bytes_fetched += len(chunk)
+                        try:
+                            if out:
+                                out.write(chunk)
+                        except OSError:
+                            # Keep downloading for other devices
+                            LOG.warning(f"Client disconnected from {url}")
+                            out = None
+            size = os.path.getsize(part_file)
+            if new_entry["size"] is not None and size != new_entry["size"]:
+                raise IOError(f"Expected {new_entry['size']} bytes from "
+                              f"{url} but read {size}")
+            new_entry["size"] = size
+            with self._lock:
+                os.replace(part_file,
+                           os.path.join(self.path, new_entry["file"]))
+                self._index[url] = new_entry
+                self._evict(keep=url)
+                self._save()
+        finally:
+            # Don't leave a partial download behind if the upstream failed
+            if os.path.isfile(part_file):
+                os.remove(part_file)
+        self.fetched += 1
+        LOG.info(f"Mirrored {url} ({new_entry['size']} bytes)")
+        return new_entry
+
+    def _evict(self, keep: str):
+        if not self.max_bytes:
+            return
+        total = sum(entry["size"] for entry in self._index.values())
+        for url in sorted(self._index,
+                          key=lambda u: self._index[u]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if url == keep:
+                continue
+            entry = self._index.pop(url)
+            total -= entry["size"]
+            os.remove(os.path.join(self.path, entry["file"]))
+            LOG.info(f"Evicted mirrored file: {url}")
+
+    def rewrite(self, data: bytes, mirror: str) -> bytes:
+        """
+        Rewrite upstream URLs in a text response to point at the mirror.
+        @param data: response body
+        @param mirror: base URL of the mirror as seen by the client
+        @return: rewritten response body
+        """
+        for name, base in self.upstreams.items():
+            data = data.replace(base.encode(), f"{mirror}/{name}/".encode())
+        return data
+
+    def start(self, port: int = 0, host: str = ""):
+        """
+        Start serving mirrored files.
+        @param port: TCP port to listen on (0 for any)
+        @param host: address to listen on (default all interfaces)
+        """
+        mirror = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self._serve(True)
+
+            def do_HEAD(self):
+                self._serve(False)
+
+            def _send_headers(self, entry: dict, size: Optional[int]):
+                self.send_response(200)
+                for header, key in (("Content-Type", "content_type"),
+                                    ("ETag", "etag"),
+                                    ("Last-Modified", "modified")):
+                    if entry.get(key):
+                        self.send_header(header, entry[key])
+                if size is not None:
+                    self.send_header("Content-Length", str(size))
+                self.end_headers()
+
+            def _serve(self, body: bool):
+                name, _, path = self.path.lstrip('/').partition('/')
+                if name not in mirror.upstreams:
+                    self.send_error(404)
+                    return
+                sent = False
+
+                def _on_download(entry: dict) -> Optional[BinaryIO]:
+                    nonlocal sent
+                    if _is_text(entry["content_type"]):
+                        # Text is rewritten after it is downloaded
+                        return None
+                    self._send_headers(entry, entry["size"])
+                    sent = True
+                    return self.wfile if body else None
+
+                try:
+                    entry = mirror.get(mirror.upstreams[name] + path,
+                                       _on_download)
+                except HTTPError as e:
+                    self.send_error(e.code)
+                    return
+                except Exception as e:
+                    LOG.error(f"Failed to mirror {self.path}: {e}")
+                    if sent:
+                        # Too late for an error response; the client sees the
+                        # connection close before the response is complete
+                        self.close_connection = True
+                    else:
+                        self.send_error(502)
+                    return
+                if sent:
+                    return
+                with open(entry["path"], 'rb') as f:
+                    if _is_text(entry["content_type"]):
+                        data = mirror.rewrite(
+                            f.read(), f"http://{self.headers.get('Host')}")
+                        self._send_headers(entry, len(data))
+                        if body:
+                            self.wfile.write(data)
+                        return
+                    self._send_headers(entry, entry["size"])
+                    if body:
+                        shutil.copyfileobj(f, self.wfile, 1024 * 1024)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self.port = self._server.server_port
+        Thread(target=self._server.serve_forever, daemon=True).start()
+        LOG.info(f"Serving update mirror on port {self.port}")
+
+    def stop(self):
+        """
+        Stop serving mirrored files.
+        """
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @property
+    def stats(self) -> dict:
+        """
+        Get counts of requests served from the mirror without downloading,
+        revalidated, downloaded, and served while the upstream was
+        unavailable.
+        """
+        return {"hits": self.hits, "revalidated": self.revalidated,
+                "fetched": self.fetched, "stale": self.stale,
+                "bytes_fetched": self.bytes_fetched,
+                "entries": len(self._index)}
+
+
+def probe_source(url: str, probe_bytes: int = 64 * 1024,
+                 timeout: float = 5) -> Optional[dict]:
+    """
+    Measure the latency and throughput of a download source by requesting
+    the first `probe_bytes` of `url`. A server that answers with an HTTP
+    error (i.e. 404 for the root of a mirror) is still available, but its
+    throughput can't be measured.
+    @param url: URL to probe
+    @param probe_bytes: number of bytes to download
+    @param timeout: seconds to wait for the server
+    @return: dict with `latency` seconds to the first byte, `rate` in
+        bytes/s, and HTTP `status`, or None if the source is unavailable
+    """
+    start = time()
+    try:
+        request = Request(url, headers={"Range": f"bytes=0-{probe_bytes - 1}"})
+        with urlopen(request, timeout=timeout) as resp:
+            status = resp.status
+            received = len(resp.read(1))
+            latency = time() - start
+            received += len(resp.read(probe_bytes - 1))
+    except HTTPError as e:
+        LOG.info(f"Source answered with an error: {url} ({e})")
+        return {"latency": time() - start, "rate": 0.0, "status": e.code}
+    except Exception as e:
+        LOG.info(f"Source unavailable: {url} ({e})")
+        return None
+    elapsed = time() - start
+    return {"latency": latency,
+            "rate": received / elapsed if elapsed else float(received),
+            "status": status}
+
+
+class MirrorSelector:
+    def __init__(self, ttl: float = 3600, probe_bytes: int = 64 * 1024,
+                 transfer_bytes: int = 8 * 1024 * 1024, timeout: float = 5):
+        """
+        Ranks equivalent download sources by probing them concurrently.
+        Sources are ordered by the estimated time to download
+        `transfer_bytes` from their probed latency and throughput, and
+        rankings are cached for `ttl` seconds.
+        @param ttl: seconds to cache a ranking for
+        @param probe_bytes: number of bytes to download from each source
+        @param transfer_bytes: transfer size to rank sources for
+        @param timeout: seconds to wait for each source
+        """
+        self.ttl = ttl
+        self.probe_bytes = probe_bytes
+        self.transfer_bytes = transfer_bytes
+        self.timeout = timeout
+        self._results: Dict[str, Optional[dict]] = dict()
+        self._rankings: Dict[Tuple[str, ...], Tuple[float, List[str]]] = \
+            dict()
+        self._flights = SingleFlight()
+        self._lock = Lock()
+
+    def rank(self, urls: List[str]) -> List[str]:
+        """
+        Get available sources, fastest first.
+        @param urls: equivalent URLs to rank
+        @return: URLs that responded to a probe, in order of preference;
+            empty only if no source answered
+        """
+        key = tuple(urls)
+        with self._lock:
+            checked, ranking = self._rankings.get(key, (0, None))
+        if ranking and time() - checked < self.ttl:
+            return list(ranking)
+        return list(self._flights.do(key, lambda: self._probe(urls)))
+
+    def _probe(self, urls: List[str]) -> List[str]:
+        if not urls:
+            return list()
+        with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+            results = dict(zip(urls, executor.map(
+                lambda url: probe_source(url, self.probe_bytes, self.timeout),
+                urls)))
+        # Sources that answered with an error are ranked after the rest
+        ranking = sorted(
+            (url for url in urls if results[url]),
+            key=lambda url: (results[url]["status"] >= 400,
+                             results[url]["latency"] +
+                             self.transfer_bytes /
+                             max(results[url]["rate"], 1)))
+        LOG.info(f"Ranked sources: {ranking}")
+        with self._lock:
+            self._results.update(results)
+            # Don't cache an outage
+            if ranking:
+                self._rankings[tuple(urls)] = (time(), ranking)
+        return ranking
+
+    def invalidate(self):
+        """
+        Discard cached rankings so sources are probed again.
+        """
+        with self._lock:
+            self._rankings.clear()
+
+    @property
+    def stats(self) -> Dict[str, Optional[dict]]:
+        """
+        Get the latest probe result for each source; None if it was
+        unavailable.
+        """
+        with self._lock:
+            return dict(self._results)
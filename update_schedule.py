@@ -0,0 +1,237 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2025 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from contextlib import contextmanager
+from random import Random
+from statistics import mean
+from threading import Lock
+from time import localtime, sleep, time
+from typing import Dict, List, Optional, Tuple
+from uuid import getnode
+
+from ovos_bus_client import Message
+
+
+ACTIVITY_EVENTS = ("recognizer_loop:wakeword",
+                   "recognizer_loop:record_begin",
+                   "recognizer_loop:utterance",
+                   "recognizer_loop:audio_output_start",
+                   "recognizer_loop:audio_output_end",
+                   "speak")
+
+
+class IdleScheduler:
+    def __init__(self, idle_seconds: float = 120,
+                 quiet_hours: Optional[Tuple[int, int]] = None,
+                 max_samples: int = 100):
+        """
+        Decide when background update work may run, based on recent voice
+        interaction and optional quiet hours. Response latency (from an
+        utterance to the next `speak`) is recorded separately for responses
+        made while update work was running so the effect can be measured.
+        @param idle_seconds: seconds without interaction before the device is
+            considered idle
+        @param quiet_hours: optional (start, end) local hours to limit
+            background work to, i.e. (1, 5) for 1:00 to 5:00
+        @param max_samples: number of latency samples to keep
+        """
+        self.idle_seconds = idle_seconds
+        self.quiet_hours = quiet_hours
+        self.max_samples = max_samples
+        self._last_activity = time()
+        self._utterance_time: Optional[float] = None
+        self._working = 0
+        self._latency: Dict[str, List[float]] = {"updating": list(),
+                                                 "not_updating": list()}
+        self._lock = Lock()
+
+    @property
+    def idle_time(self) -> float:
+        """
+        Seconds since the last voice interaction.
+        """
+        return time() - self._last_activity
+
+    @property
+    def working(self) -> bool:
+        """
+        Returns True if update work is running.
+        """
+        return self._working > 0
+
+    @property
+    def latency_stats(self) -> Dict[str, dict]:
+        """
+        Response latency statistics while updating and while not updating.
+        """
+        with self._lock:
+            return {key: {"count": len(samples),
+                          "mean": mean(samples) if samples else None,
+                          "max": max(samples) if samples else None}
+                    for key, samples in self._latency.items()}
+
+    def on_activity(self, message: Message):
+        """
+        Handle a voice interaction event.
+        @param message: Message with a type in `ACTIVITY_EVENTS`
+        """
+        now = time()
+        with self._lock:
+            self._last_activity = now
+            if message.msg_type == "recognizer_loop:utterance":
+                self._utterance_time = now
+            elif message.msg_type == "speak" and self._utterance_time:
+                samples = self._latency["updating" if self.working
+                                        else "not_updating"]
+                samples.append(now - self._utterance_time)
+                del samples[:-self.max_samples]
+                self._utterance_time = None
+
+    def in_quiet_hours(self, now: Optional[float] = None) -> bool:
+        """
+        Check if a time is within quiet hours. If no quiet hours are
+        configured, any time is allowed.
+        @param now: epoch time to check (default now)
+        @return: True if background work is allowed at `now`
+        """
+        if not self.quiet_hours:
+            return True
+        start, end = self.quiet_hours
+        hour = localtime(now).tm_hour
+        if start <= end:
+            return start <= hour < end
+        # Quiet hours span midnight
+        return hour >= start or hour < end
+
+    def can_run(self) -> bool:
+        """
+        Returns True if background work may start now.
+        """
+        return self.idle_time >= self.idle_seconds and self.in_quiet_hours()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until background work may start.
+        @param timeout: maximum seconds to wait (default no limit)
+        @return: True if work may start, False if `timeout` expired
+        """
+        deadline = time() + timeout if timeout is not None else None
+        while not self.can_run():
+            remaining = self.idle_seconds - self.idle_time
+            # Quiet hours are checked every minute once idle
+            wait_time = remaining if remaining > 0 else 60
+            if deadline is not None:
+                wait_time = min(wait_time, deadline - time())
+                if wait_time <= 0:
+                    return False
+            sleep(wait_time)
+        return True
+
+    def start_work(self):
+        """
+        Mark the start of update work.
+        """
+        with self._lock:
+            self._working += 1
+
+    def end_work(self):
+        """
+        Mark the end of update work started with `start_work`.
+        """
+        with self._lock:
+            self._working = max(self._working - 1, 0)
+
+    @contextmanager
+    def work(self):
+        """
+        Context manager to mark update work while it runs.
+        """
+        self.start_work()
+        try:
+            yield
+        finally:
+            self.end_work()
+
+
+def get_device_id() -> str:
+    """
+    Get a stable identifier for this device, used to spread out scheduled
+    update checks across devices.
+    @return: systemd machine ID if available, else the MAC address
+    """
+    try:
+        with open("/etc/machine-id") as f:
+            device_id = f.read().strip()
+        if device_id:
+            return device_id
+    except OSError:
+        pass
+    return str(getnode())
+
+
+class CheckScheduler:
+    def __init__(self, device_id: str, interval: float, jitter: float = 0.1,
+                 retry_delay: float = 60):
+        """
+        Compute delays between periodic update checks. Delays are randomized
+        by a generator seeded with the device ID, so devices started at the
+        same time check at different times while each device's schedule is
+        reproducible. Failed checks are retried with exponential backoff, up to
+        `interval` between attempts.
+        @param device_id: unique identifier of this device
+        @param interval: seconds between successful checks
+        @param jitter: fraction of `interval` to randomly vary each delay by
+        @param retry_delay: seconds before the first retry of a failed check
+        """
+        self.interval = interval
+        self.jitter = jitter
+        self.retry_delay = retry_delay
+        self.failures = 0
+        self._random = Random(device_id)
+
+    def first_delay(self) -> float:
+        """
+        Get the delay before the first periodic check, a random point in the
+        first interval.
+        """
+        return self._random.uniform(0, self.interval)
+
+    def next_delay(self, success: bool) -> float:
+        """
+        Get the delay before the next check.
+        @param success: True if the last check succeeded
+        @return: seconds to wait before checking again
+        """
+        if success:
+            self.failures = 0
+            return self.interval * self._random.uniform(1 - self.jitter,
+                                                        1 + self.jitter)
+        self.failures += 1
+        backoff = min(self.interval,
+                      self.retry_delay * 2 ** (self.failures - 1))
+        return backoff / 2 + self._random.uniform(0, backoff / 2)
@@ -0,0 +1,125 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2025 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from enum import Enum
+from threading import Lock
+from time import time
+from typing import Iterable, List, Optional, Tuple
+
+from ovos_utils.log import LOG
+
+
+class UpdateState(str, Enum):
+    IDLE = "idle"
+    CHECKING = "checking"
+    CONFIRMED = "confirmed"
+    INITRAMFS = "initramfs"
+    SQUASHFS_DOWNLOADING = "squashfs_downloading"
+    REBOOT_PENDING = "reboot_pending"
+    FAILED = "failed"
+
+
+_TRANSITIONS = {
+    UpdateState.IDLE: {UpdateState.CHECKING},
+    UpdateState.CHECKING: {UpdateState.IDLE, UpdateState.CONFIRMED,
+                           UpdateState.FAILED},
+    UpdateState.CONFIRMED: {UpdateState.INITRAMFS,
+                            UpdateState.SQUASHFS_DOWNLOADING,
+                            UpdateState.IDLE, UpdateState.FAILED},
+    UpdateState.INITRAMFS: {UpdateState.SQUASHFS_DOWNLOADING,
+                            UpdateState.IDLE, UpdateState.FAILED},
+    UpdateState.SQUASHFS_DOWNLOADING: {UpdateState.REBOOT_PENDING,
+                                       UpdateState.FAILED},
+    UpdateState.REBOOT_PENDING: set(),
+    UpdateState.FAILED: {UpdateState.CHECKING, UpdateState.IDLE},
+}
+
+
+class UpdateStateMachine:
+    def __init__(self):
+        """
+        Thread-safe state of an OS update.
+        """
+        self._state = UpdateState.IDLE
+        self._lock = Lock()
+        self.history: List[Tuple[float, UpdateState]] = \
+            [(time(), self._state)]
+
+    @property
+    def state(self) -> UpdateState:
+        """
+        Get the current update state.
+        """
+        return self._state
+
+    @property
+    def busy(self) -> bool:
+        """
+        Returns True if an update is being checked for or is in progress.
+        """
+        return self._state not in (UpdateState.IDLE, UpdateState.FAILED)
+
+    def transition(self, new_state: UpdateState,
+                   expected: Optional[Iterable[UpdateState]] = None) -> bool:
+        """
+        Atomically move to a new state if the transition is valid.
+        @param new_state: state to move to
+        @param expected: if specified, only transition from one of these states
+        @return: True if the state was changed
+        """
+        with self._lock:
+            if expected is not None and self._state not in expected:
+                return False
+            if new_state not in _TRANSITIONS[self._state]:
+                LOG.warning(f"Invalid update state transition: "
+                            f"{self._state.value} -> {new_state.value}")
+                return False
+            self._set_state(new_state)
+            return True
+
+    def start_check(self) -> bool:
+        """
+        Atomically start checking for updates if no update is in progress.
+        @return: True if this caller may proceed with an update check
+        """
+        return self.transition(UpdateState.CHECKING,
+                               (UpdateState.IDLE, UpdateState.FAILED))
+
+    def reset(self, state: UpdateState = UpdateState.IDLE):
+        """
+        Force the update state, ignoring valid transitions.
+        @param state: state to set
+        """
+        with self._lock:
+            self._set_state(state)
+
+    def _set_state(self, state: UpdateState):
+        LOG.debug(f"Update state: {self._state.value} -> {state.value}")
+        self._state = state
+        self.history.append((time(), state))
+        self.history = self.history[-20:]